@@ -1,11 +1,34 @@
 from .chat import ChatBot
-from .shortcut import index_dbt_docs, memory_message, suggest_sql, suggest_table
+from .shortcut import (
+    aindex_dbt_docs,
+    amemory_message,
+    asuggest_sql,
+    asuggest_table,
+    index_dbt_docs,
+    memory_message,
+    reload_dbt_docs,
+    suggest_sql,
+    suggest_sql_many,
+    suggest_sql_stream,
+    suggest_table,
+    suggest_table_many,
+    suggest_table_stream,
+)
 
 
 __all__ = [
     "suggest_sql",
     "suggest_table",
+    "suggest_sql_stream",
+    "suggest_table_stream",
+    "suggest_sql_many",
+    "suggest_table_many",
     "memory_message",
     "index_dbt_docs",
+    "reload_dbt_docs",
+    "asuggest_sql",
+    "asuggest_table",
+    "amemory_message",
+    "aindex_dbt_docs",
     "ChatBot",
 ]
@@ -0,0 +1,13 @@
+"""asyncio helpers"""
+
+import asyncio
+import functools
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+async def run_sync(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking function in the default executor of the running loop"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
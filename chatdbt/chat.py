@@ -1,5 +1,27 @@
+import asyncio
+import atexit
+import glob
+import json
 import logging
-from typing import Optional, Set, List, Dict, cast, Any
+import os
+import pickle
+import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
 import uuid
 import datetime
 from chatdbt.model import (
@@ -14,16 +36,49 @@ from chatdbt.model import (
     TikTokenProvider,
     DBTModelDocument,
     DBTModelSqlDocument,
-    DBTDocMeta,
     CatalogColumn,
+    EmbeddingCache,
+    EmbeddingProvider,
+    MessageStore,
+    InstrumentationCallback,
+    ChatMessageStream,
+    AsyncChatMessageStream,
+    content_hash,
+    SearchResult,
 )
 from collections import defaultdict
 from chatdbt.openai import (
+    COMPLETION_MODEL,
     Openai,
+    price_for_completion,
     price_for_embedding,
     EMBEDDING_MODEL,
 )
+from chatdbt.aio import run_sync
 from chatdbt.i18n import get_i18n_text, I18nKey
+from chatdbt.context_packer import (
+    ContextPacker,
+    PackedContext,
+    DEFAULT_CONTEXT_MAX_TOKENS,
+    count_tokens,
+)
+from chatdbt.instrumentation.trace import Trace
+from chatdbt.lexical_index import BM25Index, LexicalHit
+from chatdbt.lru_cache import LRUCache
+from chatdbt.rate_limiter import RateLimiter
+from chatdbt.response_cache import CachedResponse, ResponseCache, messages_key
+from chatdbt.embedding_cache.memory import MemoryEmbeddingCache
+from chatdbt.embedding_cache.provider import CachedEmbeddingProvider
+from chatdbt.message_store.memory import MemoryMessageStore
+
+
+DEFAULT_INDEX_BATCH_SIZE = 100
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_MEMORY_FLUSH_INTERVAL_SECS = 60.0
+
+RETRIEVAL_MODES = ("vector", "hybrid")
+# damps the weight of the top ranks in reciprocal rank fusion
+RRF_RANK_CONSTANT = 60
 
 
 def _truncate_schema_name_for_model(name: str) -> str:
@@ -31,11 +86,63 @@ def _truncate_schema_name_for_model(name: str) -> str:
     return ".".join(name.split(".")[1:])
 
 
+# compact form of a model, as stored in snapshots:
+# (name, description, [(column name, data type, description)], depends_on, compiled sql)
+ModelRow = Tuple[
+    str,
+    Optional[str],
+    List[Tuple[str, Optional[str], Optional[str]]],
+    List[str],
+    Optional[str],
+]
+
+SNAPSHOT_VERSION = 1
+
+
+ModelDocs = Tuple[DBTModelDocument, Optional[DBTModelSqlDocument]]
+
+
+class DocChanges(NamedTuple):
+    """Names of the models added, changed and removed by a reload"""
+
+    added: List[str]
+    changed: List[str]
+    removed: List[str]
+
+
+def _model_row_checksum(row: ModelRow) -> str:
+    return content_hash(repr(row))
+
+
 class DocManager:
-    def __init__(self, dbt_doc_resolver: DBTDocResolver) -> None:
+    def __init__(
+        self,
+        dbt_doc_resolver: DBTDocResolver,
+        snapshot_dir: Optional[str] = None,
+        lazy: bool = False,
+        lazy_cache_size: int = 1024,
+    ) -> None:
+        """
+        :param snapshot_dir: directory to keep a snapshot of the built docs in,
+            loaded instead of rebuilding the docs while the dbt artifacts are unchanged
+        :param lazy: only index model names on startup, docs are built from the
+            resolver when first resolved; snapshots are not used in lazy mode
+        :param lazy_cache_size: number of models whose docs are kept in lazy mode
+        """
         self._dbt_doc_resolver = dbt_doc_resolver
+        self.snapshot_dir = snapshot_dir
+        self.lazy = str(lazy).lower() in ("true", "1")
         self._dbt_model_doc_store: Dict[str, DBTModelDocument] = {}
         self._dbt_model_sql_doc_store: Dict[str, DBTModelSqlDocument] = {}
+        # lazy mode: model name -> unique id, and the docs built so far
+        self._model_unique_ids: Dict[str, str] = {}
+        self._lazy_docs: LRUCache[ModelDocs] = LRUCache(int(lazy_cache_size))
+        # model name -> checksum of its row, to diff models on reload
+        self._model_checksums: Optional[Dict[str, str]] = None
+        self._reload_lock = threading.Lock()
+        # built on the first lexical search
+        self._lexical_index: Optional[BM25Index] = None
+        self._lexical_index_lock = threading.Lock()
 
         self._initialize_model_doc_store()
 
@@ -67,41 +174,291 @@ class DocManager:
         ]
         return catalog_columns
 
-    def _initialize_model_doc_store(self):
+    def _read_model_row(self, unique_id: str) -> Optional[ModelRow]:
+        """Read a model from the dbt doc resolver, None if it is not a model"""
+        model = self._dbt_doc_resolver.get_manifest_by_unique_id(unique_id)
+        if model is None or model["resource_type"] != "model":
+            return None
+        unique_id = model["unique_id"]
+        return (
+            _truncate_schema_name_for_model(unique_id),
+            model["description"],
+            [
+                (i.name, i.data_type, i.description)
+                for i in self._get_catalog_columns_for_unique_id(unique_id)
+            ],
+            [_truncate_schema_name_for_model(i) for i in model["depends_on"]["nodes"]],
+            model.get("compiled_code"),
+        )
+
+    def _read_model_unique_ids(self) -> Dict[str, str]:
+        return {
+            _truncate_schema_name_for_model(unique_id): unique_id
+            for unique_id in self._dbt_doc_resolver.list_model_unique_id()
+        }
+
+    def _read_model_rows(self) -> List[ModelRow]:
+        """Read every model from the dbt doc resolver"""
+        rows: List[ModelRow] = []
         for unique_id in self._dbt_doc_resolver.list_model_unique_id():
-            model = self._dbt_doc_resolver.get_manifest_by_unique_id(unique_id)
-            if model["resource_type"] == "model":
-                model_name = _truncate_schema_name_for_model(model["unique_id"])
-                unique_id = model["unique_id"]
-                catalog_columns = self._get_catalog_columns_for_unique_id(unique_id)
-
-                model_doc = DBTModelDocument(
-                    name=model_name,
-                    description=model["description"],
-                    columns=catalog_columns,
-                    depends_on=[
-                        _truncate_schema_name_for_model(i)
-                        for i in model["depends_on"]["nodes"]
-                    ],
-                    meta=DocMetaContainer(
-                        doc_type=DocType.MODEL, meta=DBTDocMeta(name=model_name)
-                    ),
+            row = self._read_model_row(unique_id)
+            if row is not None:
+                rows.append(row)
+        return rows
+
+    def _snapshot_prefix(self) -> str:
+        """Prefix of the snapshots of the resolver's source, shared by its versions"""
+        source_id = self._dbt_doc_resolver.get_source_id()
+        if source_id is None:
+            return "doc_store-"
+        return f"doc_store-{content_hash(source_id)[:16]}-"
+
+    def _snapshot_path(self) -> Optional[str]:
+        if not self.snapshot_dir:
+            return None
+        fingerprint = self._dbt_doc_resolver.get_fingerprint()
+        if fingerprint is None:
+            return None
+        return os.path.join(
+            self.snapshot_dir, f"{self._snapshot_prefix()}{fingerprint}.pickle"
+        )
+
+    def _load_snapshot(self, path: str) -> Optional[List[ModelRow]]:
+        try:
+            with open(path, "rb") as snapshot_f:
+                version, rows = pickle.load(snapshot_f)
+        except FileNotFoundError:
+            return None
+        except Exception:  # pylint: disable=broad-except
+            logging.warning("Ignoring unreadable doc snapshot %s", path, exc_info=True)
+            return None
+        if version != SNAPSHOT_VERSION:
+            return None
+        logging.debug("loaded %s models from snapshot %s", len(rows), path)
+        return rows
+
+    def _save_snapshot(self, path: str, rows: List[ModelRow]):
+        """Write the snapshot atomically and remove snapshots of older artifacts
+
+        Only snapshots of the same source are removed, so several projects may
+        share `snapshot_dir`. Snapshots only speed up later startups, so failing
+        to save one is logged.
+        """
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # unique per writer, workers sharing `snapshot_dir` may save at once
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(path), prefix=os.path.basename(path), suffix=".tmp"
+            )
+            try:
+                with os.fdopen(fd, "wb") as snapshot_f:
+                    pickle.dump(
+                        (SNAPSHOT_VERSION, rows),
+                        snapshot_f,
+                        protocol=pickle.HIGHEST_PROTOCOL,
+                    )
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            if self._dbt_doc_resolver.get_source_id() is None:
+                return
+            for stale_path in glob.glob(
+                os.path.join(
+                    glob.escape(self.snapshot_dir or ""),
+                    f"{self._snapshot_prefix()}*.pickle",
+                )
+            ):
+                if stale_path != path:
+                    try:
+                        os.remove(stale_path)
+                    except FileNotFoundError:
+                        pass  # removed by another worker
+        except Exception:  # pylint: disable=broad-except
+            logging.warning("Failed to save doc snapshot %s", path, exc_info=True)
+
+    def _build_model_docs(self, row: ModelRow) -> ModelDocs:
+        """Build the docs of a model, skipping validation as rows are trusted"""
+        name, description, columns, depends_on, compiled_sql = row
+        model_doc = DBTModelDocument.construct(
+            name=name,
+            description=description,
+            columns=[
+                CatalogColumn.construct(
+                    name=column_name,
+                    data_type=data_type,
+                    description=column_description,
+                )
+                for column_name, data_type, column_description in columns
+            ],
+            depends_on=depends_on,
+            meta=DocMetaContainer.construct(
+                doc_type=DocType.MODEL, meta={"name": name}
+            ),
+        )
+        model_sql_doc = None
+        if compiled_sql is not None:
+            model_sql_doc = DBTModelSqlDocument.construct(
+                doc=model_doc,
+                compiled_sql=compiled_sql,
+                meta=DocMetaContainer.construct(
+                    doc_type=DocType.MODEL, meta={"name": name}
+                ),
+            )
+        return model_doc, model_sql_doc
+
+    def _doc_store_rows(self) -> List[ModelRow]:
+        """Rows of the built docs, as read from the resolver"""
+        rows: List[ModelRow] = []
+        for name, model_doc in self._dbt_model_doc_store.items():
+            model_sql_doc = self._dbt_model_sql_doc_store.get(name)
+            rows.append(
+                (
+                    name,
+                    model_doc.description,
+                    [(i.name, i.data_type, i.description) for i in model_doc.columns],
+                    model_doc.depends_on,
+                    model_sql_doc.compiled_sql if model_sql_doc else None,
+                )
+            )
+        return rows
+
+    def _add_model_row(self, row: ModelRow):
+        model_doc, model_sql_doc = self._build_model_docs(row)
+        self._dbt_model_doc_store[model_doc.name] = model_doc
+        if model_sql_doc is not None:
+            self._dbt_model_sql_doc_store[model_doc.name] = model_sql_doc
+
+    def _initialize_model_doc_store(self):
+        if self.lazy:
+            self._model_unique_ids = self._read_model_unique_ids()
+            return
+        snapshot_path = self._snapshot_path()
+        rows = self._load_snapshot(snapshot_path) if snapshot_path else None
+        if rows is None:
+            rows = self._read_model_rows()
+            if snapshot_path:
+                self._save_snapshot(snapshot_path, rows)
+        for row in rows:
+            self._add_model_row(row)
+
+    def reload(self) -> DocChanges:
+        """Reload the docs if the dbt artifacts changed
+
+        Models are compared by the checksum of their name, description, columns,
+        dependencies and compiled SQL, and only added or changed models are
+        rebuilt. The new docs are swapped in once built, queries resolve the old
+        docs meanwhile. The first reload checksums the docs loaded before, read
+        from the resolver in lazy mode.
+        """
+        with self._reload_lock:
+            old_checksums = self._model_checksums
+            if old_checksums is None:
+                old_rows = (
+                    self._read_model_rows() if self.lazy else self._doc_store_rows()
                 )
-                self._dbt_model_doc_store[model_name] = model_doc
-
-                if "compiled_code" in model:
-                    model_sql_doc = DBTModelSqlDocument(
-                        doc=model_doc,
-                        compiled_sql=model["compiled_code"],
-                        meta=DocMetaContainer(
-                            doc_type=DocType.MODEL, meta=DBTDocMeta(name=model_name)
-                        ),
+                old_checksums = {row[0]: _model_row_checksum(row) for row in old_rows}
+            if not self._dbt_doc_resolver.reload():
+                self._model_checksums = old_checksums
+                return DocChanges(added=[], changed=[], removed=[])
+
+            rows = {row[0]: row for row in self._read_model_rows()}
+            checksums = {name: _model_row_checksum(row) for name, row in rows.items()}
+            changes = DocChanges(
+                added=[name for name in checksums if name not in old_checksums],
+                changed=[
+                    name
+                    for name, checksum in checksums.items()
+                    if name in old_checksums and old_checksums[name] != checksum
+                ],
+                removed=[name for name in old_checksums if name not in checksums],
+            )
+            if self.lazy:
+                self._model_unique_ids = self._read_model_unique_ids()
+                for name in changes.changed + changes.removed:
+                    self._lazy_docs.pop(name)
+            else:
+                model_docs = dict(self._dbt_model_doc_store)
+                model_sql_docs = dict(self._dbt_model_sql_doc_store)
+                for name in changes.changed + changes.removed:
+                    model_docs.pop(name, None)
+                    model_sql_docs.pop(name, None)
+                for name in changes.added + changes.changed:
+                    model_doc, model_sql_doc = self._build_model_docs(rows[name])
+                    model_docs[name] = model_doc
+                    if model_sql_doc is not None:
+                        model_sql_docs[name] = model_sql_doc
+                self._dbt_model_doc_store, self._dbt_model_sql_doc_store = (
+                    model_docs,
+                    model_sql_docs,
+                )
+            if self._lexical_index is not None:
+                self._lexical_index = self._build_lexical_index(list(rows.values()))
+            self._model_checksums = checksums
+            logging.info(
+                "reloaded dbt docs: %s added, %s changed, %s removed",
+                len(changes.added),
+                len(changes.changed),
+                len(changes.removed),
+            )
+            return changes
+
+    @staticmethod
+    def _build_lexical_index(rows: List[ModelRow]) -> BM25Index:
+        index = BM25Index()
+        for name, description, columns, _, _ in rows:
+            index.add(name, description, [column[0] for column in columns])
+        logging.debug("built lexical index of %s models", len(index))
+        return index
+
+    def _get_lexical_index(self) -> BM25Index:
+        with self._lexical_index_lock:
+            if self._lexical_index is None:
+                if self.lazy:
+                    self._lexical_index = self._build_lexical_index(
+                        self._read_model_rows()
                     )
-                    self._dbt_model_sql_doc_store[model_name] = model_sql_doc
+                else:
+                    self._lexical_index = BM25Index()
+                    for doc in self._dbt_model_doc_store.values():
+                        self._lexical_index.add(
+                            doc.name, doc.description, [i.name for i in doc.columns]
+                        )
+            return self._lexical_index
+
+    def lexical_search(self, query: str, k: int) -> List[LexicalHit]:
+        """Search models by name, description and column names with BM25
+
+        The index is built on the first search, and rebuilt by `reload`.
+        """
+        return self._get_lexical_index().search(query, k)
+
+    def _lazy_model_docs(self, name: str) -> ModelDocs:
+        """Get the docs of a model in lazy mode, building them on first access"""
+        docs = self._lazy_docs.get(name)
+        if docs is None:
+            row = self._read_model_row(self._model_unique_ids[name])
+            if row is None:
+                raise KeyError(name)
+            docs = self._build_model_docs(row)
+            self._lazy_docs.put(name, docs)
+        return docs
+
+    def get_docs(self, names: List[str]) -> List[Doc]:
+        """Get the DBT docs of models by name"""
+        return [
+            self._resolve_dbt_doc_meta(
+                DocMetaContainer(doc_type=DocType.MODEL, meta={"name": name})
+            )
+            for name in names
+        ]
 
     def get_all_docs(self) -> List[Doc]:
         """Get all DBT docs"""
         logging.debug("Getting all DBT docs")
+        if self.lazy:
+            # built for indexing and dropped afterwards, not worth caching
+            return [self._build_model_docs(row)[0] for row in self._read_model_rows()]
         return [
             *self._dbt_model_doc_store.values(),
         ]
@@ -109,6 +466,13 @@ class DocManager:
     def _resolve_dbt_doc_meta(self, container: DocMetaContainer) -> Doc:
         """Resolve a DBT doc meta"""
         model_meta = container.meta
+        if self.lazy and container.doc_type in [DocType.MODEL, DocType.SQL]:
+            model_doc, model_sql_doc = self._lazy_model_docs(model_meta["name"])
+            if container.doc_type == DocType.MODEL:
+                return model_doc
+            if model_sql_doc is None:
+                raise KeyError(model_meta["name"])
+            return model_sql_doc
         if container.doc_type == DocType.MODEL:
             return self._dbt_model_doc_store[model_meta["name"]]
         elif container.doc_type == DocType.SQL:
@@ -137,6 +501,64 @@ class DocManager:
             raise NotImplementedError
 
 
+def _flush_memory_at_exit(chat_bot_ref: "weakref.ref[ChatBot]"):
+    chat_bot = chat_bot_ref()
+    if chat_bot is None:
+        return
+    try:
+        chat_bot.flush_memory()
+    except Exception:  # pylint: disable=broad-except
+        logging.exception("Failed to flush memorized messages")
+
+
+def _fuse_hits(
+    vector_metas: List[DocMetaContainer], lexical_hits: List[LexicalHit], k: int
+) -> List[DocMetaContainer]:
+    """Merge vector and lexical hits by reciprocal rank fusion
+
+    Models named in the query come first, whatever their vector rank.
+    """
+    if not lexical_hits:
+        return vector_metas[:k]
+    metas: Dict[str, DocMetaContainer] = {}
+    scores: Dict[str, float] = defaultdict(float)
+    named: Set[str] = set()
+
+    def _add(meta: DocMetaContainer, rank: int) -> str:
+        key = json.dumps([meta.doc_type.value, meta.meta], sort_keys=True, default=str)
+        metas.setdefault(key, meta)
+        scores[key] += 1 / (RRF_RANK_CONSTANT + rank + 1)
+        return key
+
+    for rank, meta in enumerate(vector_metas):
+        _add(meta, rank)
+    for rank, hit in enumerate(lexical_hits):
+        key = _add(
+            DocMetaContainer(doc_type=DocType.MODEL, meta={"name": hit.name}), rank
+        )
+        if hit.exact:
+            named.add(key)
+    ranked = sorted(scores, key=lambda key: (key not in named, -scores[key]))
+    return [metas[key] for key in ranked[:k]]
+
+
+class _Suggestion(NamedTuple):
+    """A query ready for completion, `messages` is None without related dbt docs
+
+    `context_key` identifies the prompt without the query, it keys the semantic
+    tier of the response cache.
+    """
+
+    query: str
+    vector: List[float]
+    messages: Optional[List[Dict[str, str]]]
+    context_key: Optional[str]
+    dbt_docs: List[Doc]
+    chat_docs: List[ChatConversationDocument]
+    packed: PackedContext
+    trace: Trace
+
+
 class ChatBot:
     """Chatbot for dbt documentation"""
 
@@ -147,32 +569,250 @@ class ChatBot:
         tiktoken_provider: Optional[TikTokenProvider],
         openai_config: Optional[Dict[str, Any]] = None,
         i18n: str = "en",
+        embedding_cache: Optional[EmbeddingCache] = None,
+        query_embedding_cache_config: Optional[Dict[str, Any]] = None,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        min_similarity: Optional[float] = None,
+        doc_manager_config: Optional[Dict[str, Any]] = None,
+        context_max_tokens: int = DEFAULT_CONTEXT_MAX_TOKENS,
+        response_cache_config: Optional[Dict[str, Any]] = None,
+        message_store: Optional[MessageStore] = None,
+        retrieval_mode: str = "vector",
+        lexical_skip_embedding: bool = False,
+        callbacks: Optional[List[InstrumentationCallback]] = None,
+        memory_flush_interval_secs: float = DEFAULT_MEMORY_FLUSH_INTERVAL_SECS,
     ) -> None:
-        self.doc_manager = DocManager(doc_resolver)
+        """
+        :param min_similarity: drop search hits less similar to the query, so
+            unrelated tables never reach the prompt
+        :param doc_manager_config: keyword arguments of `DocManager`
+        :param context_max_tokens: token budget of the docs in a prompt, docs
+            are trimmed or dropped to fit in
+        :param response_cache_config: keyword arguments of `ResponseCache`,
+            responses are not cached without it
+        :param message_store: where messages are kept for `memory_message_by_uuid`,
+            the last 1024 messages are kept in memory by default
+        :param retrieval_mode: `vector`, or `hybrid` to merge the vector search
+            with a lexical search of model names, descriptions and column names
+        :param lexical_skip_embedding: in `hybrid` mode, retrieve the docs of
+            queries naming a model lexically, without embedding the query
+        :param callbacks: notified of the timed stages of every suggestion
+        :param memory_flush_interval_secs: memorized messages are flushed to the
+            vector storage at most this often, and when the process exits
+        """
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {retrieval_mode}")
+        self.doc_manager = DocManager(doc_resolver, **(doc_manager_config or {}))
         self.vector_storage = vector_storage
         self.tiktoken_provider = tiktoken_provider
         self.openai = Openai(**(openai_config or {}))
+        self.embedding_provider: EmbeddingProvider = self.openai
+        if embedding_cache is not None:
+            self.embedding_provider = CachedEmbeddingProvider(
+                self.openai, embedding_cache
+            )
+        # queries are often repeated, keep their embeddings in memory only
+        self.query_embedding_provider = CachedEmbeddingProvider(
+            self.openai,
+            MemoryEmbeddingCache(**(query_embedding_cache_config or {})),
+        )
         self._i18n = i18n
-        self._messages: List[ChatMessage] = []
+        self.message_store: MessageStore = message_store or MemoryMessageStore()
+        self.retrieval_mode = retrieval_mode
+        self.callbacks: List[InstrumentationCallback] = list(callbacks or [])
+        self.lexical_skip_embedding = str(lexical_skip_embedding).lower() in (
+            "true",
+            "1",
+        )
+        # bounds in-flight calls of the async api, one semaphore per event loop
+        self.max_concurrency = int(max_concurrency)
+        self._async_semaphores: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self.min_similarity = (
+            float(min_similarity) if min_similarity is not None else None
+        )
+        self.context_packer = ContextPacker(tiktoken_provider, context_max_tokens)
+        self.response_cache = (
+            ResponseCache(**response_cache_config)
+            if response_cache_config is not None
+            else None
+        )
+        self.memory_flush_interval_secs = float(memory_flush_interval_secs)
+        self._memory_flush_lock = threading.Lock()
+        self._memory_flushed_at = time.monotonic()
+        self._memory_unflushed = False
+        atexit.register(_flush_memory_at_exit, weakref.ref(self))
+
+    def _changed_docs(self, docs: List[Doc]) -> List[Doc]:
+        """Drop stale dbt docs from the vector storage and return new or changed docs"""
+        stored_hashes = self.vector_storage.list_content_hashes(
+            [DocType.MODEL, DocType.SQL]
+        )
+        unique_ids = {doc.get_unique_id() for doc in docs}
+        removed = [i for i in stored_hashes if i not in unique_ids]
+        if removed:
+            logging.debug("removing docs: %s", removed)
+            self.vector_storage.delete_docs(removed)
 
-    def index_dbt_docs(self):
-        """Index all dbt docs"""
+        changed = [
+            doc
+            for doc in docs
+            if stored_hashes.get(doc.get_unique_id()) != doc.get_content_hash()
+        ]
+        logging.info(
+            "incremental index: %s new or changed, %s removed, %s unchanged",
+            len(changed),
+            len(removed),
+            len(docs) - len(changed),
+        )
+        return changed
 
+    def _count_doc_tokens(self, docs: List[Doc]) -> List[int]:
+        """Count the embedding tokens of every doc
+
+        Counts come from the tiktoken provider when there is one, and are
+        estimated from the content length otherwise.
+        """
+        counts = count_tokens(
+            self.tiktoken_provider,
+            [doc.get_content() for doc in docs],
+            EMBEDDING_MODEL,
+        )
         if self.tiktoken_provider:
-            n_tokens = 0
-            for doc in self.doc_manager.get_all_docs():
-                n_tokens += self.tiktoken_provider.count_token(
-                    doc.get_content(), EMBEDDING_MODEL
-                )
             logging.info(
                 "index dbt docs total tokens: %s, cost %s$",
-                n_tokens,
-                price_for_embedding(n_tokens),
+                sum(counts),
+                price_for_embedding(sum(counts)),
+            )
+        return counts
+
+    def _index_batches(
+        self, docs: List[Doc], batch_size: int
+    ) -> List[Tuple[List[Doc], int]]:
+        """Split docs into batches, along with the number of tokens of each batch"""
+        token_counts = self._count_doc_tokens(docs)
+        return [
+            (
+                docs[start : start + batch_size],
+                sum(token_counts[start : start + batch_size]),
+            )
+            for start in range(0, len(docs), batch_size)
+        ]
+
+    def index_dbt_docs(
+        self,
+        batch_size: int = DEFAULT_INDEX_BATCH_SIZE,
+        incremental: bool = False,
+        workers: int = 1,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+    ):
+        """Index all dbt docs
+
+        Docs are embedded and written to the vector storage `batch_size` at a time.
+        With `incremental`, only new or changed docs are embedded, and docs of
+        models which no longer exist are removed from the vector storage.
+
+        Batches are embedded by `workers` threads, paced to stay within
+        `requests_per_minute` embedding requests and `tokens_per_minute` tokens.
+        """
+        docs = self.doc_manager.get_all_docs()
+        if incremental:
+            docs = self._changed_docs(docs)
+        self._index_docs(
+            docs, batch_size, workers, requests_per_minute, tokens_per_minute
+        )
+
+    def _index_docs(
+        self,
+        docs: List[Doc],
+        batch_size: int = DEFAULT_INDEX_BATCH_SIZE,
+        workers: int = 1,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+    ):
+        batch_size = max(1, int(batch_size))
+        rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        # vector storages are not required to be thread-safe
+        insert_lock = threading.Lock()
+
+        def _index_batch(batch: List[Doc], n_tokens: int) -> int:
+            rate_limiter.acquire(n_tokens)
+            logging.debug("indexing docs: %s", batch)
+            vectors = self.embedding_provider.embed_many(
+                [doc.get_content() for doc in batch]
+            )
+            with insert_lock:
+                self.vector_storage.insert_docs(batch, vectors)
+            return len(batch)
+
+        with ThreadPoolExecutor(max_workers=max(1, int(workers))) as executor:
+            futures = [
+                executor.submit(_index_batch, batch, n_tokens)
+                for batch, n_tokens in self._index_batches(docs, batch_size)
+            ]
+            n_indexed = 0
+            try:
+                for future in as_completed(futures):
+                    n_indexed += future.result()
+                    logging.info("indexed dbt docs: %s/%s", n_indexed, len(docs))
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        self.vector_storage.flush()
+
+    def reload_dbt_docs(
+        self,
+        reindex: bool = False,
+        batch_size: int = DEFAULT_INDEX_BATCH_SIZE,
+        workers: int = 1,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+    ) -> DocChanges:
+        """Reload dbt docs if the dbt artifacts changed, queries are served meanwhile
+
+        Docs of removed models, and remembered chats referring to them, are
+        removed from the vector storage. With `reindex`, the docs of added and
+        changed models are embedded.
+        """
+        changes = self.doc_manager.reload()
+        if self.response_cache is not None:
+            self.response_cache.invalidate(changes.changed + changes.removed)
+        self._delete_removed_docs(changes.removed)
+        if reindex:
+            docs = self.doc_manager.get_docs(changes.added + changes.changed)
+            self._index_docs(
+                docs, batch_size, workers, requests_per_minute, tokens_per_minute
+            )
+        return changes
+
+    def _delete_removed_docs(self, removed: List[str]):
+        """Delete the docs of removed models, and the chat docs referring to them"""
+        if not removed:
+            return
+        stale = set(removed)
+        unique_ids = [i for name in removed for i in (name, f"{name}_sql")]
+        try:
+            chat_metas = self.vector_storage.list_metas([DocType.CHAT])
+            for unique_id, container in chat_metas.items():
+                meta = ChatMessageMeta.parse_obj(container.meta)
+                if any(
+                    i.meta.get("name") in stale
+                    for i in meta.ref_dbt_docs_meta_containers
+                ):
+                    unique_ids.append(unique_id)
+        except NotImplementedError:
+            logging.debug("cannot list chat docs of removed models", exc_info=True)
+        try:
+            self.vector_storage.delete_docs(unique_ids)
+            self.vector_storage.flush()
+        except NotImplementedError:
+            # searches skip the docs of removed models
+            logging.warning(
+                "%s cannot delete docs of removed models: %s",
+                self.vector_storage.__class__.__name__,
+                removed,
             )
-        for doc in self.doc_manager.get_all_docs():
-            logging.debug("indexing doc: %s", doc)
-            vector = self.openai.embed(doc.get_content())
-            self.vector_storage.insert_doc(doc, vector)
 
     def _unique_docs(self, docs: List[Doc]) -> List[Doc]:
         """Remove duplicate docs"""
@@ -184,12 +824,19 @@ class ChatBot:
                 visited.add(doc.get_unique_id())
         return res
 
-    def suggest_table(self, query: str, k: int = 5) -> ChatMessage:
-        """Suggest table for query"""
-        vector = self.openai.embed(query)
-        logging.debug("embedding query: %s, %s", query, vector[:5])
-        similar_docs_meta = self.vector_storage.similarity_search(vector, k)
-        docs = [self.doc_manager.resolve_doc_meta(meta) for meta in similar_docs_meta]
+    def _resolve_similar_docs(
+        self, query: str, similar_docs_meta: List[DocMetaContainer]
+    ) -> Tuple[List[Doc], List[Doc], List[ChatConversationDocument]]:
+        """Resolve search results into all, dbt and chat docs
+
+        Docs of models which no longer exist are skipped.
+        """
+        docs = []
+        for meta in similar_docs_meta:
+            try:
+                docs.append(self.doc_manager.resolve_doc_meta(meta))
+            except KeyError as ex:
+                logging.warning("Skipping doc of unknown model %s: %s", ex, meta)
         logging.debug("similar docs: %s, %s", query, docs)
         dbt_docs = [
             doc
@@ -201,20 +848,32 @@ class ChatBot:
             for doc in docs
             if doc.get_metadata().doc_type == DocType.CHAT
         ]
-        dbt_model_names = [doc.get_metadata().meta["name"] for doc in dbt_docs]
+        return docs, dbt_docs, chat_docs
 
-        if not dbt_docs:
-            message = ChatMessage(
-                uuid=uuid.uuid4().hex,
-                created_at=datetime.datetime.now(),
-                query=query,
-                response=get_i18n_text(I18nKey.KEY_NO_RESPONSE),
-                ref_dbt_docs=dbt_docs,
-                ref_chat_docs=chat_docs,
-            )
-            self._messages.append(message)
-            return message
+    def _pack_docs(
+        self,
+        docs: List[Doc],
+        dbt_docs: List[Doc],
+        chat_docs: List[ChatConversationDocument],
+    ) -> Tuple[PackedContext, List[Doc], List[ChatConversationDocument]]:
+        """Fit docs into the context token budget, return the kept dbt and chat docs"""
+        packed = self.context_packer.pack(docs)
+        kept = {id(doc) for doc in packed.docs}
+        return (
+            packed,
+            [doc for doc in dbt_docs if id(doc) in kept],
+            [doc for doc in chat_docs if id(doc) in kept],
+        )
 
+    def _build_messages(
+        self,
+        query: str,
+        contents: List[str],
+        dbt_docs: List[Doc],
+        user_prompt_key: I18nKey,
+    ) -> List[Dict[str, str]]:
+        """Build the chat completion messages for a query"""
+        dbt_model_names = [doc.get_metadata().meta["name"] for doc in dbt_docs]
         messages = []
         messages.append(
             {
@@ -223,7 +882,7 @@ class ChatBot:
             }
         )
         if dbt_docs:
-            _content = "\n".join([doc.get_content() for doc in docs])
+            _content = "\n".join(contents)
             messages.append(
                 {
                     "role": "system",
@@ -236,12 +895,25 @@ class ChatBot:
         messages.append(
             {
                 "role": "user",
-                "content": get_i18n_text(
-                    I18nKey.KEY_PROMPT_USER_ROLE_SUGGEST_TABLES
-                ).format(",".join(dbt_model_names), query),
+                "content": get_i18n_text(user_prompt_key).format(
+                    ",".join(dbt_model_names), query
+                ),
             }
         )
-        response = self.openai.chat_completion(messages=messages)
+        logging.debug("messages: %s", messages)
+        return messages
+
+    def _new_message(
+        self,
+        query: str,
+        response: str,
+        dbt_docs: List[Doc],
+        chat_docs: List[ChatConversationDocument],
+        packed: Optional[PackedContext] = None,
+        usage: Optional[Dict[str, int]] = None,
+        cache_hit: Optional[str] = None,
+        trace: Optional[Trace] = None,
+    ) -> ChatMessage:
         message = ChatMessage(
             uuid=uuid.uuid4().hex,
             created_at=datetime.datetime.now(),
@@ -249,97 +921,346 @@ class ChatBot:
             response=response,
             ref_dbt_docs=dbt_docs,
             ref_chat_docs=chat_docs,
+            context_tokens=packed.n_tokens if packed else None,
+            dropped_docs=packed.dropped_docs if packed else [],
+            usage=usage,
+            cache_hit=cache_hit,
+            timings=trace.timings() if trace else {},
+            cost=price_for_completion(usage["total_tokens"]) if usage else None,
         )
-        self._messages.append(message)
+        self.message_store.put(message)
         return message
 
-    def suggest_sql(self, query: str, k: int = 10) -> ChatMessage:
-        """Suggest sql for query"""
-        vector = self.openai.embed(query)
-        logging.debug("embedding query: %s, %s", query, vector[:5])
-        similar_docs_meta = self.vector_storage.similarity_search(vector, k)
-        docs = [self.doc_manager.resolve_doc_meta(meta) for meta in similar_docs_meta]
-        logging.debug("similar docs: %s, %s", query, docs)
-        dbt_docs = [
-            doc
-            for doc in docs
-            if doc.get_metadata().doc_type in [DocType.MODEL, DocType.SQL]
+    def _lexical_hits(
+        self, queries: List[str], k: int, trace: Trace
+    ) -> List[List[LexicalHit]]:
+        if self.retrieval_mode != "hybrid":
+            return [[] for _ in queries]
+        with trace.span("lexical_search", BM25Index.__name__, n_queries=len(queries)):
+            return [self.doc_manager.lexical_search(query, k) for query in queries]
+
+    def _embedded_queries(self, lexical_hits: List[List[LexicalHit]]) -> List[int]:
+        """Indices of the queries to embed, queries naming a model may skip it"""
+        return [
+            idx
+            for idx, hits in enumerate(lexical_hits)
+            if not (self.lexical_skip_embedding and any(i.unambiguous for i in hits))
         ]
-        chat_docs = [
-            cast(ChatConversationDocument, doc)
-            for doc in docs
-            if doc.get_metadata().doc_type == DocType.CHAT
+
+    def _fuse_retrievals(
+        self,
+        n_queries: int,
+        k: int,
+        lexical_hits: List[List[LexicalHit]],
+        embedded: List[int],
+        vectors: List[List[float]],
+        results: List[List[SearchResult]],
+    ) -> List[Tuple[List[float], List[DocMetaContainer]]]:
+        """Query vectors, empty when not embedded, and the docs retrieved by every query"""
+        query_vectors: List[List[float]] = [[] for _ in range(n_queries)]
+        vector_metas: List[List[DocMetaContainer]] = [[] for _ in range(n_queries)]
+        for idx, vector, hits in zip(embedded, vectors, results):
+            query_vectors[idx] = vector
+            vector_metas[idx] = [i.meta for i in hits]
+        return [
+            (query_vectors[idx], _fuse_hits(vector_metas[idx], lexical_hits[idx], k))
+            for idx in range(n_queries)
         ]
-        dbt_model_names = [doc.get_metadata().meta["name"] for doc in dbt_docs]
 
-        if not dbt_docs:
-            message = ChatMessage(
-                uuid=uuid.uuid4().hex,
-                created_at=datetime.datetime.now(),
-                query=query,
-                response=get_i18n_text(I18nKey.KEY_NO_RESPONSE),
-                ref_dbt_docs=dbt_docs,
-                ref_chat_docs=chat_docs,
+    def _retrieve_many(
+        self, queries: List[str], k: int, trace: Trace
+    ) -> List[Tuple[List[float], List[DocMetaContainer]]]:
+        """Retrieve the docs of every query, embedding and searching queries at once"""
+        lexical_hits = self._lexical_hits(queries, k, trace)
+        embedded = self._embedded_queries(lexical_hits)
+        vectors: List[List[float]] = []
+        results: List[List[SearchResult]] = []
+        if embedded:
+            # repeated queries are served from the query embedding cache
+            provider = self.query_embedding_provider
+            with trace.span(
+                "embed", self.openai, n_queries=len(embedded)
+            ) as attributes:
+                vectors, attributes["cache_hits"] = provider.embed_many_with_hits(
+                    [queries[idx] for idx in embedded]
+                )
+            with trace.span("search", self.vector_storage, n_queries=len(embedded)):
+                results = self.vector_storage.search_many(
+                    vectors, k, min_similarity=self.min_similarity
+                )
+        return self._fuse_retrievals(
+            len(queries), k, lexical_hits, embedded, vectors, results
+        )
+
+    def _prepare_suggestion(
+        self, query: str, k: int, user_prompt_key: I18nKey
+    ) -> _Suggestion:
+        trace = Trace(self.callbacks)
+        vector, similar_docs_meta = self._retrieve_many([query], k, trace)[0]
+        logging.debug("embedding query: %s, %s", query, vector[:5])
+        return self._suggestion_for(
+            query, vector, similar_docs_meta, user_prompt_key, trace
+        )
+
+    def _suggestion_for(
+        self,
+        query: str,
+        vector: List[float],
+        similar_docs_meta: List[DocMetaContainer],
+        user_prompt_key: I18nKey,
+        trace: Trace,
+    ) -> _Suggestion:
+        with trace.span("resolve", self.doc_manager, n_docs=len(similar_docs_meta)):
+            docs, dbt_docs, chat_docs = self._resolve_similar_docs(
+                query, similar_docs_meta
+            )
+        with trace.span("prompt", self.context_packer) as attributes:
+            packed, dbt_docs, chat_docs = self._pack_docs(docs, dbt_docs, chat_docs)
+            attributes.update(n_docs=len(packed.docs), tokens=packed.n_tokens)
+            if not dbt_docs:
+                return _Suggestion(
+                    query, vector, None, None, dbt_docs, chat_docs, packed, trace
+                )
+            messages = self._build_messages(
+                query, packed.contents, dbt_docs, user_prompt_key
+            )
+            # the prompt template stands in for the user message, which has the query
+            context_key = messages_key(
+                messages[:-1]
+                + [{"role": "user", "content": get_i18n_text(user_prompt_key)}]
             )
-            self._messages.append(message)
-            return message
+        return _Suggestion(
+            query, vector, messages, context_key, dbt_docs, chat_docs, packed, trace
+        )
 
-        messages = []
-        messages.append(
-            {
-                "role": "system",
-                "content": get_i18n_text(I18nKey.KEY_PROMPT_SYSTEM_ROLE_CONTENT),
-            }
+    @staticmethod
+    def _completion_attributes(usage: Dict[str, int]) -> Dict[str, Any]:
+        return dict(
+            tokens=usage["total_tokens"],
+            cost=price_for_completion(usage["total_tokens"]),
         )
-        if dbt_docs:
-            _content = "\n".join([doc.get_content() for doc in docs])
-            messages.append(
-                {
-                    "role": "system",
-                    "content": get_i18n_text(
-                        I18nKey.KEY_PROMPT_SYSTEM_ROLE_RELATED_TABLES
-                    ).format(_content),
-                }
+
+    def _record_completion(
+        self, suggestion: _Suggestion, start: float, usage: Dict[str, int]
+    ):
+        """Record the completion span of a streamed suggestion, started at `start`"""
+        suggestion.trace.record(
+            "completion",
+            self.openai,
+            time.perf_counter() - start,
+            self._completion_attributes(usage),
+        )
+
+    def _cached_suggestion(self, suggestion: _Suggestion) -> Optional[ChatMessage]:
+        """Finish a suggestion with a cached response, if there is one"""
+        if (
+            self.response_cache is None
+            or suggestion.messages is None
+            or suggestion.context_key is None
+        ):
+            return None
+        hit = self.response_cache.get(
+            suggestion.messages, suggestion.context_key, suggestion.vector
+        )
+        if hit is None:
+            return None
+        cached, tier = hit
+        logging.info("chat-completion %s cache hit: %s", tier, suggestion.query)
+        return self._finish_suggestion(suggestion, cached.response, cache_hit=tier)
+
+    def _cache_suggestion(self, suggestion: _Suggestion, response: str):
+        if (
+            self.response_cache is None
+            or suggestion.messages is None
+            or suggestion.context_key is None
+        ):
+            return
+        doc_ids = frozenset(
+            doc.get_unique_id() for doc in suggestion.dbt_docs + suggestion.chat_docs
+        )
+        self.response_cache.put(
+            suggestion.messages,
+            suggestion.context_key,
+            suggestion.vector,
+            CachedResponse(response, doc_ids),
+        )
+
+    def _finish_suggestion(
+        self,
+        suggestion: _Suggestion,
+        response: str,
+        usage: Optional[Dict[str, int]] = None,
+        cache_hit: Optional[str] = None,
+    ) -> ChatMessage:
+        return self._new_message(
+            suggestion.query,
+            response,
+            suggestion.dbt_docs,
+            suggestion.chat_docs,
+            suggestion.packed,
+            usage,
+            cache_hit,
+            suggestion.trace,
+        )
+
+    def _completion_usage(
+        self, messages: List[Dict[str, str]], response: str
+    ) -> Dict[str, int]:
+        """Count the tokens of a streamed completion, streams do not report usage"""
+        counts = count_tokens(
+            self.tiktoken_provider,
+            [message["content"] for message in messages] + [response],
+            COMPLETION_MODEL,
+        )
+        # every message is wrapped in 3 tokens, and the reply primed with 3 more
+        prompt_tokens = sum(counts[:-1]) + 3 * len(messages) + 3
+        usage = dict(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=counts[-1],
+            total_tokens=prompt_tokens + counts[-1],
+        )
+        logging.info(
+            "chat-completion total tokens: %s, cost %s$",
+            usage["total_tokens"],
+            price_for_completion(usage["total_tokens"]),
+        )
+        return usage
+
+    def _suggest(self, query: str, k: int, user_prompt_key: I18nKey) -> ChatMessage:
+        return self._complete_suggestion(
+            self._prepare_suggestion(query, k, user_prompt_key)
+        )
+
+    def _complete_suggestion(self, suggestion: _Suggestion) -> ChatMessage:
+        if suggestion.messages is None:
+            return self._finish_suggestion(
+                suggestion, get_i18n_text(I18nKey.KEY_NO_RESPONSE)
+            )
+        cached = self._cached_suggestion(suggestion)
+        if cached is not None:
+            return cached
+        with suggestion.trace.span("completion", self.openai) as attributes:
+            response, usage = self.openai.chat_completion_with_usage(
+                messages=suggestion.messages
             )
+            attributes.update(self._completion_attributes(usage))
+        self._cache_suggestion(suggestion, response)
+        return self._finish_suggestion(suggestion, response, usage)
 
-        messages.append(
-            {
-                "role": "user",
-                "content": get_i18n_text(
-                    I18nKey.KEY_PROMPT_USER_ROLE_SUGGEST_SQL
-                ).format(",".join(dbt_model_names), query),
-            }
+    def _suggest_many(
+        self,
+        queries: List[str],
+        k: int,
+        user_prompt_key: I18nKey,
+        max_concurrency: Optional[int] = None,
+    ) -> List[Union[ChatMessage, Exception]]:
+        # the batch embedding and search count in the timings of every query
+        batch_trace = Trace(self.callbacks)
+        try:
+            retrievals = self._retrieve_many(queries, k, batch_trace)
+        except Exception as ex:  # pylint: disable=broad-except
+            logging.warning("suggest %s queries failed: %s", len(queries), ex)
+            return [ex] * len(queries)
+
+        def _complete(
+            query: str, vector: List[float], metas: List[DocMetaContainer]
+        ) -> ChatMessage:
+            trace = Trace(self.callbacks, batch_trace.spans)
+            return self._complete_suggestion(
+                self._suggestion_for(query, vector, metas, user_prompt_key, trace)
+            )
+
+        workers = max(1, int(max_concurrency or self.max_concurrency))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_complete, query, vector, metas)
+                for query, (vector, metas) in zip(queries, retrievals)
+            ]
+            messages: List[Union[ChatMessage, Exception]] = []
+            for query, future in zip(queries, futures):
+                try:
+                    messages.append(future.result())
+                except Exception as ex:  # pylint: disable=broad-except
+                    logging.warning("suggest failed: %s, %s", query, ex)
+                    messages.append(ex)
+        return messages
+
+    def _suggest_stream(
+        self, query: str, k: int, user_prompt_key: I18nKey
+    ) -> ChatMessageStream:
+        suggestion = self._prepare_suggestion(query, k, user_prompt_key)
+        messages = suggestion.messages
+        if messages is None:
+            return ChatMessageStream(
+                iter([get_i18n_text(I18nKey.KEY_NO_RESPONSE)]),
+                lambda response: self._finish_suggestion(suggestion, response),
+            )
+        cached = self._cached_suggestion(suggestion)
+        if cached is not None:
+            return ChatMessageStream(iter([cached.response]), lambda _: cached)
+
+        # the completion span lasts until the last delta is consumed
+        start = time.perf_counter()
+
+        def _finish(response: str) -> ChatMessage:
+            usage = self._completion_usage(messages, response)
+            self._record_completion(suggestion, start, usage)
+            self._cache_suggestion(suggestion, response)
+            return self._finish_suggestion(suggestion, response, usage)
+
+        return ChatMessageStream(
+            self.openai.chat_completion_stream(messages=messages), _finish
         )
-        logging.debug("messages: %s", messages)
-        response = self.openai.chat_completion(messages=messages)
-        message = ChatMessage(
-            uuid=uuid.uuid4().hex,
-            created_at=datetime.datetime.now(),
-            query=query,
-            response=response,
-            ref_dbt_docs=dbt_docs,
-            ref_chat_docs=chat_docs,
+
+    def suggest_table(self, query: str, k: int = 5) -> ChatMessage:
+        """Suggest table for query"""
+        return self._suggest(query, k, I18nKey.KEY_PROMPT_USER_ROLE_SUGGEST_TABLES)
+
+    def suggest_sql(self, query: str, k: int = 10) -> ChatMessage:
+        """Suggest sql for query"""
+        return self._suggest(query, k, I18nKey.KEY_PROMPT_USER_ROLE_SUGGEST_SQL)
+
+    def suggest_table_many(
+        self, queries: List[str], k: int = 5, max_concurrency: Optional[int] = None
+    ) -> List[Union[ChatMessage, Exception]]:
+        """Suggest tables for many queries, see `suggest_sql_many`"""
+        return self._suggest_many(
+            queries, k, I18nKey.KEY_PROMPT_USER_ROLE_SUGGEST_TABLES, max_concurrency
+        )
+
+    def suggest_sql_many(
+        self, queries: List[str], k: int = 10, max_concurrency: Optional[int] = None
+    ) -> List[Union[ChatMessage, Exception]]:
+        """Suggest sql for many queries
+
+        Queries are embedded in one batch and searched at once, then up to
+        `max_concurrency` (default `ChatBot.max_concurrency`) completions run at a
+        time. Results are in input order; a query which fails gets its exception
+        in place of a message, the other queries are unaffected.
+        """
+        return self._suggest_many(
+            queries, k, I18nKey.KEY_PROMPT_USER_ROLE_SUGGEST_SQL, max_concurrency
         )
-        self._messages.append(message)
-        return message
+
+    def suggest_table_stream(self, query: str, k: int = 5) -> ChatMessageStream:
+        """Suggest table for query, streaming the response as it is generated"""
+        return self._suggest_stream(
+            query, k, I18nKey.KEY_PROMPT_USER_ROLE_SUGGEST_TABLES
+        )
+
+    def suggest_sql_stream(self, query: str, k: int = 10) -> ChatMessageStream:
+        """Suggest sql for query, streaming the response as it is generated"""
+        return self._suggest_stream(query, k, I18nKey.KEY_PROMPT_USER_ROLE_SUGGEST_SQL)
 
     def memory_message(self, message: ChatMessage):
         """Memory message"""
         return self.memory_message_by_uuid(message.uuid)
 
-    def _find_message(self, chat_uuid: str) -> Optional[ChatMessage]:
-        """Find message by uuid"""
-        for message in self._messages:
-            if message.uuid == chat_uuid:
-                return message
-        return None
-
-    def memory_message_by_uuid(self, chat_uuid: str):
-        """Memory message by uuid"""
-        message = self._find_message(chat_uuid)
+    def _chat_doc_for_message(self, chat_uuid: str) -> ChatConversationDocument:
+        message = self.message_store.get(chat_uuid)
         if not message:
             raise ValueError("message not found")
-        chat_doc = ChatConversationDocument(
+        return ChatConversationDocument(
             query=message.query,
             response=message.response,
             meta=DocMetaContainer(
@@ -356,6 +1277,278 @@ class ChatBot:
             ref_dbt_docs=message.ref_dbt_docs,
         )
 
-        vector = self.openai.embed(chat_doc.get_content())
+    def memory_message_by_uuid(self, chat_uuid: str):
+        """Memory message by uuid"""
+        chat_doc = self._chat_doc_for_message(chat_uuid)
+        vector = self.embedding_provider.embed(chat_doc.get_content())
         logging.debug("memory message: %s, %s", chat_doc, vector[:5])
         self.vector_storage.insert_doc(chat_doc, vector)
+        if self._memory_flush_due():
+            self.flush_memory()
+
+    def _memory_flush_due(self) -> bool:
+        """Record a memorized message, return whether it is time to flush"""
+        with self._memory_flush_lock:
+            self._memory_unflushed = True
+            return (
+                time.monotonic() - self._memory_flushed_at
+                >= self.memory_flush_interval_secs
+            )
+
+    def flush_memory(self):
+        """Flush the memorized messages the vector storage has not saved yet
+
+        Saving may rewrite the whole vector storage, like `numpy` does, so
+        memorized messages are only flushed every `memory_flush_interval_secs`.
+        """
+        with self._memory_flush_lock:
+            unflushed = self._memory_unflushed
+            self._memory_unflushed = False
+            self._memory_flushed_at = time.monotonic()
+        if unflushed:
+            self.vector_storage.flush()
+
+    def _async_semaphore(self) -> asyncio.Semaphore:
+        """Get the semaphore bounding in-flight async calls on the running loop"""
+        loop = asyncio.get_event_loop()
+        semaphore = self._async_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._async_semaphores[loop] = semaphore
+        return semaphore
+
+    async def aindex_dbt_docs(
+        self,
+        batch_size: int = DEFAULT_INDEX_BATCH_SIZE,
+        incremental: bool = False,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+    ):
+        """Index all dbt docs, embedding up to `max_concurrency` batches at a time"""
+        batch_size = max(1, int(batch_size))
+        docs = self.doc_manager.get_all_docs()
+        if incremental:
+            docs = await run_sync(self._changed_docs, docs)
+
+        rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        n_indexed = 0
+
+        async def _index_batch(batch: List[Doc], n_tokens: int):
+            nonlocal n_indexed
+            async with self._async_semaphore():
+                await rate_limiter.aacquire(n_tokens)
+                logging.debug("indexing docs: %s", batch)
+                vectors = await self.embedding_provider.aembed_many(
+                    [doc.get_content() for doc in batch]
+                )
+                await self.vector_storage.ainsert_docs(batch, vectors)
+            n_indexed += len(batch)
+            logging.info("indexed dbt docs: %s/%s", n_indexed, len(docs))
+
+        batches = await run_sync(self._index_batches, docs, batch_size)
+        await asyncio.gather(
+            *[_index_batch(batch, n_tokens) for batch, n_tokens in batches]
+        )
+        await run_sync(self.vector_storage.flush)
+
+    async def _aretrieve_many(
+        self, queries: List[str], k: int, trace: Trace
+    ) -> List[Tuple[List[float], List[DocMetaContainer]]]:
+        # the lexical index is built on the first search
+        lexical_hits = await run_sync(self._lexical_hits, queries, k, trace)
+        embedded = self._embedded_queries(lexical_hits)
+        vectors: List[List[float]] = []
+        results: List[List[SearchResult]] = []
+        if embedded:
+            # repeated queries are served from the query embedding cache
+            provider = self.query_embedding_provider
+            with trace.span(
+                "embed", self.openai, n_queries=len(embedded)
+            ) as attributes:
+                (
+                    vectors,
+                    attributes["cache_hits"],
+                ) = await provider.aembed_many_with_hits(
+                    [queries[idx] for idx in embedded]
+                )
+            with trace.span("search", self.vector_storage, n_queries=len(embedded)):
+                results = await self.vector_storage.asearch_many(
+                    vectors, k, min_similarity=self.min_similarity
+                )
+        return self._fuse_retrievals(
+            len(queries), k, lexical_hits, embedded, vectors, results
+        )
+
+    async def _aprepare_suggestion(
+        self, query: str, k: int, user_prompt_key: I18nKey
+    ) -> _Suggestion:
+        trace = Trace(self.callbacks)
+        vector, similar_docs_meta = (await self._aretrieve_many([query], k, trace))[0]
+        logging.debug("embedding query: %s, %s", query, vector[:5])
+        # token counts may come from a tiktoken server
+        return await run_sync(
+            self._suggestion_for,
+            query,
+            vector,
+            similar_docs_meta,
+            user_prompt_key,
+            trace,
+        )
+
+    async def _asuggest(
+        self, query: str, k: int, user_prompt_key: I18nKey
+    ) -> ChatMessage:
+        async with self._async_semaphore():
+            suggestion = await self._aprepare_suggestion(query, k, user_prompt_key)
+            return await self._acomplete_suggestion(suggestion)
+
+    async def _acomplete_suggestion(self, suggestion: _Suggestion) -> ChatMessage:
+        if suggestion.messages is None:
+            return self._finish_suggestion(
+                suggestion, get_i18n_text(I18nKey.KEY_NO_RESPONSE)
+            )
+        cached = await run_sync(self._cached_suggestion, suggestion)
+        if cached is not None:
+            return cached
+        with suggestion.trace.span("completion", self.openai) as attributes:
+            response, usage = await self.openai.achat_completion_with_usage(
+                messages=suggestion.messages
+            )
+            attributes.update(self._completion_attributes(usage))
+        self._cache_suggestion(suggestion, response)
+        return self._finish_suggestion(suggestion, response, usage)
+
+    async def _asuggest_many(
+        self, queries: List[str], k: int, user_prompt_key: I18nKey
+    ) -> List[Union[ChatMessage, Exception]]:
+        batch_trace = Trace(self.callbacks)
+        try:
+            async with self._async_semaphore():
+                retrievals = await self._aretrieve_many(queries, k, batch_trace)
+        except Exception as ex:  # pylint: disable=broad-except
+            logging.warning("suggest %s queries failed: %s", len(queries), ex)
+            return [ex] * len(queries)
+
+        async def _complete(
+            query: str, vector: List[float], metas: List[DocMetaContainer]
+        ) -> Union[ChatMessage, Exception]:
+            try:
+                async with self._async_semaphore():
+                    suggestion = await run_sync(
+                        self._suggestion_for,
+                        query,
+                        vector,
+                        metas,
+                        user_prompt_key,
+                        Trace(self.callbacks, batch_trace.spans),
+                    )
+                    return await self._acomplete_suggestion(suggestion)
+            except Exception as ex:  # pylint: disable=broad-except
+                logging.warning("suggest failed: %s, %s", query, ex)
+                return ex
+
+        return await asyncio.gather(
+            *[
+                _complete(query, vector, metas)
+                for query, (vector, metas) in zip(queries, retrievals)
+            ]
+        )
+
+    async def _asuggest_stream(
+        self, query: str, k: int, user_prompt_key: I18nKey
+    ) -> AsyncChatMessageStream:
+        async with self._async_semaphore():
+            suggestion = await self._aprepare_suggestion(query, k, user_prompt_key)
+        messages = suggestion.messages
+        cached = (
+            await run_sync(self._cached_suggestion, suggestion)
+            if messages is not None
+            else None
+        )
+
+        async def _deltas() -> AsyncIterator[str]:
+            if messages is None:
+                yield get_i18n_text(I18nKey.KEY_NO_RESPONSE)
+                return
+            if cached is not None:
+                yield cached.response
+                return
+            async with self._async_semaphore():
+                async for delta in self.openai.achat_completion_stream(
+                    messages=messages
+                ):
+                    yield delta
+
+        start = time.perf_counter()
+
+        async def _finish(response: str) -> ChatMessage:
+            if cached is not None:
+                return cached
+            if messages is None:
+                return self._finish_suggestion(suggestion, response)
+            usage = await run_sync(self._completion_usage, messages, response)
+            self._record_completion(suggestion, start, usage)
+            self._cache_suggestion(suggestion, response)
+            return self._finish_suggestion(suggestion, response, usage)
+
+        return AsyncChatMessageStream(_deltas(), _finish)
+
+    async def asuggest_table(self, query: str, k: int = 5) -> ChatMessage:
+        """Suggest table for query"""
+        return await self._asuggest(
+            query, k, I18nKey.KEY_PROMPT_USER_ROLE_SUGGEST_TABLES
+        )
+
+    async def asuggest_sql(self, query: str, k: int = 10) -> ChatMessage:
+        """Suggest sql for query"""
+        return await self._asuggest(query, k, I18nKey.KEY_PROMPT_USER_ROLE_SUGGEST_SQL)
+
+    async def asuggest_table_many(
+        self, queries: List[str], k: int = 5
+    ) -> List[Union[ChatMessage, Exception]]:
+        """Suggest tables for many queries, see `suggest_sql_many`"""
+        return await self._asuggest_many(
+            queries, k, I18nKey.KEY_PROMPT_USER_ROLE_SUGGEST_TABLES
+        )
+
+    async def asuggest_sql_many(
+        self, queries: List[str], k: int = 10
+    ) -> List[Union[ChatMessage, Exception]]:
+        """Suggest sql for many queries, up to `max_concurrency` at a time
+
+        Results are in input order, a query which fails gets its exception in
+        place of a message.
+        """
+        return await self._asuggest_many(
+            queries, k, I18nKey.KEY_PROMPT_USER_ROLE_SUGGEST_SQL
+        )
+
+    async def asuggest_table_stream(
+        self, query: str, k: int = 5
+    ) -> AsyncChatMessageStream:
+        """Suggest table for query, streaming the response as it is generated"""
+        return await self._asuggest_stream(
+            query, k, I18nKey.KEY_PROMPT_USER_ROLE_SUGGEST_TABLES
+        )
+
+    async def asuggest_sql_stream(
+        self, query: str, k: int = 10
+    ) -> AsyncChatMessageStream:
+        """Suggest sql for query, streaming the response as it is generated"""
+        return await self._asuggest_stream(
+            query, k, I18nKey.KEY_PROMPT_USER_ROLE_SUGGEST_SQL
+        )
+
+    async def amemory_message(self, message: ChatMessage):
+        """Memory message"""
+        return await self.amemory_message_by_uuid(message.uuid)
+
+    async def amemory_message_by_uuid(self, chat_uuid: str):
+        """Memory message by uuid"""
+        chat_doc = self._chat_doc_for_message(chat_uuid)
+        async with self._async_semaphore():
+            vector = await self.embedding_provider.aembed(chat_doc.get_content())
+            logging.debug("memory message: %s, %s", chat_doc, vector[:5])
+            await self.vector_storage.ainsert_doc(chat_doc, vector)
+            if self._memory_flush_due():
+                await run_sync(self.flush_memory)
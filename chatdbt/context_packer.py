@@ -0,0 +1,108 @@
+"""Fit retrieved docs into the token budget of a prompt"""
+
+import logging
+from typing import List, NamedTuple, Optional
+
+from chatdbt.model import Doc, TikTokenProvider
+from chatdbt.openai import COMPLETION_MODEL
+
+DEFAULT_CONTEXT_MAX_TOKENS = 2000
+
+
+def estimate_token_count(content: str) -> int:
+    """Roughly estimate the number of tokens, about 4 characters per token"""
+    return len(content) // 4 + 1
+
+
+def count_tokens(
+    tiktoken_provider: Optional[TikTokenProvider], contents: List[str], model: str
+) -> List[int]:
+    """Count tokens with the tiktoken provider, estimating counts it cannot provide"""
+    counted: List[Optional[int]] = (
+        tiktoken_provider.count_tokens(contents, model)
+        if tiktoken_provider and contents
+        else [None] * len(contents)
+    )
+    return [
+        n_tokens if n_tokens is not None else estimate_token_count(content)
+        for content, n_tokens in zip(contents, counted)
+    ]
+
+
+class PackedContext(NamedTuple):
+    """Docs fitted into a token budget"""
+
+    docs: List[Doc]
+    contents: List[str]
+    dropped_docs: List[Doc]
+    n_tokens: int
+
+
+class ContextPacker:
+    """Fit docs, ranked from the most to the least relevant, into `max_tokens` tokens
+
+    Docs over budget are first trimmed with `Doc.get_compact_contents`, one level
+    at a time across all docs, least relevant docs first; so column descriptions
+    are dropped from every doc before any doc loses its columns. When every doc
+    is trimmed as much as possible, the least relevant docs are dropped.
+    Tokens are counted with the tiktoken provider, or estimated without one.
+    """
+
+    def __init__(
+        self,
+        tiktoken_provider: Optional[TikTokenProvider],
+        max_tokens: int = DEFAULT_CONTEXT_MAX_TOKENS,
+        model: str = COMPLETION_MODEL,
+    ):
+        self.tiktoken_provider = tiktoken_provider
+        self.max_tokens = int(max_tokens)
+        self.model = model
+
+    def _count_tokens(self, contents: List[str]) -> List[int]:
+        return count_tokens(self.tiktoken_provider, contents, self.model)
+
+    def pack(self, docs: List[Doc]) -> PackedContext:
+        renderings = [[doc.get_content()] for doc in docs]
+        counts = [
+            [n_tokens] for n_tokens in self._count_tokens([i[0] for i in renderings])
+        ]
+        levels = [0] * len(docs)
+        kept = list(range(len(docs)))
+        n_tokens = sum(i[0] for i in counts)
+
+        if n_tokens > self.max_tokens:
+            compact_contents = [doc.get_compact_contents() for doc in docs]
+            compact_counts = self._count_tokens(
+                [content for contents in compact_contents for content in contents]
+            )
+            for idx, contents in enumerate(compact_contents):
+                renderings[idx].extend(contents)
+                counts[idx].extend(compact_counts[: len(contents)])
+                compact_counts = compact_counts[len(contents) :]
+
+        while n_tokens > self.max_tokens and kept:
+            trimmable = [i for i in kept if levels[i] + 1 < len(renderings[i])]
+            if trimmable:
+                # the least trimmed doc, the least relevant one on ties
+                idx = min(trimmable, key=lambda i: (levels[i], -i))
+                n_tokens -= counts[idx][levels[idx]]
+                levels[idx] += 1
+                n_tokens += counts[idx][levels[idx]]
+            else:
+                idx = kept.pop()
+                n_tokens -= counts[idx][levels[idx]]
+
+        dropped_docs = [doc for idx, doc in enumerate(docs) if idx not in kept]
+        if dropped_docs or any(levels):
+            logging.info(
+                "packed context into %s tokens, trimmed %s docs, dropped %s docs",
+                n_tokens,
+                sum(1 for i in kept if levels[i]),
+                len(dropped_docs),
+            )
+        return PackedContext(
+            docs=[docs[i] for i in kept],
+            contents=[renderings[i][levels[i]] for i in kept],
+            dropped_docs=dropped_docs,
+            n_tokens=n_tokens,
+        )
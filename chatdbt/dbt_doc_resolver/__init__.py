@@ -1,9 +1,9 @@
-from typing import Dict
+from typing import Any, Dict
 from chatdbt.model import DBTDocResolver
 
 
 def get_dbt_doc_resolver(
-    dbt_doc_resolver_type: str, dbt_doc_resolver_config: Dict[str, str]
+    dbt_doc_resolver_type: str, dbt_doc_resolver_config: Dict[str, Any]
 ) -> DBTDocResolver:
     if dbt_doc_resolver_type == "localfs":
         from .localfs import LocalfsDBTDocResolver
@@ -1,25 +1,169 @@
+import gzip
+import hashlib
 import json
-from typing import Dict, List, Optional
+import logging
+import os
+import threading
+from typing import IO, Any, Dict, Iterator, List, Optional, Set, Tuple, cast
 
 from chatdbt.model import DBTDocResolver
 
+# the only manifest fields read from model nodes, kept in streaming mode
+MANIFEST_NODE_FIELDS = (
+    "unique_id",
+    "resource_type",
+    "name",
+    "description",
+    "columns",
+    "depends_on",
+    "compiled_code",
+    "checksum",
+)
+MANIFEST_COLUMN_FIELDS = ("name", "description", "data_type")
+CATALOG_COLUMN_FIELDS = ("name", "type")
+
+
+def _open_artifact(path: str) -> IO[bytes]:
+    """Open a dbt artifact, decompressing `.gz` and `.zst` files"""
+    if path.endswith(".gz"):
+        return cast(IO[bytes], gzip.open(path, "rb"))
+    if path.endswith((".zst", ".zstd")):
+        try:
+            import zstandard  # pylint: disable=import-outside-toplevel
+        except ImportError as ex:
+            raise RuntimeError(
+                f"{ex}\nPlease install zstandard to read {path}\npip install chatdbt[streaming]"
+            )  # pylint: disable=raise-missing-from
+        return zstandard.open(path, "rb")
+    return open(path, "rb")
+
+
+def _pick(item: Dict[str, Any], fields: Tuple[str, ...]) -> Dict[str, Any]:
+    return {k: item[k] for k in fields if k in item}
+
+
+def _iter_nodes(artifact_f: IO[bytes]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Iterate over the nodes of an artifact, one node in memory at a time"""
+    try:
+        import ijson  # pylint: disable=import-outside-toplevel
+    except ImportError as ex:
+        raise RuntimeError(
+            f"{ex}\nPlease install ijson to use LocalfsDBTDocResolver streaming\npip install chatdbt[streaming]"
+        )  # pylint: disable=raise-missing-from
+    return ijson.kvitems(artifact_f, "nodes", use_float=True)
+
 
 class LocalfsDBTDocResolver(DBTDocResolver):
-    def __init__(self, manifest_json_path: str, catalog_json_path: str):
-        with open(manifest_json_path, "r", encoding="utf8") as manifest_f:
-            self._dbt_docs_manifest = json.load(manifest_f)
-        with open(catalog_json_path, "r", encoding="utf8") as catalog_f:
-            self._dbt_docs_catalog = json.load(catalog_f)
+    """Resolve dbt docs from `manifest.json` and `catalog.json` files
+
+    Artifacts may be gzip (`.gz`) or zstandard (`.zst`) compressed. With
+    `streaming`, artifacts are parsed incrementally and only model nodes and the
+    fields chatdbt reads are kept, so large manifests fit in a fraction of the memory.
+    Artifacts are parsed on first access, so a `DocManager` snapshot of unchanged
+    artifacts saves parsing them.
+    """
+
+    def __init__(
+        self, manifest_json_path: str, catalog_json_path: str, streaming: bool = False
+    ):
+        self.manifest_json_path = manifest_json_path
+        self.catalog_json_path = catalog_json_path
+        self.streaming = str(streaming).lower() in ("true", "1")
+        self._fingerprint = self._read_fingerprint()
+        self._artifacts: Optional[Tuple[Dict[str, Any], Dict[str, Any]]] = None
+        self._load_lock = threading.Lock()
+
+    def _get_artifacts(self) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Parsed manifest and catalog, parsed on first access"""
+        artifacts = self._artifacts
+        if artifacts is None:
+            with self._load_lock:
+                if self._artifacts is None:
+                    self._artifacts = self._load()
+                artifacts = self._artifacts
+        return artifacts
+
+    def _load(self) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        if self.streaming:
+            manifest = self._stream_manifest()
+            return manifest, self._stream_catalog(set(manifest["nodes"]))
+        with _open_artifact(self.manifest_json_path) as manifest_f:
+            manifest = json.load(manifest_f)
+        with _open_artifact(self.catalog_json_path) as catalog_f:
+            return manifest, json.load(catalog_f)
+
+    def _read_fingerprint(self) -> str:
+        """Fingerprint of the artifact paths, sizes and modification times"""
+        stats = []
+        for path in (self.manifest_json_path, self.catalog_json_path):
+            stat = os.stat(path)
+            stats.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+        return hashlib.sha256(json.dumps(stats).encode("utf8")).hexdigest()
+
+    def get_fingerprint(self) -> Optional[str]:
+        return self._fingerprint
+
+    def get_source_id(self) -> Optional[str]:
+        return json.dumps(
+            [
+                os.path.abspath(self.manifest_json_path),
+                os.path.abspath(self.catalog_json_path),
+            ]
+        )
+
+    def reload(self) -> bool:
+        """Reload the artifacts if they were modified since they were loaded"""
+        fingerprint = self._read_fingerprint()
+        if fingerprint == self._fingerprint:
+            return False
+        logging.info("reloading dbt artifacts %s", self.manifest_json_path)
+        artifacts = self._load()
+        with self._load_lock:
+            self._artifacts = artifacts
+            self._fingerprint = fingerprint
+        return True
+
+    def _stream_manifest(self) -> Dict[str, Any]:
+        nodes = {}
+        with _open_artifact(self.manifest_json_path) as manifest_f:
+            for unique_id, node in _iter_nodes(manifest_f):
+                if node.get("resource_type") != "model":
+                    continue
+                node = _pick(node, MANIFEST_NODE_FIELDS)
+                node["columns"] = {
+                    name: _pick(column, MANIFEST_COLUMN_FIELDS)
+                    for name, column in node.get("columns", {}).items()
+                }
+                node["depends_on"] = {
+                    "nodes": node.get("depends_on", {}).get("nodes", [])
+                }
+                nodes[unique_id] = node
+        logging.debug("streamed %s models from %s", len(nodes), self.manifest_json_path)
+        return {"nodes": nodes}
+
+    def _stream_catalog(self, unique_ids: Set[str]) -> Dict[str, Any]:
+        nodes = {}
+        with _open_artifact(self.catalog_json_path) as catalog_f:
+            for unique_id, node in _iter_nodes(catalog_f):
+                if unique_id not in unique_ids:
+                    continue
+                nodes[unique_id] = {
+                    "columns": {
+                        name: _pick(column, CATALOG_COLUMN_FIELDS)
+                        for name, column in node.get("columns", {}).items()
+                    }
+                }
+        return {"nodes": nodes}
 
     def get_manifest_by_unique_id(self, unique_id: str) -> Optional[Dict]:
-        return self._dbt_docs_manifest["nodes"].get(unique_id)
+        return self._get_artifacts()[0]["nodes"].get(unique_id)
 
     def get_catalog_by_unique_id(self, unique_id: str) -> Optional[Dict]:
-        return self._dbt_docs_catalog["nodes"].get(unique_id)
+        return self._get_artifacts()[1]["nodes"].get(unique_id)
 
     def list_model_unique_id(self) -> List[str]:
         res = []
-        for model in self._dbt_docs_manifest["nodes"].values():
+        for model in self._get_artifacts()[0]["nodes"].values():
             if model["resource_type"] != "model":
                 continue
             res.append(model["unique_id"])
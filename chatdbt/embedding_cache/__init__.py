@@ -0,0 +1,19 @@
+from typing import Any, Dict
+
+from chatdbt.model import EmbeddingCache
+
+
+def get_embedding_cache(
+    embedding_cache_type: str, embedding_cache_config: Dict[str, Any]
+) -> EmbeddingCache:
+    """Get an embedding cache instance"""
+    if embedding_cache_type == "memory":
+        from chatdbt.embedding_cache.memory import MemoryEmbeddingCache
+
+        return MemoryEmbeddingCache(**embedding_cache_config)
+    elif embedding_cache_type == "sqlite":
+        from chatdbt.embedding_cache.sqlite import SqliteEmbeddingCache
+
+        return SqliteEmbeddingCache(**embedding_cache_config)
+    else:
+        raise ValueError("Unknown embedding cache type")
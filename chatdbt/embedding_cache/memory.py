@@ -0,0 +1,24 @@
+from typing import List, Optional
+
+from chatdbt.lru_cache import LRUCache
+from chatdbt.model import EmbeddingCache
+
+
+class MemoryEmbeddingCache(EmbeddingCache):
+    """In-process embedding cache bounded by `max_entries`, with an optional TTL"""
+
+    def __init__(self, max_entries: int = 1024, ttl_secs: Optional[float] = 3600):
+        self._cache: LRUCache[List[float]] = LRUCache(
+            max_entries, float(ttl_secs) if ttl_secs else None
+        )
+
+    def get_many(
+        self, model: str, content_hashes: List[str]
+    ) -> List[Optional[List[float]]]:
+        return [self._cache.get((model, i)) for i in content_hashes]
+
+    def put_many(
+        self, model: str, content_hashes: List[str], vectors: List[List[float]]
+    ):
+        for content_hash, vector in zip(content_hashes, vectors):
+            self._cache.put((model, content_hash), vector)
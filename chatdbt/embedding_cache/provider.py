@@ -0,0 +1,87 @@
+import logging
+from typing import List, Optional, Tuple, cast
+
+from chatdbt.model import EmbeddingCache, EmbeddingProvider, content_hash
+
+
+class CachedEmbeddingProvider(EmbeddingProvider):
+    """Embedding provider which serves vectors from a cache before calling the wrapped provider"""
+
+    def __init__(self, provider: EmbeddingProvider, cache: EmbeddingCache):
+        self.provider = provider
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def get_model_name(self) -> str:
+        return self.provider.get_model_name()
+
+    def embed(self, content: str) -> List[float]:
+        return self.embed_many([content])[0]
+
+    def _lookup(
+        self, contents: List[str]
+    ) -> Tuple[List[str], List[Optional[List[float]]], List[int]]:
+        content_hashes = [content_hash(content) for content in contents]
+        vectors = self.cache.get_many(self.get_model_name(), content_hashes)
+        missing = [idx for idx, vector in enumerate(vectors) if vector is None]
+        self.hits += len(contents) - len(missing)
+        self.misses += len(missing)
+        logging.debug(
+            "embedding cache: %s hits, %s misses",
+            len(contents) - len(missing),
+            len(missing),
+        )
+        return content_hashes, vectors, missing
+
+    def _fill(
+        self,
+        content_hashes: List[str],
+        vectors: List[Optional[List[float]]],
+        missing: List[int],
+        missing_vectors: List[List[float]],
+    ) -> List[List[float]]:
+        self.cache.put_many(
+            self.get_model_name(),
+            [content_hashes[i] for i in missing],
+            missing_vectors,
+        )
+        for idx, vector in zip(missing, missing_vectors):
+            vectors[idx] = vector
+        return cast(List[List[float]], vectors)
+
+    def embed_many(self, contents: List[str]) -> List[List[float]]:
+        return self.embed_many_with_hits(contents)[0]
+
+    def embed_many_with_hits(
+        self, contents: List[str]
+    ) -> Tuple[List[List[float]], int]:
+        """Embed contents, along with the number of them served from the cache"""
+        content_hashes, vectors, missing = self._lookup(contents)
+        missing_vectors = (
+            self.provider.embed_many([contents[i] for i in missing]) if missing else []
+        )
+        return (
+            self._fill(content_hashes, vectors, missing, missing_vectors),
+            len(contents) - len(missing),
+        )
+
+    async def aembed(self, content: str) -> List[float]:
+        return (await self.aembed_many([content]))[0]
+
+    async def aembed_many(self, contents: List[str]) -> List[List[float]]:
+        return (await self.aembed_many_with_hits(contents))[0]
+
+    async def aembed_many_with_hits(
+        self, contents: List[str]
+    ) -> Tuple[List[List[float]], int]:
+        content_hashes, vectors, missing = self._lookup(contents)
+        missing_vectors = (
+            await self.provider.aembed_many([contents[i] for i in missing])
+            if missing
+            else []
+        )
+        return (
+            self._fill(content_hashes, vectors, missing, missing_vectors),
+            len(contents) - len(missing),
+        )
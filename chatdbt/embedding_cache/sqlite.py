@@ -0,0 +1,103 @@
+import logging
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional
+
+from chatdbt.model import EmbeddingCache
+
+# sqlite limits the number of host parameters in a statement
+_SQLITE_CHUNK_SIZE = 500
+
+
+def _encode_vector(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _decode_vector(blob: bytes) -> List[float]:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class SqliteEmbeddingCache(EmbeddingCache):
+    """Persistent embedding cache in a local sqlite file
+
+    Vectors are stored as float32 blobs keyed by embedding model and content hash.
+    Once the cache holds more than `max_entries` vectors, the least recently used
+    ones are evicted.
+    """
+
+    def __init__(self, path: str, max_entries: int = 100000):
+        self.path = path
+        self.max_entries = int(max_entries)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._create_tables()
+
+    def _create_tables(self):
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS embedding_cache (
+                    model TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (model, content_hash)
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_embedding_cache_accessed_at "
+                "ON embedding_cache (accessed_at)"
+            )
+
+    def get_many(
+        self, model: str, content_hashes: List[str]
+    ) -> List[Optional[List[float]]]:
+        found: Dict[str, bytes] = {}
+        now = time.time()
+        with self._lock, self._conn:
+            for start in range(0, len(content_hashes), _SQLITE_CHUNK_SIZE):
+                chunk = content_hashes[start : start + _SQLITE_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    "SELECT content_hash, vector FROM embedding_cache "
+                    f"WHERE model = ? AND content_hash IN ({placeholders})",
+                    [model, *chunk],
+                ).fetchall()
+                found.update(rows)
+                self._conn.execute(
+                    "UPDATE embedding_cache SET accessed_at = ? "
+                    f"WHERE model = ? AND content_hash IN ({placeholders})",
+                    [now, model, *chunk],
+                )
+        return [
+            _decode_vector(found[i]) if i in found else None for i in content_hashes
+        ]
+
+    def put_many(
+        self, model: str, content_hashes: List[str], vectors: List[List[float]]
+    ):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache "
+                "(model, content_hash, vector, accessed_at) VALUES (?, ?, ?, ?)",
+                [
+                    (model, content_hash, _encode_vector(vector), now)
+                    for content_hash, vector in zip(content_hashes, vectors)
+                ],
+            )
+            (n_entries,) = self._conn.execute(
+                "SELECT COUNT(*) FROM embedding_cache"
+            ).fetchone()
+            n_evict = n_entries - self.max_entries
+            if n_evict > 0:
+                logging.debug("evicting %s cached embeddings", n_evict)
+                self._conn.execute(
+                    "DELETE FROM embedding_cache WHERE rowid IN "
+                    "(SELECT rowid FROM embedding_cache ORDER BY accessed_at LIMIT ?)",
+                    [n_evict],
+                )
@@ -0,0 +1,15 @@
+from typing import Any, Dict
+
+from chatdbt.model import InstrumentationCallback
+
+
+def get_instrumentation_callback(
+    callback_type: str, callback_config: Dict[str, Any]
+) -> InstrumentationCallback:
+    """Get an instrumentation callback instance"""
+    if callback_type == "prometheus":
+        from chatdbt.instrumentation.prometheus import PrometheusCallback
+
+        return PrometheusCallback(**callback_config)
+    else:
+        raise ValueError("Unknown instrumentation callback type")
@@ -0,0 +1,82 @@
+from typing import Any, Optional
+
+from chatdbt.model import InstrumentationCallback, Span
+
+
+class PrometheusCallback(InstrumentationCallback):
+    """Export spans as Prometheus metrics, labelled by stage and backend
+
+    - `<namespace>_stage_duration_seconds`: histogram of stage durations
+    - `<namespace>_stage_errors_total`: stages which raised
+    - `<namespace>_tokens_total` and `<namespace>_cost_dollars_total`: tokens
+      and cost of completions; query and doc embeddings are not counted
+    - `<namespace>_cache_hits_total`: queries embedded from the query
+      embedding cache
+
+    Metrics are registered in `registry`, the default registry without one.
+    With a `port`, an HTTP server exposing them is started.
+    """
+
+    def __init__(
+        self,
+        namespace: str = "chatdbt",
+        registry: Optional[Any] = None,
+        port: Optional[int] = None,
+    ):
+        try:
+            import prometheus_client  # pylint: disable=import-outside-toplevel
+        except ImportError as ex:
+            raise RuntimeError(
+                f"{ex}\nPlease install prometheus_client to use PrometheusCallback\npip install chatdbt[prometheus]"
+            )  # pylint: disable=raise-missing-from
+        registry = registry or prometheus_client.REGISTRY
+        labels = ["stage", "backend"]
+        self._durations = prometheus_client.Histogram(
+            "stage_duration_seconds",
+            "Duration of chatdbt request stages",
+            labels,
+            namespace=namespace,
+            registry=registry,
+        )
+        self._errors = prometheus_client.Counter(
+            "stage_errors",
+            "chatdbt request stages which raised",
+            labels,
+            namespace=namespace,
+            registry=registry,
+        )
+        self._tokens = prometheus_client.Counter(
+            "tokens",
+            "Tokens used by chatdbt completions, embeddings are not counted",
+            labels,
+            namespace=namespace,
+            registry=registry,
+        )
+        self._cost = prometheus_client.Counter(
+            "cost_dollars",
+            "Cost of chatdbt completions in dollars, embeddings are not counted",
+            labels,
+            namespace=namespace,
+            registry=registry,
+        )
+        self._cache_hits = prometheus_client.Counter(
+            "cache_hits",
+            "Queries of chatdbt requests served from a cache",
+            labels,
+            namespace=namespace,
+            registry=registry,
+        )
+        if port:
+            prometheus_client.start_http_server(int(port), registry=registry)
+
+    def on_span(self, span: Span):
+        labels = (span.stage, span.backend)
+        self._durations.labels(*labels).observe(span.duration_secs)
+        if span.error is not None:
+            self._errors.labels(*labels).inc()
+        if span.attributes.get("tokens"):
+            self._tokens.labels(*labels).inc(span.attributes["tokens"])
+        if span.attributes.get("cost"):
+            self._cost.labels(*labels).inc(span.attributes["cost"])
+        if span.attributes.get("cache_hits"):
+            self._cache_hits.labels(*labels).inc(span.attributes["cache_hits"])
@@ -0,0 +1,69 @@
+import contextlib
+import logging
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+
+from chatdbt.model import InstrumentationCallback, Span
+
+
+def backend_name(backend: Union[str, object]) -> str:
+    return backend if isinstance(backend, str) else type(backend).__name__
+
+
+class Trace:
+    """Spans of a request, reported to the callbacks as they end
+
+    `spans` are spans shared with other requests, like the embedding of a
+    batch of queries; they are already reported and only kept for `timings`.
+    """
+
+    def __init__(
+        self,
+        callbacks: Sequence[InstrumentationCallback] = (),
+        spans: Optional[List[Span]] = None,
+    ):
+        self.callbacks = callbacks
+        self.spans: List[Span] = list(spans or [])
+
+    @contextlib.contextmanager
+    def span(
+        self, stage: str, backend: Union[str, object], **attributes: Any
+    ) -> Iterator[Dict[str, Any]]:
+        """Time a stage, the yielded attributes may be filled in meanwhile"""
+        start = time.perf_counter()
+        error = None
+        try:
+            yield attributes
+        except BaseException as ex:
+            error = type(ex).__name__
+            raise
+        finally:
+            self.record(stage, backend, time.perf_counter() - start, attributes, error)
+
+    def record(
+        self,
+        stage: str,
+        backend: Union[str, object],
+        duration_secs: float,
+        attributes: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None,
+    ) -> Span:
+        """Record a stage timed by the caller"""
+        span = Span(
+            stage, backend_name(backend), duration_secs, attributes or {}, error
+        )
+        self.spans.append(span)
+        for callback in self.callbacks:
+            try:
+                callback.on_span(span)
+            except Exception:  # pylint: disable=broad-except
+                logging.warning("instrumentation callback failed", exc_info=True)
+        return span
+
+    def timings(self) -> Dict[str, float]:
+        """Seconds spent in every stage"""
+        res: Dict[str, float] = defaultdict(float)
+        for span in self.spans:
+            res[span.stage] += span.duration_secs
+        return dict(res)
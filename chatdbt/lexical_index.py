@@ -0,0 +1,143 @@
+"""In-memory lexical index over model names, descriptions and column names"""
+
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, NamedTuple, Optional, Set
+
+_WORD_RE = re.compile(r"[a-z0-9_]+")
+_QUALIFIED_NAME_RE = re.compile(r"[a-z0-9_]+(?:\.[a-z0-9_]+)+")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercase words, identifiers like `fct_orders` also yield their parts"""
+    tokens = []
+    for word in _WORD_RE.findall((text or "").lower()):
+        tokens.append(word)
+        parts = [i for i in word.split("_") if i]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def _short_name(name: str) -> str:
+    """`jaffle_shop.fct_orders` -> `fct_orders`"""
+    return name.split(".")[-1].lower()
+
+
+class LexicalHit(NamedTuple):
+    """A model matching a query, `exact` when the query names the model
+
+    `unambiguous` when the query names the model by its full name, or its
+    short name and the model outscores every other model by a margin.
+    """
+
+    name: str
+    score: float
+    exact: bool
+    unambiguous: bool = False
+
+
+class BM25Index:
+    """Okapi BM25 index of models
+
+    Model names count `name_weight` times, so a model named in a query ranks
+    above models which only mention it in their description or columns. A model
+    named by its short name is only `unambiguous` if it scores `name_margin`
+    times as high as any other model, so everyday words like `orders` which
+    several models are named after do not count.
+    """
+
+    def __init__(
+        self,
+        k1: float = 1.2,
+        b: float = 0.75,
+        name_weight: int = 3,
+        name_margin: float = 2.0,
+    ):
+        self.k1 = k1
+        self.b = b
+        self.name_weight = name_weight
+        self.name_margin = name_margin
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._lengths: Dict[str, int] = {}
+        self._tokens: Dict[str, Set[str]] = {}
+        self._total_length = 0
+        # short model name -> model names, to find models named in a query
+        self._names: Dict[str, Set[str]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(
+        self,
+        name: str,
+        description: Optional[str],
+        column_names: List[str],
+    ):
+        """Index a model, replacing any model of the same name"""
+        self.remove(name)
+        tokens = tokenize(name) * self.name_weight + tokenize(description)
+        for column_name in column_names:
+            tokens.extend(tokenize(column_name))
+        for token, tf in Counter(tokens).items():
+            self._postings[token][name] = tf
+        self._lengths[name] = len(tokens)
+        self._tokens[name] = set(tokens)
+        self._total_length += len(tokens)
+        self._names[_short_name(name)].add(name)
+
+    def remove(self, name: str):
+        length = self._lengths.pop(name, None)
+        if length is None:
+            return
+        self._total_length -= length
+        for token in self._tokens.pop(name):
+            postings = self._postings[token]
+            postings.pop(name, None)
+            if not postings:
+                del self._postings[token]
+        self._names[_short_name(name)].discard(name)
+
+    def search(self, query: str, k: int) -> List[LexicalHit]:
+        """Get the `k` best matching models, models named in the query first"""
+        if not self._lengths or k <= 0:
+            return []
+        n_docs = len(self._lengths)
+        avg_length = self._total_length / n_docs
+        scores: Dict[str, float] = defaultdict(float)
+        for token in set(tokenize(query)):
+            postings = self._postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for name, tf in postings.items():
+                norm = self.k1 * (
+                    1 - self.b + self.b * self._lengths[name] / avg_length
+                )
+                scores[name] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        named = {
+            name
+            for word in _WORD_RE.findall(query.lower())
+            for name in self._names.get(word, ())
+        }
+        ranked = sorted(scores.items(), key=lambda i: (i[0] not in named, -i[1]))
+        if not ranked:
+            return []
+        qualified_names = set(_QUALIFIED_NAME_RE.findall(query.lower()))
+        top_name, top_score = ranked[0]
+        runner_up_score = max((score for _, score in ranked[1:]), default=0.0)
+        unambiguous = top_name in named and (
+            top_name.lower() in qualified_names
+            or top_score >= self.name_margin * runner_up_score
+        )
+        return [
+            LexicalHit(
+                name=name,
+                score=score,
+                exact=name in named,
+                unambiguous=unambiguous and name == top_name,
+            )
+            for name, score in ranked[:k]
+        ]
@@ -0,0 +1,69 @@
+"""Thread-safe in-memory LRU cache with optional TTL"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Generic, Hashable, List, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """Bounded mapping which evicts the least recently used entry once full
+
+    Entries older than `ttl_secs` are treated as missing, `ttl_secs=None` keeps
+    entries until they are evicted.
+    """
+
+    def __init__(self, max_entries: int, ttl_secs: Optional[float] = None):
+        self.max_entries = int(max_entries)
+        self.ttl_secs = float(ttl_secs) if ttl_secs is not None else None
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created_at, value = entry
+            if (
+                self.ttl_secs is not None
+                and time.monotonic() - created_at > self.ttl_secs
+            ):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: V):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[1] if entry is not None else None
+
+    def items(self) -> List[Tuple[Hashable, V]]:
+        """Snapshot of the unexpired entries, from the least to the most recently used"""
+        with self._lock:
+            now = time.monotonic()
+            return [
+                (key, value)
+                for key, (created_at, value) in self._entries.items()
+                if self.ttl_secs is None or now - created_at <= self.ttl_secs
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key) is not None
@@ -0,0 +1,19 @@
+from typing import Any, Dict
+
+from chatdbt.model import MessageStore
+
+
+def get_message_store(
+    message_store_type: str, message_store_config: Dict[str, Any]
+) -> MessageStore:
+    """Get a message store instance"""
+    if message_store_type == "memory":
+        from chatdbt.message_store.memory import MemoryMessageStore
+
+        return MemoryMessageStore(**message_store_config)
+    elif message_store_type == "sqlite":
+        from chatdbt.message_store.sqlite import SqliteMessageStore
+
+        return SqliteMessageStore(**message_store_config)
+    else:
+        raise ValueError("Unknown message store type")
@@ -0,0 +1,19 @@
+from typing import Optional
+
+from chatdbt.lru_cache import LRUCache
+from chatdbt.model import ChatMessage, MessageStore
+
+
+class MemoryMessageStore(MessageStore):
+    """In-process message store bounded by `max_entries`, with an optional TTL"""
+
+    def __init__(self, max_entries: int = 1024, ttl_secs: Optional[float] = None):
+        self._messages: LRUCache[ChatMessage] = LRUCache(
+            max_entries, float(ttl_secs) if ttl_secs else None
+        )
+
+    def get(self, chat_uuid: str) -> Optional[ChatMessage]:
+        return self._messages.get(chat_uuid)
+
+    def put(self, message: ChatMessage):
+        self._messages.put(message.uuid, message)
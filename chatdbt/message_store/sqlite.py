@@ -0,0 +1,90 @@
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from chatdbt.model import ChatMessage, MessageStore
+
+
+class SqliteMessageStore(MessageStore):
+    """Persistent message store in a local sqlite file
+
+    Messages survive restarts and are shared by the processes using the same
+    file. Messages older than `ttl_secs` are treated as missing, and once the
+    store holds more than `max_entries` messages, the least recently used ones
+    are evicted.
+    """
+
+    def __init__(
+        self, path: str, max_entries: int = 100000, ttl_secs: Optional[float] = None
+    ):
+        self.path = path
+        self.max_entries = int(max_entries)
+        self.ttl_secs = float(ttl_secs) if ttl_secs else None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._create_tables()
+
+    def _create_tables(self):
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS chat_message (
+                    uuid TEXT PRIMARY KEY,
+                    message BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_chat_message_accessed_at "
+                "ON chat_message (accessed_at)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_chat_message_created_at "
+                "ON chat_message (created_at)"
+            )
+
+    def _min_created_at(self, now: float) -> float:
+        return now - self.ttl_secs if self.ttl_secs is not None else 0.0
+
+    def get(self, chat_uuid: str) -> Optional[ChatMessage]:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT message FROM chat_message WHERE uuid = ? AND created_at >= ?",
+                [chat_uuid, self._min_created_at(now)],
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE chat_message SET accessed_at = ? WHERE uuid = ?",
+                [now, chat_uuid],
+            )
+        return pickle.loads(row[0])
+
+    def put(self, message: ChatMessage):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chat_message "
+                "(uuid, message, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                [message.uuid, pickle.dumps(message), now, now],
+            )
+            self._conn.execute(
+                "DELETE FROM chat_message WHERE created_at < ?",
+                [self._min_created_at(now)],
+            )
+            (n_entries,) = self._conn.execute(
+                "SELECT COUNT(*) FROM chat_message"
+            ).fetchone()
+            n_evict = n_entries - self.max_entries
+            if n_evict > 0:
+                logging.debug("evicting %s chat messages", n_evict)
+                self._conn.execute(
+                    "DELETE FROM chat_message WHERE rowid IN "
+                    "(SELECT rowid FROM chat_message ORDER BY accessed_at LIMIT ?)",
+                    [n_evict],
+                )
@@ -1,8 +1,22 @@
 """Base classes for the chatdbt model"""
 import datetime
+import hashlib
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Optional
+from typing import (
+    IO,
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    cast,
+)
 from pydantic import BaseModel as PydanticBaseModel
+from chatdbt.aio import run_sync
 from chatdbt.i18n import get_i18n_text, I18nKey
 
 from enum import Enum
@@ -21,6 +35,11 @@ class DocType(Enum):
     CHAT = "chat"
 
 
+def content_hash(content: str) -> str:
+    """Get the SHA-256 hex digest of a piece of content"""
+    return hashlib.sha256(content.encode("utf8")).hexdigest()
+
+
 class DocMetaContainer(BaseModel):
     """Metadata for a document"""
 
@@ -35,6 +54,13 @@ class Doc(ABC):
     def get_content(self):
         """Get the content of the document"""
 
+    def get_compact_contents(self) -> List[str]:
+        """Get shorter renderings of the content, from the least to the most trimmed
+
+        Used to fit documents into a prompt token budget, none by default.
+        """
+        return []
+
     @abstractmethod
     def get_metadata(self) -> DocMetaContainer:
         """Get the metadata of the document"""
@@ -43,6 +69,30 @@ class Doc(ABC):
     def get_unique_id(self) -> str:
         pass
 
+    def get_content_hash(self) -> str:
+        """Get the hash of the content, used to detect changed documents"""
+        return content_hash(self.get_content())
+
+
+class VectorRecord(NamedTuple):
+    """A stored document vector, along with its metadata"""
+
+    unique_id: str
+    vector: List[float]
+    meta: DocMetaContainer
+    content_hash: Optional[str]
+
+
+class SearchResult(NamedTuple):
+    """A similarity search hit
+
+    `similarity` is higher for more similar documents, cosine similarity for
+    cosine distance storages, None when the storage does not report scores.
+    """
+
+    meta: DocMetaContainer
+    similarity: Optional[float]
+
 
 class VectorStorage(ABC):
     """Base class for all vector storages"""
@@ -51,10 +101,110 @@ class VectorStorage(ABC):
     def insert_doc(self, doc: Doc, vector: List[float]):
         """Insert a document into the vector storage"""
 
+    def insert_docs(self, docs: List[Doc], vectors: List[List[float]]):
+        """Insert a batch of documents into the vector storage"""
+        for doc, vector in zip(docs, vectors):
+            self.insert_doc(doc, vector)
+
+    async def ainsert_doc(self, doc: Doc, vector: List[float]):
+        """Insert a document into the vector storage, defaults to a worker thread"""
+        await run_sync(self.insert_doc, doc, vector)
+
+    async def ainsert_docs(self, docs: List[Doc], vectors: List[List[float]]):
+        """Insert a batch of documents into the vector storage, defaults to a worker thread"""
+        await run_sync(self.insert_docs, docs, vectors)
+
+    def flush(self):
+        """Write documents buffered by the vector storage, if it buffers writes"""
+
     @abstractmethod
     def similarity_search(self, vector: List[float], k: int) -> List[DocMetaContainer]:
         """Search for similar documents in the vector storage"""
 
+    async def asimilarity_search(
+        self, vector: List[float], k: int
+    ) -> List[DocMetaContainer]:
+        """Search for similar documents, defaults to a worker thread"""
+        return await run_sync(self.similarity_search, vector, k)
+
+    def search(
+        self,
+        vector: List[float],
+        k: int,
+        doc_types: Optional[List[DocType]] = None,
+        min_similarity: Optional[float] = None,
+    ) -> List[SearchResult]:
+        """Search for the metadata and similarity of similar documents
+
+        Only documents of `doc_types` and at least `min_similarity` similar are
+        returned. Defaults to filtering `similarity_search` results, which reports
+        no similarity, so `min_similarity` is ignored and fewer than `k` documents
+        may be returned.
+        """
+        return [
+            SearchResult(meta=meta, similarity=None)
+            for meta in self.similarity_search(vector, k)
+            if doc_types is None or meta.doc_type in doc_types
+        ]
+
+    async def asearch(
+        self,
+        vector: List[float],
+        k: int,
+        doc_types: Optional[List[DocType]] = None,
+        min_similarity: Optional[float] = None,
+    ) -> List[SearchResult]:
+        """Search for the metadata and similarity of similar documents, defaults to a worker thread"""
+        return await run_sync(self.search, vector, k, doc_types, min_similarity)
+
+    def search_many(
+        self,
+        vectors: List[List[float]],
+        k: int,
+        doc_types: Optional[List[DocType]] = None,
+        min_similarity: Optional[float] = None,
+    ) -> List[List[SearchResult]]:
+        """Search for the documents similar to each vector, in input order
+
+        Defaults to one `search` per vector, storages able to search many
+        vectors at once override it.
+        """
+        return [self.search(vector, k, doc_types, min_similarity) for vector in vectors]
+
+    async def asearch_many(
+        self,
+        vectors: List[List[float]],
+        k: int,
+        doc_types: Optional[List[DocType]] = None,
+        min_similarity: Optional[float] = None,
+    ) -> List[List[SearchResult]]:
+        """Search for the documents similar to each vector, defaults to a worker thread"""
+        return await run_sync(self.search_many, vectors, k, doc_types, min_similarity)
+
+    def list_content_hashes(self, doc_types: List[DocType]) -> Dict[str, Optional[str]]:
+        """List the content hash of every stored document of the given types, by unique id"""
+        raise NotImplementedError(
+            f"{self.__class__.__name__} does not support incremental indexing"
+        )
+
+    def list_metas(self, doc_types: List[DocType]) -> Dict[str, DocMetaContainer]:
+        """List the metadata of every stored document of the given types, by unique id"""
+        raise NotImplementedError(
+            f"{self.__class__.__name__} does not support listing documents"
+        )
+
+    def delete_docs(self, unique_ids: List[str]):
+        """Delete documents from the vector storage"""
+        raise NotImplementedError(
+            f"{self.__class__.__name__} does not support deleting documents"
+        )
+
+    def list_records(self) -> Iterator[VectorRecord]:
+        """Iterate over every stored document vector"""
+        raise NotImplementedError(
+            f"{self.__class__.__name__} does not support listing vectors"
+        )
+
 
 class EmbeddingProvider(ABC):
     """Base class for all embeddings"""
@@ -63,6 +213,75 @@ class EmbeddingProvider(ABC):
     def embed(self, content: str) -> List[float]:
         """Embed a piece of text into a vector"""
 
+    def embed_many(self, contents: List[str]) -> List[List[float]]:
+        """Embed a batch of texts into vectors, in input order"""
+        return [self.embed(content) for content in contents]
+
+    def get_model_name(self) -> str:
+        """Get the name of the embedding model, vectors of different models never mix"""
+        return self.__class__.__name__
+
+    async def aembed(self, content: str) -> List[float]:
+        """Embed a piece of text into a vector, defaults to a worker thread"""
+        return await run_sync(self.embed, content)
+
+    async def aembed_many(self, contents: List[str]) -> List[List[float]]:
+        """Embed a batch of texts into vectors, defaults to a worker thread"""
+        return await run_sync(self.embed_many, contents)
+
+
+class EmbeddingCache(ABC):
+    """Base class for all embedding caches"""
+
+    @abstractmethod
+    def get_many(
+        self, model: str, content_hashes: List[str]
+    ) -> List[Optional[List[float]]]:
+        """Get cached vectors by content hash, None for misses"""
+
+    @abstractmethod
+    def put_many(
+        self, model: str, content_hashes: List[str], vectors: List[List[float]]
+    ):
+        """Cache vectors by content hash"""
+
+
+class Span(NamedTuple):
+    """A timed stage of a request
+
+    `stage` is one of `embed`, `search`, `lexical_search`, `resolve`, `prompt`
+    and `completion`, `backend` is the class serving it. `attributes` hold
+    stage details like the number of docs, `cache_hits` for the queries of an
+    embedding served from the query embedding cache, and `tokens` and `cost`
+    (in dollars) for completions. `error` is the class name of the exception it raised.
+    """
+
+    stage: str
+    backend: str
+    duration_secs: float
+    attributes: Dict[str, Any]
+    error: Optional[str] = None
+
+
+class InstrumentationCallback(ABC):
+    """Base class for all instrumentation callbacks, notified as spans end"""
+
+    @abstractmethod
+    def on_span(self, span: Span):
+        """Handle an ended span, must not raise"""
+
+
+class MessageStore(ABC):
+    """Base class for all stores of chat messages, looked up by uuid"""
+
+    @abstractmethod
+    def get(self, chat_uuid: str) -> Optional["ChatMessage"]:
+        """Get a message by uuid, None if it is unknown or evicted"""
+
+    @abstractmethod
+    def put(self, message: "ChatMessage"):
+        """Store a message"""
+
 
 class TikTokenProvider(ABC):
     """Base class for all tiktoken providers"""
@@ -71,6 +290,14 @@ class TikTokenProvider(ABC):
     def count_token(self, prompt: str, model: str) -> Optional[int]:
         """Count tokens for a prompt"""
 
+    def count_tokens(self, prompts: List[str], model: str) -> List[Optional[int]]:
+        """Count tokens for a batch of prompts, in input order"""
+        return [self.count_token(prompt, model) for prompt in prompts]
+
+    async def acount_token(self, prompt: str, model: str) -> Optional[int]:
+        """Count tokens for a prompt, defaults to a worker thread"""
+        return await run_sync(self.count_token, prompt, model)
+
 
 def _markdown_dbt_doc_li(name: str, content: str, indent: int = 4):
     _items = content.split("\n")
@@ -108,6 +335,18 @@ class DBTDocResolver(ABC):
     def list_model_unique_id(self) -> List[str]:
         pass
 
+    def get_fingerprint(self) -> Optional[str]:
+        """Identify the version of the loaded dbt docs, None if unknown"""
+        return None
+
+    def get_source_id(self) -> Optional[str]:
+        """Identify where the dbt docs are read from, None if unknown"""
+        return None
+
+    def reload(self) -> bool:
+        """Reload the dbt docs if they changed, return whether they were reloaded"""
+        return False
+
 
 class DBTDocMeta(BaseModel):
     """DBT document metadata"""
@@ -151,6 +390,22 @@ columns: {columns}
 depends_on: {self.depends_on}
 """
 
+    def get_compact_contents(self) -> List[str]:
+        """Drop column descriptions, then column types and dependencies, then columns"""
+        column_types = [f"{i.name}:{i.data_type}" for i in self.columns]
+        column_names = [i.name for i in self.columns]
+        head = f"""name: {self.name}
+description: {self.description or ''}
+"""
+        return [
+            f"""{head}columns: {column_types}
+depends_on: {self.depends_on}
+""",
+            f"""{head}columns: {column_names}
+""",
+            head,
+        ]
+
     def get_metadata(self):
         return self.meta
 
@@ -210,6 +465,16 @@ class ChatMessage(BaseModel):
     created_at: datetime.datetime
     ref_dbt_docs: List[Doc]
     ref_chat_docs: List[ChatConversationDocument]
+    # tokens of the docs in the prompt, and the docs dropped to fit the budget
+    context_tokens: Optional[int] = None
+    dropped_docs: List[Doc] = []
+    # prompt_tokens, completion_tokens and total_tokens of the completion
+    usage: Optional[Dict[str, int]] = None
+    # "exact" or "semantic" when the response comes from the response cache
+    cache_hit: Optional[str] = None
+    # seconds spent in every stage, and the cost of the completion in dollars
+    timings: Dict[str, float] = {}
+    cost: Optional[float] = None
 
     def _repr_markdown_(self):
         ref_dbt_docs = "\n".join(
@@ -239,3 +504,64 @@ class ChatMessage(BaseModel):
 {ref_chat_docs}
 
 """
+
+
+class ChatMessageStream:
+    """A chat message streamed as it is generated
+
+    Iterate over it to get the response deltas, `message` is set to the final
+    `ChatMessage` once the stream ends.
+    """
+
+    def __init__(self, deltas: Iterator[str], finish: Callable[[str], ChatMessage]):
+        self._deltas = deltas
+        self._finish = finish
+        self._parts: List[str] = []
+        self.message: Optional[ChatMessage] = None
+
+    def __iter__(self) -> Iterator[str]:
+        for delta in self._deltas:
+            self._parts.append(delta)
+            yield delta
+        if self.message is None:
+            self.message = self._finish("".join(self._parts))
+
+    def get_message(self) -> ChatMessage:
+        """Consume the rest of the stream and get the final message"""
+        for _ in self:
+            pass
+        return cast(ChatMessage, self.message)
+
+    def echo(self, file: Optional[IO[str]] = None) -> ChatMessage:
+        """Write the response to `file` (stdout by default) as it is generated"""
+        for delta in self:
+            print(delta, end="", file=file, flush=True)
+        print(file=file)
+        return cast(ChatMessage, self.message)
+
+
+class AsyncChatMessageStream:
+    """A chat message streamed as it is generated, for asyncio"""
+
+    def __init__(
+        self,
+        deltas: AsyncIterator[str],
+        finish: Callable[[str], Awaitable[ChatMessage]],
+    ):
+        self._deltas = deltas
+        self._finish = finish
+        self._parts: List[str] = []
+        self.message: Optional[ChatMessage] = None
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        async for delta in self._deltas:
+            self._parts.append(delta)
+            yield delta
+        if self.message is None:
+            self.message = await self._finish("".join(self._parts))
+
+    async def get_message(self) -> ChatMessage:
+        """Consume the rest of the stream and get the final message"""
+        async for _ in self:
+            pass
+        return cast(ChatMessage, self.message)
@@ -2,23 +2,98 @@
 
 import logging
 import openai
-from openai.embeddings_utils import get_embedding
-from typing import Dict, List
+from typing import AsyncIterator, Dict, Iterator, List, Tuple
 from chatdbt.model import EmbeddingProvider
-from tenacity import retry, stop_after_attempt, wait_random_exponential
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 
 
 COMPLETION_MODEL = "gpt-3.5-turbo"
 EMBEDDING_MODEL = "text-embedding-ada-002"
+# the embeddings API accepts at most 2048 inputs per request
+EMBEDDING_MAX_BATCH_SIZE = 2048
 
 
-@retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))
+# rate limits (429), server errors (5xx) and network errors are worth retrying,
+# invalid requests are not
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIError,
+    openai.error.TryAgain,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+)
+
+retry_on_transient_error = retry(
+    wait=wait_random_exponential(min=1, max=20),
+    stop=stop_after_attempt(6),
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    reraise=True,
+)
+
+
+def _embedding_inputs(contents: List[str]) -> List[str]:
+    # replace newlines, which can negatively affect performance.
+    return [content.replace("\n", " ") for content in contents]
+
+
+def _embedding_vectors(res) -> List[List[float]]:
+    return [i["embedding"] for i in sorted(res["data"], key=lambda i: i["index"])]
+
+
+@retry_on_transient_error
+def embeddings(contents: List[str], model: str = EMBEDDING_MODEL) -> List[List[float]]:
+    res = openai.Embedding.create(input=_embedding_inputs(contents), engine=model)
+    return _embedding_vectors(res)
+
+
+@retry_on_transient_error
+async def aembeddings(
+    contents: List[str], model: str = EMBEDDING_MODEL
+) -> List[List[float]]:
+    res = await openai.Embedding.acreate(
+        input=_embedding_inputs(contents), engine=model
+    )
+    return _embedding_vectors(res)
+
+
+@retry_on_transient_error
 def chat_completion(messages: List[Dict[str, str]], temperature=0.2):
     return openai.ChatCompletion.create(
         messages=messages, model=COMPLETION_MODEL, temperature=temperature
     )
 
 
+@retry_on_transient_error
+async def achat_completion(messages: List[Dict[str, str]], temperature=0.2):
+    return await openai.ChatCompletion.acreate(
+        messages=messages, model=COMPLETION_MODEL, temperature=temperature
+    )
+
+
+@retry_on_transient_error
+def chat_completion_stream(messages: List[Dict[str, str]], temperature=0.2):
+    return openai.ChatCompletion.create(
+        messages=messages, model=COMPLETION_MODEL, temperature=temperature, stream=True
+    )
+
+
+@retry_on_transient_error
+async def achat_completion_stream(messages: List[Dict[str, str]], temperature=0.2):
+    return await openai.ChatCompletion.acreate(
+        messages=messages, model=COMPLETION_MODEL, temperature=temperature, stream=True
+    )
+
+
+def _chunk_delta(chunk) -> str:
+    return chunk["choices"][0]["delta"].get("content") or ""
+
+
 def price_for_completion(n_tokens: int) -> float:
     return float(n_tokens) / 1000.0 * 0.002
 
@@ -30,24 +105,100 @@ def price_for_embedding(n_tokens: int) -> float:
 class Openai(EmbeddingProvider):
     """OpenAI embedding"""
 
-    def __init__(self, temperature: float = 0.2):
+    def __init__(
+        self,
+        temperature: float = 0.2,
+        embedding_batch_size: int = EMBEDDING_MAX_BATCH_SIZE,
+    ):
         self.embedding_model = EMBEDDING_MODEL
         self.temperature = float(temperature)
+        self.embedding_batch_size = max(
+            1, min(int(embedding_batch_size), EMBEDDING_MAX_BATCH_SIZE)
+        )
 
     def embed(self, content: str) -> List[float]:
         """Embed a piece of text into a vector"""
-        return get_embedding(content, engine=self.embedding_model)
+        return embeddings([content], model=self.embedding_model)[0]
+
+    def get_model_name(self) -> str:
+        return self.embedding_model
+
+    def embed_many(self, contents: List[str]) -> List[List[float]]:
+        """Embed a batch of texts, one API request per `embedding_batch_size` texts"""
+        res: List[List[float]] = []
+        for start in range(0, len(contents), self.embedding_batch_size):
+            res.extend(
+                embeddings(
+                    contents[start : start + self.embedding_batch_size],
+                    model=self.embedding_model,
+                )
+            )
+        return res
 
     def completion(self):
         openai.ChatCompletion.create()
 
-    def chat_completion(self, messages: List[Dict[str, str]]) -> str:
-        res = chat_completion(messages, temperature=self.temperature)
-        usage = res["usage"]["total_tokens"]
+    async def aembed(self, content: str) -> List[float]:
+        """Embed a piece of text into a vector"""
+        return (await aembeddings([content], model=self.embedding_model))[0]
+
+    async def aembed_many(self, contents: List[str]) -> List[List[float]]:
+        """Embed a batch of texts, one API request per `embedding_batch_size` texts"""
+        res: List[List[float]] = []
+        for start in range(0, len(contents), self.embedding_batch_size):
+            res.extend(
+                await aembeddings(
+                    contents[start : start + self.embedding_batch_size],
+                    model=self.embedding_model,
+                )
+            )
+        return res
+
+    def _completion_result(self, res) -> Tuple[str, Dict[str, int]]:
+        usage = dict(res["usage"])
         logging.info(
             "chat-completion total tokens: %s, cost %s$",
-            usage,
-            price_for_completion(usage),
+            usage["total_tokens"],
+            price_for_completion(usage["total_tokens"]),
         )
 
-        return res["choices"][0]["message"]["content"]
+        return res["choices"][0]["message"]["content"], usage
+
+    def chat_completion_with_usage(
+        self, messages: List[Dict[str, str]]
+    ) -> Tuple[str, Dict[str, int]]:
+        """Complete the messages, along with the token usage of the completion"""
+        res = chat_completion(messages, temperature=self.temperature)
+        return self._completion_result(res)
+
+    async def achat_completion_with_usage(
+        self, messages: List[Dict[str, str]]
+    ) -> Tuple[str, Dict[str, int]]:
+        res = await achat_completion(messages, temperature=self.temperature)
+        return self._completion_result(res)
+
+    def chat_completion(self, messages: List[Dict[str, str]]) -> str:
+        return self.chat_completion_with_usage(messages)[0]
+
+    async def achat_completion(self, messages: List[Dict[str, str]]) -> str:
+        return (await self.achat_completion_with_usage(messages))[0]
+
+    def chat_completion_stream(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        """Yield the completion content as it is generated
+
+        Only opening the stream is retried, a stream failing midway raises.
+        """
+        for chunk in chat_completion_stream(messages, temperature=self.temperature):
+            delta = _chunk_delta(chunk)
+            if delta:
+                yield delta
+
+    async def achat_completion_stream(
+        self, messages: List[Dict[str, str]]
+    ) -> AsyncIterator[str]:
+        """Yield the completion content as it is generated"""
+        stream = await achat_completion_stream(messages, temperature=self.temperature)
+        async for chunk in stream:
+            delta = _chunk_delta(chunk)
+            if delta:
+                yield delta
@@ -0,0 +1,70 @@
+"""Token bucket rate limiter for OpenAI requests"""
+
+import asyncio
+import threading
+import time
+from typing import Optional
+
+
+class RateLimiter:
+    """Paces callers to at most `requests_per_minute` requests and `tokens_per_minute` tokens
+
+    Both buckets hold up to one minute of budget and refill continuously. A caller
+    reserves its budget up front and then sleeps until the buckets are back in
+    credit, so concurrent callers are served in arrival order without spinning.
+    A limit of None disables that bucket.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+    ):
+        self.requests_per_minute = (
+            float(requests_per_minute) if requests_per_minute else None
+        )
+        self.tokens_per_minute = float(tokens_per_minute) if tokens_per_minute else None
+        self._lock = threading.Lock()
+        self._requests = self.requests_per_minute or 0.0
+        self._tokens = self.tokens_per_minute or 0.0
+        self._updated_at = time.monotonic()
+
+    def _reserve(self, n_tokens: int) -> float:
+        """Reserve budget for one request, returns the seconds to wait before sending it"""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated_at
+            self._updated_at = now
+
+            wait_secs = 0.0
+            if self.requests_per_minute:
+                self._requests = min(
+                    self.requests_per_minute,
+                    self._requests + elapsed * self.requests_per_minute / 60.0,
+                )
+                self._requests -= 1
+                wait_secs = max(
+                    wait_secs, -self._requests * 60.0 / self.requests_per_minute
+                )
+            if self.tokens_per_minute:
+                self._tokens = min(
+                    self.tokens_per_minute,
+                    self._tokens + elapsed * self.tokens_per_minute / 60.0,
+                )
+                self._tokens -= n_tokens
+                wait_secs = max(
+                    wait_secs, -self._tokens * 60.0 / self.tokens_per_minute
+                )
+            return wait_secs
+
+    def acquire(self, n_tokens: int = 0):
+        """Block until a request of `n_tokens` tokens may be sent"""
+        wait_secs = self._reserve(n_tokens)
+        if wait_secs > 0:
+            time.sleep(wait_secs)
+
+    async def aacquire(self, n_tokens: int = 0):
+        """Wait until a request of `n_tokens` tokens may be sent"""
+        wait_secs = self._reserve(n_tokens)
+        if wait_secs > 0:
+            await asyncio.sleep(wait_secs)
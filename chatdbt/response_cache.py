@@ -0,0 +1,133 @@
+"""Cache chat completion responses in front of the completion api"""
+
+import json
+import math
+import threading
+import time
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+from chatdbt.lru_cache import LRUCache
+from chatdbt.model import content_hash
+
+CACHE_HIT_EXACT = "exact"
+CACHE_HIT_SEMANTIC = "semantic"
+
+
+class CachedResponse(NamedTuple):
+    """A cached completion response, and the unique ids of the docs it is based on"""
+
+    response: str
+    doc_ids: FrozenSet[str]
+
+
+class _SemanticEntry(NamedTuple):
+    created_at: float
+    vector: List[float]
+    cached: CachedResponse
+
+
+def _normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+def messages_key(messages: List[Dict[str, str]]) -> str:
+    """Key of a list of chat completion messages"""
+    return content_hash(json.dumps(messages, sort_keys=True))
+
+
+class ResponseCache:
+    """Two-tier cache of chat completion responses
+
+    The exact tier is keyed on the assembled completion messages. The semantic
+    tier is keyed on the prompt context, which is the messages without the user
+    query, and returns the response of a cached query whose embedding is at least
+    `similarity_threshold` cosine-similar to the query. As both keys include the
+    contents of the retrieved docs, a response is never reused once the docs it
+    is based on change; `invalidate` also frees such responses right away.
+
+    Both tiers keep up to `max_entries` entries for `ttl_secs` seconds, the
+    semantic tier compares a query with up to `max_queries_per_context` queries.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_secs: Optional[float] = 3600,
+        similarity_threshold: float = 0.95,
+        max_queries_per_context: int = 16,
+    ):
+        ttl = float(ttl_secs) if ttl_secs else None
+        self.similarity_threshold = float(similarity_threshold)
+        self.max_queries_per_context = int(max_queries_per_context)
+        self._exact: LRUCache[CachedResponse] = LRUCache(max_entries, ttl)
+        self._semantic: LRUCache[List[_SemanticEntry]] = LRUCache(max_entries, ttl)
+        # semantic entries of a context are replaced as a whole
+        self._semantic_lock = threading.Lock()
+
+    def _semantic_entries(self, context_key: str) -> List[_SemanticEntry]:
+        ttl_secs = self._semantic.ttl_secs
+        now = time.monotonic()
+        return [
+            entry
+            for entry in self._semantic.get(context_key) or []
+            if ttl_secs is None or now - entry.created_at <= ttl_secs
+        ]
+
+    def get(
+        self,
+        messages: List[Dict[str, str]],
+        context_key: str,
+        vector: List[float],
+    ) -> Optional[Tuple[CachedResponse, str]]:
+        """Get a cached response of the messages, and which tier it comes from"""
+        cached = self._exact.get(messages_key(messages))
+        if cached is not None:
+            return cached, CACHE_HIT_EXACT
+        # queries retrieved without embedding only use the exact tier
+        if not vector:
+            return None
+
+        vector = _normalize(vector)
+        best: Optional[CachedResponse] = None
+        best_similarity = self.similarity_threshold
+        for entry in self._semantic_entries(context_key):
+            similarity = sum(a * b for a, b in zip(vector, entry.vector))
+            if similarity >= best_similarity:
+                best, best_similarity = entry.cached, similarity
+        return (best, CACHE_HIT_SEMANTIC) if best is not None else None
+
+    def put(
+        self,
+        messages: List[Dict[str, str]],
+        context_key: str,
+        vector: List[float],
+        cached: CachedResponse,
+    ):
+        self._exact.put(messages_key(messages), cached)
+        if not vector:
+            return
+        entry = _SemanticEntry(time.monotonic(), _normalize(vector), cached)
+        with self._semantic_lock:
+            entries = self._semantic_entries(context_key) + [entry]
+            self._semantic.put(context_key, entries[-self.max_queries_per_context :])
+
+    def invalidate(self, doc_ids: List[str]):
+        """Drop the responses based on any of the docs"""
+        stale = set(doc_ids)
+        if not stale:
+            return
+        for key, cached in self._exact.items():
+            if cached.doc_ids & stale:
+                self._exact.pop(key)
+        with self._semantic_lock:
+            for key, entries in self._semantic.items():
+                kept = [i for i in entries if not i.cached.doc_ids & stale]
+                if not kept:
+                    self._semantic.pop(key)
+                elif len(kept) < len(entries):
+                    self._semantic.put(key, kept)
+
+    def clear(self):
+        self._exact.clear()
+        self._semantic.clear()
@@ -1,11 +1,29 @@
 import functools
 import logging
 import os
-from typing import Optional, cast, Any, Dict
+from typing import List, Optional, cast, Any, Dict
 
-from chatdbt.chat import ChatBot
+from chatdbt.chat import (
+    ChatBot,
+    DocChanges,
+    DEFAULT_INDEX_BATCH_SIZE,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_MEMORY_FLUSH_INTERVAL_SECS,
+)
+from chatdbt.context_packer import DEFAULT_CONTEXT_MAX_TOKENS
 from chatdbt.dbt_doc_resolver import get_dbt_doc_resolver
-from chatdbt.model import ChatMessage, DBTDocResolver, TikTokenProvider, VectorStorage
+from chatdbt.embedding_cache import get_embedding_cache
+from chatdbt.instrumentation import get_instrumentation_callback
+from chatdbt.message_store import get_message_store
+from chatdbt.model import (
+    ChatMessage,
+    DBTDocResolver,
+    EmbeddingCache,
+    InstrumentationCallback,
+    MessageStore,
+    TikTokenProvider,
+    VectorStorage,
+)
 from chatdbt.tiktoken_provider import get_tiktoken_provider
 from chatdbt.vector_storage import get_vector_storage
 
@@ -16,12 +34,31 @@ ENV_VAR_DBT_DOC_RESOLVER_TYPE = "CHATDBT_DBT_DOC_RESOLVER_TYPE"
 ENV_VAR_DBT_DOC_RESOLVER_CONFIG_PREFIX = "CHATDBT_DBT_DOC_RESOLVER_CONFIG_"
 
 ENV_VAR_I18N = "CHATDBT_I18N"
+ENV_VAR_MAX_CONCURRENCY = "CHATDBT_MAX_CONCURRENCY"
+ENV_VAR_MIN_SIMILARITY = "CHATDBT_MIN_SIMILARITY"
+ENV_VAR_CONTEXT_MAX_TOKENS = "CHATDBT_CONTEXT_MAX_TOKENS"
+ENV_VAR_RETRIEVAL_MODE = "CHATDBT_RETRIEVAL_MODE"
+ENV_VAR_LEXICAL_SKIP_EMBEDDING = "CHATDBT_LEXICAL_SKIP_EMBEDDING"
+ENV_VAR_MEMORY_FLUSH_INTERVAL_SECS = "CHATDBT_MEMORY_FLUSH_INTERVAL_SECS"
 
 ENV_VAR_TIKTOKEN_PROVIDER_TYPE = "CHATDBT_TIKTOKEN_PROVIDER_TYPE"
 ENV_VAR_TIKTOKEN_PROVIDER_CONFIG_PREFIX = "CHATDBT_TIKTOKEN_PROVIDER_CONFIG_"
 
 ENV_VAR_OPENAI_CONFIG_PREFIX = "CHATDBT_OPENAI_CONFIG_"
 
+ENV_VAR_EMBEDDING_CACHE_TYPE = "CHATDBT_EMBEDDING_CACHE_TYPE"
+ENV_VAR_EMBEDDING_CACHE_CONFIG_PREFIX = "CHATDBT_EMBEDDING_CACHE_CONFIG_"
+ENV_VAR_QUERY_EMBEDDING_CACHE_CONFIG_PREFIX = "CHATDBT_QUERY_EMBEDDING_CACHE_CONFIG_"
+
+ENV_VAR_DOC_MANAGER_CONFIG_PREFIX = "CHATDBT_DOC_MANAGER_CONFIG_"
+ENV_VAR_RESPONSE_CACHE_CONFIG_PREFIX = "CHATDBT_RESPONSE_CACHE_CONFIG_"
+
+ENV_VAR_MESSAGE_STORE_TYPE = "CHATDBT_MESSAGE_STORE_TYPE"
+ENV_VAR_MESSAGE_STORE_CONFIG_PREFIX = "CHATDBT_MESSAGE_STORE_CONFIG_"
+
+ENV_VAR_INSTRUMENTATION_TYPE = "CHATDBT_INSTRUMENTATION_TYPE"
+ENV_VAR_INSTRUMENTATION_CONFIG_PREFIX = "CHATDBT_INSTRUMENTATION_CONFIG_"
+
 
 class _Global:
     chat_instance: Optional[ChatBot] = None
@@ -34,6 +71,18 @@ def setup_shortcut(
     tiktoken_provider: Optional[TikTokenProvider] = None,
     openai_config: Optional[Dict[str, Any]] = None,
     i18n: str = "en-us",
+    embedding_cache: Optional[EmbeddingCache] = None,
+    query_embedding_cache_config: Optional[Dict[str, Any]] = None,
+    min_similarity: Optional[float] = None,
+    doc_manager_config: Optional[Dict[str, Any]] = None,
+    context_max_tokens: int = DEFAULT_CONTEXT_MAX_TOKENS,
+    response_cache_config: Optional[Dict[str, Any]] = None,
+    message_store: Optional[MessageStore] = None,
+    retrieval_mode: str = "vector",
+    lexical_skip_embedding: bool = False,
+    callbacks: Optional[List[InstrumentationCallback]] = None,
+    memory_flush_interval_secs: float = DEFAULT_MEMORY_FLUSH_INTERVAL_SECS,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
 ):
     logging.basicConfig(level=logging.INFO)
 
@@ -43,6 +92,18 @@ def setup_shortcut(
         tiktoken_provider,
         openai_config,
         i18n,
+        embedding_cache,
+        query_embedding_cache_config,
+        min_similarity=min_similarity,
+        doc_manager_config=doc_manager_config,
+        context_max_tokens=context_max_tokens,
+        response_cache_config=response_cache_config,
+        message_store=message_store,
+        retrieval_mode=retrieval_mode,
+        lexical_skip_embedding=lexical_skip_embedding,
+        callbacks=callbacks,
+        memory_flush_interval_secs=memory_flush_interval_secs,
+        max_concurrency=max_concurrency,
     )
     _Global.chat_instance_init = True
 
@@ -91,12 +152,83 @@ def setup_shortcut_via_env() -> None:
         if k.startswith(ENV_VAR_OPENAI_CONFIG_PREFIX)
     }
 
+    embedding_cache: Optional[EmbeddingCache] = None
+    embedding_cache_type = os.environ.get(ENV_VAR_EMBEDDING_CACHE_TYPE)
+    embedding_cache_config = {
+        k.replace(ENV_VAR_EMBEDDING_CACHE_CONFIG_PREFIX, "").lower(): v
+        for k, v in os.environ.items()
+        if k.startswith(ENV_VAR_EMBEDDING_CACHE_CONFIG_PREFIX)
+    }
+    if embedding_cache_type is not None:
+        embedding_cache = get_embedding_cache(
+            embedding_cache_type, embedding_cache_config
+        )
+
+    query_embedding_cache_config = {
+        k.replace(ENV_VAR_QUERY_EMBEDDING_CACHE_CONFIG_PREFIX, "").lower(): v
+        for k, v in os.environ.items()
+        if k.startswith(ENV_VAR_QUERY_EMBEDDING_CACHE_CONFIG_PREFIX)
+    }
+
+    min_similarity = os.environ.get(ENV_VAR_MIN_SIMILARITY)
+
+    doc_manager_config = {
+        k.replace(ENV_VAR_DOC_MANAGER_CONFIG_PREFIX, "").lower(): v
+        for k, v in os.environ.items()
+        if k.startswith(ENV_VAR_DOC_MANAGER_CONFIG_PREFIX)
+    }
+
+    # responses are only cached when the response cache is configured
+    response_cache_config = {
+        k.replace(ENV_VAR_RESPONSE_CACHE_CONFIG_PREFIX, "").lower(): v
+        for k, v in os.environ.items()
+        if k.startswith(ENV_VAR_RESPONSE_CACHE_CONFIG_PREFIX)
+    }
+
+    message_store: Optional[MessageStore] = None
+    message_store_type = os.environ.get(ENV_VAR_MESSAGE_STORE_TYPE)
+    message_store_config = {
+        k.replace(ENV_VAR_MESSAGE_STORE_CONFIG_PREFIX, "").lower(): v
+        for k, v in os.environ.items()
+        if k.startswith(ENV_VAR_MESSAGE_STORE_CONFIG_PREFIX)
+    }
+    if message_store_type is not None:
+        message_store = get_message_store(message_store_type, message_store_config)
+
+    callbacks: List[InstrumentationCallback] = []
+    instrumentation_type = os.environ.get(ENV_VAR_INSTRUMENTATION_TYPE)
+    instrumentation_config = {
+        k.replace(ENV_VAR_INSTRUMENTATION_CONFIG_PREFIX, "").lower(): v
+        for k, v in os.environ.items()
+        if k.startswith(ENV_VAR_INSTRUMENTATION_CONFIG_PREFIX)
+    }
+    if instrumentation_type is not None:
+        callbacks.append(
+            get_instrumentation_callback(instrumentation_type, instrumentation_config)
+        )
+
     setup_shortcut(
         get_vector_storage(vector_storage_type, vector_storage_config),
         get_dbt_doc_resolver(dbt_doc_resolver_type, dbt_doc_resolver_config),
         tiktoken_provider,
         openai_config,
         i18n,
+        embedding_cache,
+        query_embedding_cache_config,
+        float(min_similarity) if min_similarity else None,
+        doc_manager_config,
+        int(os.environ.get(ENV_VAR_CONTEXT_MAX_TOKENS, DEFAULT_CONTEXT_MAX_TOKENS)),
+        response_cache_config or None,
+        message_store,
+        os.environ.get(ENV_VAR_RETRIEVAL_MODE, "vector"),
+        os.environ.get(ENV_VAR_LEXICAL_SKIP_EMBEDDING, "").lower() in ("true", "1"),
+        callbacks,
+        float(
+            os.environ.get(
+                ENV_VAR_MEMORY_FLUSH_INTERVAL_SECS, DEFAULT_MEMORY_FLUSH_INTERVAL_SECS
+            )
+        ),
+        int(os.environ.get(ENV_VAR_MAX_CONCURRENCY, DEFAULT_MAX_CONCURRENCY)),
     )
 
 
@@ -120,10 +252,25 @@ def suggest_table(query: str, k: int = 5):
 
 
 @ensure_chat_init
-def index_dbt_docs() -> None:
+def index_dbt_docs(
+    batch_size: int = DEFAULT_INDEX_BATCH_SIZE,
+    incremental: bool = False,
+    workers: int = 1,
+    requests_per_minute: Optional[float] = None,
+    tokens_per_minute: Optional[float] = None,
+) -> None:
     """Index dbt docs."""
     chat: ChatBot = cast(ChatBot, _Global.chat_instance)
-    return chat.index_dbt_docs()
+    return chat.index_dbt_docs(
+        batch_size, incremental, workers, requests_per_minute, tokens_per_minute
+    )
+
+
+@ensure_chat_init
+def reload_dbt_docs(reindex: bool = False) -> DocChanges:
+    """Reload dbt docs if the dbt artifacts changed."""
+    chat: ChatBot = cast(ChatBot, _Global.chat_instance)
+    return chat.reload_dbt_docs(reindex)
 
 
 @ensure_chat_init
@@ -133,8 +280,79 @@ def suggest_sql(query: str, k: int = 5):
     return chat.suggest_sql(query, k)
 
 
+@ensure_chat_init
+def suggest_table_many(queries: List[str], k: int = 5):
+    """Suggest tables for many queries, failed queries get their exception."""
+    chat: ChatBot = cast(ChatBot, _Global.chat_instance)
+    return chat.suggest_table_many(queries, k)
+
+
+@ensure_chat_init
+def suggest_sql_many(queries: List[str], k: int = 5):
+    """Suggest sql for many queries, failed queries get their exception."""
+    chat: ChatBot = cast(ChatBot, _Global.chat_instance)
+    return chat.suggest_sql_many(queries, k)
+
+
+@ensure_chat_init
+def suggest_table_stream(query: str, k: int = 5, echo: bool = True):
+    """Suggest table based on query, printing the response as it is generated.
+
+    With `echo=False`, return the `ChatMessageStream` instead of printing it.
+    """
+    chat: ChatBot = cast(ChatBot, _Global.chat_instance)
+    stream = chat.suggest_table_stream(query, k)
+    return stream.echo() if echo else stream
+
+
+@ensure_chat_init
+def suggest_sql_stream(query: str, k: int = 5, echo: bool = True):
+    """Suggest sql based on query, printing the response as it is generated.
+
+    With `echo=False`, return the `ChatMessageStream` instead of printing it.
+    """
+    chat: ChatBot = cast(ChatBot, _Global.chat_instance)
+    stream = chat.suggest_sql_stream(query, k)
+    return stream.echo() if echo else stream
+
+
 @ensure_chat_init
 def memory_message(message: ChatMessage):
     """Memory chat message."""
     chat: ChatBot = cast(ChatBot, _Global.chat_instance)
     return chat.memory_message(message)
+
+
+@ensure_chat_init
+async def asuggest_table(query: str, k: int = 5):
+    """Suggest table based on query."""
+    chat: ChatBot = cast(ChatBot, _Global.chat_instance)
+    return await chat.asuggest_table(query, k)
+
+
+@ensure_chat_init
+async def aindex_dbt_docs(
+    batch_size: int = DEFAULT_INDEX_BATCH_SIZE,
+    incremental: bool = False,
+    requests_per_minute: Optional[float] = None,
+    tokens_per_minute: Optional[float] = None,
+) -> None:
+    """Index dbt docs."""
+    chat: ChatBot = cast(ChatBot, _Global.chat_instance)
+    return await chat.aindex_dbt_docs(
+        batch_size, incremental, requests_per_minute, tokens_per_minute
+    )
+
+
+@ensure_chat_init
+async def asuggest_sql(query: str, k: int = 5):
+    """Suggest sql based on query."""
+    chat: ChatBot = cast(ChatBot, _Global.chat_instance)
+    return await chat.asuggest_sql(query, k)
+
+
+@ensure_chat_init
+async def amemory_message(message: ChatMessage):
+    """Memory chat message."""
+    chat: ChatBot = cast(ChatBot, _Global.chat_instance)
+    return await chat.amemory_message(message)
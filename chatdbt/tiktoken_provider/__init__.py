@@ -10,5 +10,9 @@ def get_tiktoken_provider(
         from .tiktoken_http_server import TikTokenHttpServerProvider
 
         return TikTokenHttpServerProvider(**config)
+    elif provider_type == "tiktoken":
+        from .tiktoken_local import TikTokenLocalProvider
+
+        return TikTokenLocalProvider(**config)
     else:
         raise NotImplementedError
@@ -1,22 +1,35 @@
 import logging
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from chatdbt.model import TikTokenProvider
 
 
 class TikTokenHttpServerProvider(TikTokenProvider):
-    """Count token using a"""
+    """Count token using a tiktoken http server
 
-    def __init__(self, api_base: str, timeout_secs: int = 5) -> None:
+    Requests share a pooled keep-alive session, batches are counted with up to
+    `max_workers` requests in flight.
+    """
+
+    def __init__(
+        self, api_base: str, timeout_secs: int = 5, max_workers: int = 8
+    ) -> None:
         self._api_base = api_base.rstrip("/")
-        self._timeout_secs = timeout_secs
+        self._timeout_secs = float(timeout_secs)
+        self._max_workers = max(1, int(max_workers))
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._max_workers)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
 
     def count_token(self, prompt: str, model: str) -> Optional[int]:
         """Count tokens for a prompt"""
 
-        req = requests.get(
+        req = self._session.get(
             url=f"{self._api_base}/tokenize",
             json={"prompt": prompt, "model": model},
             timeout=self._timeout_secs,
@@ -28,3 +41,14 @@ class TikTokenHttpServerProvider(TikTokenProvider):
             return None
         tokens = req.json()["tokens"]
         return len(tokens)
+
+    def count_tokens(self, prompts: List[str], model: str) -> List[Optional[int]]:
+        """Count tokens for a batch of prompts with bounded parallel requests"""
+        if len(prompts) <= 1:
+            return [self.count_token(prompt, model) for prompt in prompts]
+        with ThreadPoolExecutor(
+            max_workers=min(self._max_workers, len(prompts))
+        ) as executor:
+            return list(
+                executor.map(lambda prompt: self.count_token(prompt, model), prompts)
+            )
@@ -0,0 +1,89 @@
+import logging
+import os
+import threading
+import types
+from typing import Any, Dict, Optional
+
+from chatdbt.lru_cache import LRUCache
+from chatdbt.model import TikTokenProvider, content_hash
+
+
+def _unsupported_local_encoding(*args: Any, **kwargs: Any):
+    raise ValueError("Unsupported local encoding, it is not a .tiktoken file")
+
+
+class TikTokenLocalProvider(TikTokenProvider):
+    """Count tokens in process with tiktoken
+
+    With `encoding_dir`, BPE ranks are read from `<encoding>.tiktoken` files in
+    that directory (e.g. `cl100k_base.tiktoken`), so no network access is needed.
+    Without it, tiktoken downloads and caches the encodings itself.
+    Counts are memoized by content hash.
+    """
+
+    def __init__(self, encoding_dir: Optional[str] = None, cache_size: int = 100000):
+        try:
+            import tiktoken  # noqa: F401 pylint: disable=import-outside-toplevel,unused-import
+        except ImportError as ex:
+            raise RuntimeError(
+                f"{ex}\nPlease install tiktoken to use TikTokenLocalProvider\npip install chatdbt[tiktoken]"
+            )  # pylint: disable=raise-missing-from
+
+        self._encoding_dir = encoding_dir
+        self._encodings: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._counts: LRUCache[int] = LRUCache(int(cache_size))
+
+    def _load_encoding(self, encoding_name: str):
+        import tiktoken  # pylint: disable=import-outside-toplevel
+        from tiktoken.load import (  # pylint: disable=import-outside-toplevel
+            load_tiktoken_bpe,
+        )
+        from tiktoken_ext import (  # pylint: disable=import-outside-toplevel
+            openai_public,
+        )
+
+        if self._encoding_dir is None:
+            return tiktoken.get_encoding(encoding_name)
+        constructor = openai_public.ENCODING_CONSTRUCTORS.get(encoding_name)
+        if constructor is None:
+            raise ValueError(f"Unsupported local encoding: {encoding_name}")
+        logging.debug("loading encoding %s from %s", encoding_name, self._encoding_dir)
+        path = os.path.join(self._encoding_dir, f"{encoding_name}.tiktoken")
+        # run tiktoken's own constructor, so the pattern and special tokens
+        # match the installed tiktoken, with the BPE ranks read from `path`
+        local_constructor = types.FunctionType(
+            constructor.__code__,
+            {
+                **constructor.__globals__,
+                "load_tiktoken_bpe": lambda *args, **kwargs: load_tiktoken_bpe(path),
+                "data_gym_to_mergeable_bpe_ranks": _unsupported_local_encoding,
+            },
+        )
+        return tiktoken.Encoding(**local_constructor())
+
+    def _get_encoding(self, encoding_name: str):
+        with self._lock:
+            if encoding_name not in self._encodings:
+                self._encodings[encoding_name] = self._load_encoding(encoding_name)
+            return self._encodings[encoding_name]
+
+    def count_token(self, prompt: str, model: str) -> Optional[int]:
+        """Count tokens for a prompt"""
+        from tiktoken.model import (  # pylint: disable=import-outside-toplevel
+            encoding_name_for_model,
+        )
+
+        try:
+            encoding_name = encoding_name_for_model(model)
+        except KeyError:
+            logging.warning("Failed to count token, unknown model %s", model)
+            return None
+
+        key = (encoding_name, content_hash(prompt))
+        n_tokens = self._counts.get(key)
+        if n_tokens is None:
+            encoding = self._get_encoding(encoding_name)
+            n_tokens = len(encoding.encode_ordinary(prompt))
+            self._counts.put(key, n_tokens)
+        return n_tokens
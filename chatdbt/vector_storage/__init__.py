@@ -14,5 +14,18 @@ def get_vector_storage(
         from chatdbt.vector_storage.pgvector import PGVectorStorage
 
         return PGVectorStorage(**vector_storage_config)
+    elif vector_storage_type == "numpy":
+        from chatdbt.vector_storage.numpy_storage import NumpyVectorStorage
+
+        return NumpyVectorStorage(**vector_storage_config)
+    elif vector_storage_type == "replica":
+        from chatdbt.vector_storage.replica import ReplicaVectorStorage
+
+        remote_config = dict(vector_storage_config)
+        remote_type = remote_config.pop("remote_type")
+        refresh_interval_secs = remote_config.pop("refresh_interval_secs", None)
+        return ReplicaVectorStorage(
+            get_vector_storage(remote_type, remote_config), refresh_interval_secs
+        )
     else:
         raise ValueError("Unknown vector storage type")
@@ -1,14 +1,24 @@
 import logging
-from typing import List
-from chatdbt.model import DocMetaContainer, VectorStorage, Doc
+import threading
+from typing import List, Optional
+from chatdbt.model import DocMetaContainer, DocType, SearchResult, VectorStorage, Doc
 
 
 class AtlasVectorStorage(VectorStorage):
-    """Vector storage using Atlas"""
+    """Vector storage using Atlas
 
-    def __init__(self, api_key: str, project_name: str):
+    Every write to Atlas waits for the project lock, so inserted docs are
+    buffered and written `flush_batch_size` at a time under a single lock.
+    Call `flush()` to write the remaining docs.
+    """
+
+    def __init__(self, api_key: str, project_name: str, flush_batch_size: int = 5000):
         self.api_key = api_key
         self.project_name = project_name
+        self.flush_batch_size = max(1, int(flush_batch_size))
+        self._buffer_lock = threading.Lock()
+        self._buffered_docs: List[Doc] = []
+        self._buffered_vectors: List[List[float]] = []
         try:
             from nomic import AtlasProject  # pylint: disable=import-outside-toplevel
         except ImportError as ex:
@@ -27,16 +37,91 @@ class AtlasVectorStorage(VectorStorage):
 
     def insert_doc(self, doc: Doc, vector: List[float]):
         """Insert a document into the vector storage"""
-        with self.project.wait_for_project_lock():
-            self.project.add_embeddings(
-                data=[doc.get_metadata().dict()], embeddings=[vector]
-            )
+        self.insert_docs([doc], [vector])
+
+    def insert_docs(self, docs: List[Doc], vectors: List[List[float]]):
+        """Buffer a batch of documents, flushing once `flush_batch_size` are buffered"""
+        with self._buffer_lock:
+            self._buffered_docs.extend(docs)
+            self._buffered_vectors.extend(vectors)
+            n_buffered = len(self._buffered_docs)
+        if n_buffered >= self.flush_batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered documents, `flush_batch_size` per `add_embeddings` call
+
+        If a call fails, the documents not written yet stay buffered for the
+        next flush.
+        """
+        with self._buffer_lock:
+            docs, self._buffered_docs = self._buffered_docs, []
+            vectors, self._buffered_vectors = self._buffered_vectors, []
+        if not docs:
+            return
+        logging.debug("flushing %s docs to Atlas", len(docs))
+        written = 0
+        try:
+            with self.project.wait_for_project_lock():
+                for start in range(0, len(docs), self.flush_batch_size):
+                    end = start + self.flush_batch_size
+                    self.project.add_embeddings(
+                        data=[doc.get_metadata().dict() for doc in docs[start:end]],
+                        embeddings=vectors[start:end],
+                    )
+                    written = min(end, len(docs))
+        except BaseException:
+            with self._buffer_lock:
+                # ahead of the docs buffered meanwhile, to keep the insert order
+                self._buffered_docs[:0] = docs[written:]
+                self._buffered_vectors[:0] = vectors[written:]
+            raise
 
     def similarity_search(self, vector: List[float], k: int) -> List[DocMetaContainer]:
         """Search for similar documents in the vector storage"""
+        return [i.meta for i in self.search(vector, k)]
+
+    def search(
+        self,
+        vector: List[float],
+        k: int,
+        doc_types: Optional[List[DocType]] = None,
+        min_similarity: Optional[float] = None,
+    ) -> List[SearchResult]:
+        """Search for similar documents, similarity is one minus the Atlas distance
+
+        Atlas has no filtered vector search, hits are filtered after the search,
+        so fewer than `k` documents may be returned.
+        """
+        return self.search_many([vector], k, doc_types, min_similarity)[0]
+
+    def search_many(
+        self,
+        vectors: List[List[float]],
+        k: int,
+        doc_types: Optional[List[DocType]] = None,
+        min_similarity: Optional[float] = None,
+    ) -> List[List[SearchResult]]:
+        """Search for the documents similar to each vector in one Atlas request"""
+        if not vectors:
+            return []
         with self.project.wait_for_project_lock():
-            neighbors, _ = self.project.projections[0].vector_search([vector], k=k)
-            datas = self.project.get_data(ids=neighbors)
+            neighbors, distances = self.project.projections[0].vector_search(
+                vectors, k=k
+            )
+            datas = self.project.get_data(ids=[i for ids in neighbors for i in ids])
 
-        res = [DocMetaContainer(**datas[idx]) for idx in enumerate(neighbors)]
+        res = []
+        for ids, query_distances in zip(neighbors, distances):
+            query_datas, datas = datas[: len(ids)], datas[len(ids) :]
+            hits = []
+            for data, distance in zip(query_datas, query_distances):
+                meta = DocMetaContainer(**data)
+                similarity = 1 - float(distance)
+                if doc_types is not None and meta.doc_type not in doc_types:
+                    continue
+                if min_similarity is not None and similarity < float(min_similarity):
+                    continue
+                hits.append(SearchResult(meta=meta, similarity=similarity))
+            res.append(hits)
         return res
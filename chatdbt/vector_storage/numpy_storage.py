@@ -0,0 +1,322 @@
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import uuid
+from typing import Any, Dict, Iterable, Iterator, List, Optional, cast
+
+import numpy as np
+
+from chatdbt.model import (
+    Doc,
+    DocMetaContainer,
+    DocType,
+    SearchResult,
+    VectorRecord,
+    VectorStorage,
+)
+
+_VERSIONED_MATRIX_RE = re.compile(r"\.[0-9a-f]{32}\.npy")
+
+
+def _normalize(vectors: "np.ndarray") -> "np.ndarray":
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class NumpyVectorStorage(VectorStorage):
+    """Vector storage keeping L2-normalized float32 embeddings in a numpy matrix
+
+    Cosine similarity search is a single matrix-vector product. With a `path`, the
+    metadata is persisted to `<path>.json` and the matrix to a `<path>.<version>.npy`
+    file named by the metadata, so a save switches both at once; the
+    matrix is memory-mapped when loaded, so a process can serve searches without
+    reading it into memory. The first write of a process copies it into memory.
+    With `autosave`, `flush()` saves the writes made since the last save.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        dimensions: Optional[int] = None,
+        autosave: bool = True,
+    ):
+        self.path = path
+        self.dimensions = int(dimensions) if dimensions else None
+        self.autosave = str(autosave).lower() not in ("false", "0")
+        self._lock = threading.RLock()
+        self._matrix: Optional["np.ndarray"] = None
+        self._size = 0
+        self._unique_ids: List[str] = []
+        self._metas: List[DocMetaContainer] = []
+        self._content_hashes: List[Optional[str]] = []
+        self._positions: Dict[str, int] = {}
+        self._dirty = False
+        self._matrix_version: Optional[str] = None
+
+        if path and os.path.exists(self._metadata_path):
+            self._load()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _matrix_path(self, version: Optional[str] = None) -> str:
+        # files saved before versioned matrices are `<path>.npy`
+        return f"{self.path}.{version}.npy" if version else f"{self.path}.npy"
+
+    @property
+    def _metadata_path(self) -> str:
+        return f"{self.path}.json"
+
+    def _load(self):
+        with open(self._metadata_path, "r", encoding="utf8") as metadata_f:
+            metadata = json.load(metadata_f)
+        self.dimensions = metadata["dimensions"]
+        self._unique_ids = metadata["unique_ids"]
+        self._metas = [DocMetaContainer.parse_obj(i) for i in metadata["metas"]]
+        self._content_hashes = metadata["content_hashes"]
+        self._positions = {i: idx for idx, i in enumerate(self._unique_ids)}
+        self._size = len(self._unique_ids)
+        self._matrix_version = metadata.get("matrix_version")
+        matrix_path = self._matrix_path(self._matrix_version)
+        if self._size:
+            self._matrix = np.load(matrix_path, mmap_mode="r")
+        logging.debug("loaded %s vectors from %s", self._size, matrix_path)
+
+    def save(self):
+        """Persist the matrix and metadata, replacing the previous ones atomically
+
+        The matrix is written to a new file first, then the metadata naming it
+        replaces the previous metadata, so a crash never pairs a matrix with the
+        metadata of another save.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            matrix = (
+                self._matrix[: self._size]
+                if self._matrix is not None
+                else np.zeros((0, self.dimensions or 0), dtype=np.float32)
+            )
+            version = uuid.uuid4().hex
+            np.save(self._matrix_path(version), matrix)
+            tmp_metadata_path = f"{self._metadata_path}.tmp"
+            with open(tmp_metadata_path, "w", encoding="utf8") as metadata_f:
+                json.dump(
+                    {
+                        "dimensions": self.dimensions,
+                        "matrix_version": version,
+                        "unique_ids": self._unique_ids,
+                        "metas": [json.loads(i.json()) for i in self._metas],
+                        "content_hashes": self._content_hashes,
+                    },
+                    metadata_f,
+                )
+            os.replace(tmp_metadata_path, self._metadata_path)
+            self._matrix_version = version
+            self._dirty = False
+            self._remove_stale_matrices()
+
+    def _remove_stale_matrices(self):
+        """Remove the matrices of previous saves, and of saves which crashed"""
+        path = str(self.path)
+        stale_paths = [self._matrix_path()] + [
+            i
+            for i in glob.glob(f"{glob.escape(path)}.*.npy")
+            if _VERSIONED_MATRIX_RE.fullmatch(i[len(path) :])
+        ]
+        for stale_path in stale_paths:
+            if stale_path == self._matrix_path(self._matrix_version):
+                continue
+            try:
+                # processes which memory-mapped the file can still read it
+                os.remove(stale_path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                logging.debug("Failed to remove %s", stale_path, exc_info=True)
+
+    def flush(self):
+        with self._lock:
+            if self.autosave and self._dirty:
+                self.save()
+
+    def _writable_matrix(self, n_rows: int) -> "np.ndarray":
+        """Get an in-memory matrix with room for at least `n_rows` rows"""
+        assert self.dimensions is not None
+        capacity = 0
+        if self._matrix is not None and not isinstance(self._matrix, np.memmap):
+            capacity = self._matrix.shape[0]
+        if capacity < n_rows:
+            matrix = np.zeros(
+                (max(n_rows, capacity * 2, 16), self.dimensions), dtype=np.float32
+            )
+            if self._matrix is not None:
+                matrix[: self._size] = self._matrix[: self._size]
+            self._matrix = matrix
+            return matrix
+        return cast("np.ndarray", self._matrix)
+
+    def insert_doc(self, doc: Doc, vector: List[float]):
+        self.insert_docs([doc], [vector])
+
+    def insert_docs(self, docs: List[Doc], vectors: List[List[float]]):
+        if not docs:
+            return
+        rows = _normalize(np.asarray(vectors, dtype=np.float32))
+        with self._lock:
+            if self.dimensions is None:
+                self.dimensions = rows.shape[1]
+            if rows.shape[1] != self.dimensions:
+                raise ValueError(
+                    f"Expected {self.dimensions} dimensions, got {rows.shape[1]}"
+                )
+            matrix = self._writable_matrix(self._size + len(docs))
+            for doc, row in zip(docs, rows):
+                unique_id = doc.get_unique_id()
+                position = self._positions.get(unique_id)
+                if position is None:
+                    position = self._size
+                    self._size += 1
+                    self._positions[unique_id] = position
+                    self._unique_ids.append(unique_id)
+                    self._metas.append(doc.get_metadata())
+                    self._content_hashes.append(doc.get_content_hash())
+                else:
+                    self._metas[position] = doc.get_metadata()
+                    self._content_hashes[position] = doc.get_content_hash()
+                matrix[position] = row
+            self._dirty = True
+
+    def search(
+        self,
+        vector: List[float],
+        k: int,
+        doc_types: Optional[List[DocType]] = None,
+        min_similarity: Optional[float] = None,
+    ) -> List[SearchResult]:
+        """Search for similar documents, similarity is cosine similarity"""
+        return self.search_many([vector], k, doc_types, min_similarity)[0]
+
+    def search_many(
+        self,
+        vectors: List[List[float]],
+        k: int,
+        doc_types: Optional[List[DocType]] = None,
+        min_similarity: Optional[float] = None,
+    ) -> List[List[SearchResult]]:
+        """Search for the documents similar to each vector with one matrix product"""
+        with self._lock:
+            if self._matrix is None or not self._size or k <= 0 or not vectors:
+                return [[] for _ in vectors]
+            # searches run the product outside the lock on a snapshot of the
+            # rows, rows upserted meanwhile may be scored before or after the write
+            matrix = self._matrix[: self._size]
+            metas = self._metas[: self._size]
+        queries = _normalize(np.asarray(vectors, dtype=np.float32))
+        # one row of scores per query
+        all_scores = queries @ matrix.T
+        if doc_types is not None:
+            excluded = np.array([meta.doc_type not in doc_types for meta in metas])
+            all_scores[:, excluded] = -np.inf
+        if min_similarity is not None:
+            all_scores[all_scores < float(min_similarity)] = -np.inf
+        return [self._top_k(scores, metas, k) for scores in all_scores]
+
+    @staticmethod
+    def _top_k(
+        scores: np.ndarray, metas: List[DocMetaContainer], k: int
+    ) -> List[SearchResult]:
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [SearchResult(meta=metas[i], similarity=float(scores[i])) for i in top]
+
+    def similarity_search(self, vector: List[float], k: int) -> List[DocMetaContainer]:
+        return [i.meta for i in self.search(vector, k)]
+
+    def list_content_hashes(self, doc_types: List[DocType]) -> Dict[str, Optional[str]]:
+        with self._lock:
+            return {
+                unique_id: content_hash
+                for unique_id, meta, content_hash in zip(
+                    self._unique_ids, self._metas, self._content_hashes
+                )
+                if meta.doc_type in doc_types
+            }
+
+    def list_metas(self, doc_types: List[DocType]) -> Dict[str, DocMetaContainer]:
+        with self._lock:
+            return {
+                unique_id: meta
+                for unique_id, meta in zip(self._unique_ids, self._metas)
+                if meta.doc_type in doc_types
+            }
+
+    def delete_docs(self, unique_ids: List[str]):
+        with self._lock:
+            positions = [self._positions[i] for i in unique_ids if i in self._positions]
+            if not positions or self._matrix is None:
+                return
+            keep = np.ones(self._size, dtype=bool)
+            keep[positions] = False
+            self._matrix = np.ascontiguousarray(self._matrix[: self._size][keep])
+            self._size = int(keep.sum())
+
+            def _kept(items: List[Any]) -> List[Any]:
+                return [item for item, kept in zip(items, keep) if kept]
+
+            self._unique_ids = _kept(self._unique_ids)
+            self._metas = _kept(self._metas)
+            self._content_hashes = _kept(self._content_hashes)
+            self._positions = {i: idx for idx, i in enumerate(self._unique_ids)}
+            self._dirty = True
+
+    def list_records(self) -> Iterator[VectorRecord]:
+        with self._lock:
+            matrix = self._matrix
+            records = list(zip(self._unique_ids, self._metas, self._content_hashes))
+        for idx, (unique_id, meta, content_hash) in enumerate(records):
+            yield VectorRecord(
+                unique_id=unique_id,
+                vector=cast("np.ndarray", matrix)[idx].tolist(),
+                meta=meta,
+                content_hash=content_hash,
+            )
+
+    def load_records(self, records: Iterable[VectorRecord]):
+        """Replace the content of the storage with `records`"""
+        unique_ids: List[str] = []
+        metas: List[DocMetaContainer] = []
+        content_hashes: List[Optional[str]] = []
+        vectors: List[List[float]] = []
+        positions: Dict[str, int] = {}
+        for record in records:
+            position = positions.get(record.unique_id)
+            if position is not None:
+                metas[position] = record.meta
+                content_hashes[position] = record.content_hash
+                vectors[position] = record.vector
+                continue
+            positions[record.unique_id] = len(unique_ids)
+            unique_ids.append(record.unique_id)
+            metas.append(record.meta)
+            content_hashes.append(record.content_hash)
+            vectors.append(record.vector)
+
+        matrix = _normalize(np.asarray(vectors, dtype=np.float32)) if vectors else None
+        with self._lock:
+            if matrix is not None:
+                self.dimensions = matrix.shape[1]
+            self._matrix = matrix
+            self._size = len(unique_ids)
+            self._unique_ids = unique_ids
+            self._metas = metas
+            self._content_hashes = content_hashes
+            self._positions = positions
+            self._dirty = True
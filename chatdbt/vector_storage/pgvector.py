@@ -1,18 +1,47 @@
 import json
 import logging
 import datetime
-from sqlalchemy import Column, create_engine, Integer, VARCHAR, DateTime
+from sqlalchemy import (
+    Column,
+    create_engine,
+    delete,
+    literal,
+    select,
+    text,
+    union_all,
+    Integer,
+    VARCHAR,
+    DateTime,
+)
 from sqlalchemy.dialects.postgresql import insert
 from pgvector.sqlalchemy import Vector
 from sqlalchemy.dialects.postgresql import JSON
-from sqlalchemy.orm import Session, declarative_base
-from chatdbt.model import VectorStorage, Doc, DocMetaContainer
+from sqlalchemy.orm import declarative_base, sessionmaker
+from chatdbt.model import (
+    VectorStorage,
+    VectorRecord,
+    Doc,
+    DocMetaContainer,
+    DocType,
+    SearchResult,
+)
 
-from typing import List
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncEngine
 
 
 Base = declarative_base()
 
+# distance name -> (pgvector operator class, Vector comparator method)
+DISTANCES = {
+    "cosine": ("vector_cosine_ops", "cosine_distance"),
+    "l2": ("vector_l2_ops", "l2_distance"),
+    "inner_product": ("vector_ip_ops", "max_inner_product"),
+}
+INDEX_TYPES = ("ivfflat", "hnsw")
+
 
 class PGVectorStorage(VectorStorage):
     def _orm_for(self, table_name):
@@ -22,6 +51,8 @@ class PGVectorStorage(VectorStorage):
             unique_id = Column(VARCHAR, unique=True)
             embedding = Column(Vector(1536))
             data_metadata = Column(JSON)
+            content_hash = Column(VARCHAR)
+            doc_type = Column(VARCHAR, index=True)
             created_at = Column(DateTime, default=datetime.datetime.utcnow)
             updated_at = Column(
                 DateTime,
@@ -31,50 +62,412 @@ class PGVectorStorage(VectorStorage):
 
         return Item
 
-    def __init__(self, connect_string: str, table_name: str):
+    def __init__(
+        self,
+        connect_string: str,
+        table_name: str,
+        distance: str = "cosine",
+        index_type: Optional[str] = None,
+        ivfflat_lists: int = 100,
+        ivfflat_probes: Optional[int] = None,
+        hnsw_m: int = 16,
+        hnsw_ef_construction: int = 64,
+        hnsw_ef_search: Optional[int] = None,
+        pool_size: int = 10,
+        max_overflow: int = 10,
+        pool_timeout: float = 30,
+        pool_recycle: int = 1800,
+        pool_pre_ping: bool = True,
+    ):
+        """
+        :param distance: distance to search by, one of `cosine`, `l2` or `inner_product`
+        :param index_type: approximate nearest neighbor index to create on the
+            embedding column, `ivfflat` or `hnsw`; no index means exact search
+        :param ivfflat_lists: number of lists of the ivfflat index
+        :param ivfflat_probes: `ivfflat.probes` used by searches, more is slower and more accurate
+        :param hnsw_m: max connections per layer of the hnsw index
+        :param hnsw_ef_construction: candidate list size used to build the hnsw index
+        :param hnsw_ef_search: `hnsw.ef_search` used by searches, more is slower and more accurate
+        :param pool_size: connections kept open in the pool, every operation
+            checks out its own connection so this bounds concurrent operations
+        :param max_overflow: connections opened on top of `pool_size` under load
+        :param pool_timeout: seconds to wait for a connection before giving up
+        :param pool_recycle: seconds after which a connection is replaced
+        :param pool_pre_ping: test connections on checkout, so connections
+            broken by a postgres restart are replaced instead of failing
+        """
+        if distance not in DISTANCES:
+            raise ValueError(f"Unknown distance: {distance}")
+        if index_type is not None and index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {index_type}")
         self.connect_string = connect_string
         self.table_name = table_name
-        self._engine = create_engine(connect_string)
-        self._conn = self._engine.connect()
+        self.distance = distance
+        self.index_type = index_type
+        self.ivfflat_lists = int(ivfflat_lists)
+        self.ivfflat_probes = int(ivfflat_probes) if ivfflat_probes else None
+        self.hnsw_m = int(hnsw_m)
+        self.hnsw_ef_construction = int(hnsw_ef_construction)
+        self.hnsw_ef_search = int(hnsw_ef_search) if hnsw_ef_search else None
+        self._engine_options: Dict[str, Any] = dict(
+            pool_size=int(pool_size),
+            max_overflow=int(max_overflow),
+            pool_timeout=float(pool_timeout),
+            pool_recycle=int(pool_recycle),
+            pool_pre_ping=str(pool_pre_ping).lower() not in ("false", "0"),
+        )
+        self._engine = create_engine(connect_string, **self._engine_options)
+        self._session = sessionmaker(self._engine)
+
+        # created on first use of the async api, bound to the running event loop
+        self._async_engine: Optional["AsyncEngine"] = None
 
         self._table = self._orm_for(table_name)
         self._create_tables()
 
+    def _get_async_engine(self) -> "AsyncEngine":
+        # sqlalchemy's asyncio extension needs greenlet, only required by the async api
+        from sqlalchemy.ext.asyncio import (  # pylint: disable=import-outside-toplevel
+            create_async_engine,
+        )
+
+        if self._async_engine is None:
+            self._async_engine = create_async_engine(
+                self.connect_string, **self._engine_options
+            )
+        return self._async_engine
+
+    def _quote(self, name: str) -> str:
+        return self._engine.dialect.identifier_preparer.quote(name)
+
+    @property
+    def _index_name(self) -> str:
+        return f"{self.table_name}_embedding_{self.index_type}_{self.distance}_idx"
+
     def _create_tables(self):
         Base.metadata.create_all(self._engine)
+        # tables created by older versions have no content_hash or doc_type column
+        table_name = self._quote(self.table_name)
+        with self._engine.begin() as conn:
+            conn.execute(
+                text(
+                    f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS content_hash VARCHAR"
+                )
+            )
+            conn.execute(
+                text(
+                    f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS doc_type VARCHAR"
+                )
+            )
+            # data_metadata holds the metadata serialized as a json string
+            conn.execute(
+                text(
+                    f"UPDATE {table_name} "
+                    "SET doc_type = (data_metadata #>> '{}')::json ->> 'doc_type' "
+                    "WHERE doc_type IS NULL"
+                )
+            )
+        self._create_index()
+
+    def _create_index(self):
+        if self.index_type is None:
+            return
+        if self.index_type == "ivfflat":
+            options = f"lists = {self.ivfflat_lists}"
+        else:
+            options = (
+                f"m = {self.hnsw_m}, ef_construction = {self.hnsw_ef_construction}"
+            )
+        operator_class = DISTANCES[self.distance][0]
+        with self._engine.begin() as conn:
+            conn.execute(
+                text(
+                    f"CREATE INDEX IF NOT EXISTS {self._quote(self._index_name)} "
+                    f"ON {self._quote(self.table_name)} USING {self.index_type} "
+                    f"(embedding {operator_class}) WITH ({options})"
+                )
+            )
+
+    def rebuild_index(self, concurrently: bool = True):
+        """Rebuild the vector index, e.g. after bulk loads
+
+        ivfflat lists are computed from the rows present when the index is built,
+        so an index created on an empty or small table loses recall as it grows.
+
+        :param concurrently: rebuild without blocking writes (postgres 12+),
+            otherwise writes to the table wait until the rebuild finishes
+        """
+        if self.index_type is None:
+            return
+        logging.info("rebuilding vector index %s", self._index_name)
+        with self._engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as conn:
+            # REINDEX CONCURRENTLY cannot run in a transaction block
+            reindex = "REINDEX INDEX CONCURRENTLY" if concurrently else "REINDEX INDEX"
+            conn.execute(text(f"{reindex} {self._quote(self._index_name)}"))
+            conn.execute(text(f"ANALYZE {self._quote(self.table_name)}"))
+
+    def _search_settings(self) -> List[str]:
+        """Statements tuning the vector index for the current transaction"""
+        settings = []
+        if self.ivfflat_probes:
+            settings.append(f"SET LOCAL ivfflat.probes = {self.ivfflat_probes}")
+        if self.hnsw_ef_search:
+            settings.append(f"SET LOCAL hnsw.ef_search = {self.hnsw_ef_search}")
+        return settings
 
     def insert_doc(self, doc: Doc, vector: List[float]):
         logging.debug("inserting doc: %s, %s", doc, vector[:5])
-        unique_id = doc.get_unique_id()
-        with Session(self._conn) as session:
-            values = dict(
+        self.insert_docs([doc], [vector])
+
+    def _upsert_stmt(self, docs: List[Doc], vectors: List[List[float]]):
+        now = datetime.datetime.utcnow()
+        # postgres refuses to upsert the same row twice in one statement,
+        # so keep only the last occurrence of every unique_id
+        rows: Dict[str, Dict[str, Any]] = {}
+        for doc, vector in zip(docs, vectors):
+            unique_id = doc.get_unique_id()
+            rows[unique_id] = dict(
                 unique_id=unique_id,
                 embedding=vector,
                 data_metadata=doc.get_metadata().json(),
-                updated_at=datetime.datetime.utcnow(),
+                content_hash=doc.get_content_hash(),
+                doc_type=doc.get_metadata().doc_type.value,
+                updated_at=now,
             )
+        stmt = insert(self._table).values(list(rows.values()))
+        return stmt.on_conflict_do_update(
+            index_elements=["unique_id"],
+            set_=dict(
+                embedding=stmt.excluded.embedding,
+                data_metadata=stmt.excluded.data_metadata,
+                content_hash=stmt.excluded.content_hash,
+                doc_type=stmt.excluded.doc_type,
+                updated_at=stmt.excluded.updated_at,
+            ),
+        )
 
-            stmt = (
-                insert(self._table)
-                .values(
-                    **values,
-                )
-                .on_conflict_do_update(
-                    index_elements=["unique_id"],
-                    set_=values,
-                )
-            )
-            session.execute(stmt)
+    def insert_docs(self, docs: List[Doc], vectors: List[List[float]]):
+        """Upsert a batch of documents with a single multi-row statement"""
+        if not docs:
+            return
+        with self._session() as session:
+            session.execute(self._upsert_stmt(docs, vectors))
             session.commit()
 
-    def similarity_search(self, vector: List[float], k: int) -> List[DocMetaContainer]:
-        with Session(self._conn) as session:
-            res = (
-                session.query(self._table)
-                .order_by(self._table.embedding.cosine_distance(vector))
-                .limit(k)
-                .all()
+    async def ainsert_doc(self, doc: Doc, vector: List[float]):
+        await self.ainsert_docs([doc], [vector])
+
+    async def ainsert_docs(self, docs: List[Doc], vectors: List[List[float]]):
+        if not docs:
+            return
+        from sqlalchemy.ext.asyncio import (  # pylint: disable=import-outside-toplevel
+            AsyncSession,
+        )
+
+        async with AsyncSession(self._get_async_engine()) as session:
+            await session.execute(self._upsert_stmt(docs, vectors))
+            await session.commit()
+
+    def _search_stmt(
+        self,
+        vector: List[float],
+        k: int,
+        doc_types: Optional[List[DocType]] = None,
+        min_similarity: Optional[float] = None,
+    ):
+        """Select the metadata and distance of the `k` nearest documents
+
+        Only the metadata is selected, the embeddings never leave the database.
+        """
+        distance = getattr(self._table.embedding, DISTANCES[self.distance][1])(vector)
+        stmt = select(self._table.data_metadata, distance.label("distance"))
+        if doc_types is not None:
+            stmt = stmt.where(self._table.doc_type.in_([i.value for i in doc_types]))
+        if min_similarity is not None:
+            stmt = stmt.where(distance <= self._max_distance(float(min_similarity)))
+        return stmt.order_by(distance).limit(k)
+
+    def _max_distance(self, min_similarity: float) -> float:
+        if self.distance == "cosine":
+            return 1 - min_similarity
+        # l2 similarity is the negated distance, <#> is the negated inner product
+        return -min_similarity
+
+    def _similarity(self, distance: float) -> float:
+        """Convert a distance to a similarity, higher is more similar"""
+        if self.distance == "cosine":
+            return 1 - distance
+        return -distance
+
+    def _search_results(self, rows) -> List[SearchResult]:
+        return [
+            SearchResult(
+                meta=DocMetaContainer.parse_obj(json.loads(row.data_metadata)),
+                similarity=self._similarity(row.distance),
             )
+            for row in rows
+        ]
+
+    def search(
+        self,
+        vector: List[float],
+        k: int,
+        doc_types: Optional[List[DocType]] = None,
+        min_similarity: Optional[float] = None,
+    ) -> List[SearchResult]:
+        """Search for similar documents, filtering by doc type and similarity in postgres
+
+        Similarity is cosine similarity for `cosine`, inner product for
+        `inner_product` and negated euclidean distance for `l2` distance.
+        """
+        with self._session() as session:
+            for setting in self._search_settings():
+                session.execute(text(setting))
+            rows = session.execute(
+                self._search_stmt(vector, k, doc_types, min_similarity)
+            ).all()
+        return self._search_results(rows)
+
+    async def asearch(
+        self,
+        vector: List[float],
+        k: int,
+        doc_types: Optional[List[DocType]] = None,
+        min_similarity: Optional[float] = None,
+    ) -> List[SearchResult]:
+        from sqlalchemy.ext.asyncio import (  # pylint: disable=import-outside-toplevel
+            AsyncSession,
+        )
+
+        async with AsyncSession(self._get_async_engine()) as session:
+            for setting in self._search_settings():
+                await session.execute(text(setting))
+            rows = (
+                await session.execute(
+                    self._search_stmt(vector, k, doc_types, min_similarity)
+                )
+            ).all()
+        return self._search_results(rows)
+
+    def _search_many_stmt(
+        self,
+        vectors: List[List[float]],
+        k: int,
+        doc_types: Optional[List[DocType]] = None,
+        min_similarity: Optional[float] = None,
+    ):
+        """Union the searches of every vector, rows are tagged with their query index"""
+        return union_all(
+            *[
+                self._search_stmt(vector, k, doc_types, min_similarity).add_columns(
+                    literal(idx).label("query_idx")
+                )
+                for idx, vector in enumerate(vectors)
+            ]
+        )
+
+    def _search_many_results(self, n_vectors: int, rows) -> List[List[SearchResult]]:
+        grouped: List[List[Any]] = [[] for _ in range(n_vectors)]
+        for row in rows:
+            grouped[row.query_idx].append(row)
         return [
-            DocMetaContainer.parse_obj(json.loads(item.data_metadata)) for item in res
+            self._search_results(sorted(i, key=lambda row: row.distance))
+            for i in grouped
         ]
+
+    def search_many(
+        self,
+        vectors: List[List[float]],
+        k: int,
+        doc_types: Optional[List[DocType]] = None,
+        min_similarity: Optional[float] = None,
+    ) -> List[List[SearchResult]]:
+        """Search for the documents similar to each vector in a single query"""
+        if not vectors:
+            return []
+        with self._session() as session:
+            for setting in self._search_settings():
+                session.execute(text(setting))
+            rows = session.execute(
+                self._search_many_stmt(vectors, k, doc_types, min_similarity)
+            ).all()
+        return self._search_many_results(len(vectors), rows)
+
+    async def asearch_many(
+        self,
+        vectors: List[List[float]],
+        k: int,
+        doc_types: Optional[List[DocType]] = None,
+        min_similarity: Optional[float] = None,
+    ) -> List[List[SearchResult]]:
+        if not vectors:
+            return []
+        from sqlalchemy.ext.asyncio import (  # pylint: disable=import-outside-toplevel
+            AsyncSession,
+        )
+
+        async with AsyncSession(self._get_async_engine()) as session:
+            for setting in self._search_settings():
+                await session.execute(text(setting))
+            rows = (
+                await session.execute(
+                    self._search_many_stmt(vectors, k, doc_types, min_similarity)
+                )
+            ).all()
+        return self._search_many_results(len(vectors), rows)
+
+    def similarity_search(self, vector: List[float], k: int) -> List[DocMetaContainer]:
+        return [i.meta for i in self.search(vector, k)]
+
+    async def asimilarity_search(
+        self, vector: List[float], k: int
+    ) -> List[DocMetaContainer]:
+        return [i.meta for i in await self.asearch(vector, k)]
+
+    def list_content_hashes(self, doc_types: List[DocType]) -> Dict[str, Optional[str]]:
+        with self._session() as session:
+            res = session.execute(
+                select(self._table.unique_id, self._table.content_hash).where(
+                    self._table.doc_type.in_([i.value for i in doc_types])
+                )
+            ).all()
+        return {item.unique_id: item.content_hash for item in res}
+
+    def list_metas(self, doc_types: List[DocType]) -> Dict[str, DocMetaContainer]:
+        with self._session() as session:
+            res = session.execute(
+                select(self._table.unique_id, self._table.data_metadata).where(
+                    self._table.doc_type.in_([i.value for i in doc_types])
+                )
+            ).all()
+        return {
+            item.unique_id: DocMetaContainer.parse_obj(json.loads(item.data_metadata))
+            for item in res
+        }
+
+    def delete_docs(self, unique_ids: List[str]):
+        if not unique_ids:
+            return
+        with self._session() as session:
+            session.execute(
+                delete(self._table).where(self._table.unique_id.in_(unique_ids))
+            )
+            session.commit()
+
+    def list_records(self) -> Iterator[VectorRecord]:
+        stmt = select(
+            self._table.unique_id,
+            self._table.embedding,
+            self._table.data_metadata,
+            self._table.content_hash,
+        ).execution_options(yield_per=1000)
+        with self._session() as session:
+            for item in session.execute(stmt):
+                yield VectorRecord(
+                    unique_id=item.unique_id,
+                    vector=item.embedding,
+                    meta=DocMetaContainer.parse_obj(json.loads(item.data_metadata)),
+                    content_hash=item.content_hash,
+                )
@@ -0,0 +1,177 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+from chatdbt.model import (
+    Doc,
+    DocMetaContainer,
+    DocType,
+    SearchResult,
+    VectorRecord,
+    VectorStorage,
+)
+from chatdbt.vector_storage.numpy_storage import NumpyVectorStorage
+
+
+class ReplicaVectorStorage(VectorStorage):
+    """Vector storage serving searches from an in-process replica of a remote storage
+
+    The remote storage stays the source of truth: writes go to the remote storage
+    first and are then applied to the replica. The replica is loaded on startup and
+    reloaded by `refresh()`, or every `refresh_interval_secs` seconds in a
+    background thread. A reload builds a new replica and swaps it in, so searches
+    are served during the reload.
+
+    The remote storage must support `list_records`.
+    """
+
+    def __init__(
+        self, remote: VectorStorage, refresh_interval_secs: Optional[float] = None
+    ):
+        if type(remote).list_records is VectorStorage.list_records:
+            raise ValueError(
+                f"{remote.__class__.__name__} does not support listing vectors, "
+                "it cannot be replicated"
+            )
+        self.remote = remote
+        self.refresh_interval_secs = (
+            float(refresh_interval_secs) if refresh_interval_secs else None
+        )
+        self._local = NumpyVectorStorage()
+        self._write_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        # writes applied while a refresh is loading, replayed on the new replica
+        self._pending_writes: Optional[
+            List[Callable[[NumpyVectorStorage], None]]
+        ] = None
+        self._stopped = threading.Event()
+        self.refresh()
+
+        if self.refresh_interval_secs:
+            threading.Thread(
+                target=self._refresh_periodically,
+                name="chatdbt-vector-replica-refresh",
+                daemon=True,
+            ).start()
+
+    def refresh(self):
+        """Reload the replica from the remote storage"""
+        with self._refresh_lock:
+            self._refresh()
+
+    def _refresh(self):
+        started_at = time.monotonic()
+        with self._write_lock:
+            self._pending_writes = []
+        local = NumpyVectorStorage()
+        try:
+            local.load_records(self.remote.list_records())
+        except BaseException:
+            with self._write_lock:
+                self._pending_writes = None
+            raise
+        # writes stop being buffered only once they are replayed and the new
+        # replica is swapped in, so none is applied to the old replica alone
+        with self._write_lock:
+            for write in self._pending_writes or []:
+                write(local)
+            self._pending_writes = None
+            self._local = local
+        logging.info(
+            "replicated %s vectors in %.2fs",
+            len(local),
+            time.monotonic() - started_at,
+        )
+
+    def _apply(self, write: Callable[[NumpyVectorStorage], None]):
+        with self._write_lock:
+            write(self._local)
+            if self._pending_writes is not None:
+                self._pending_writes.append(write)
+
+    def _refresh_periodically(self):
+        while not self._stopped.wait(self.refresh_interval_secs):
+            try:
+                self.refresh()
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Failed to refresh vector replica")
+
+    def close(self):
+        """Stop refreshing the replica"""
+        self._stopped.set()
+
+    def insert_doc(self, doc: Doc, vector: List[float]):
+        self.insert_docs([doc], [vector])
+
+    def insert_docs(self, docs: List[Doc], vectors: List[List[float]]):
+        self.remote.insert_docs(docs, vectors)
+        self._apply(lambda local: local.insert_docs(docs, vectors))
+
+    async def ainsert_doc(self, doc: Doc, vector: List[float]):
+        await self.ainsert_docs([doc], [vector])
+
+    async def ainsert_docs(self, docs: List[Doc], vectors: List[List[float]]):
+        await self.remote.ainsert_docs(docs, vectors)
+        self._apply(lambda local: local.insert_docs(docs, vectors))
+
+    def flush(self):
+        self.remote.flush()
+
+    def similarity_search(self, vector: List[float], k: int) -> List[DocMetaContainer]:
+        return self._local.similarity_search(vector, k)
+
+    async def asimilarity_search(
+        self, vector: List[float], k: int
+    ) -> List[DocMetaContainer]:
+        # served from memory, not worth a worker thread
+        return self._local.similarity_search(vector, k)
+
+    def search(
+        self,
+        vector: List[float],
+        k: int,
+        doc_types: Optional[List[DocType]] = None,
+        min_similarity: Optional[float] = None,
+    ) -> List[SearchResult]:
+        return self._local.search(vector, k, doc_types, min_similarity)
+
+    async def asearch(
+        self,
+        vector: List[float],
+        k: int,
+        doc_types: Optional[List[DocType]] = None,
+        min_similarity: Optional[float] = None,
+    ) -> List[SearchResult]:
+        return self._local.search(vector, k, doc_types, min_similarity)
+
+    def search_many(
+        self,
+        vectors: List[List[float]],
+        k: int,
+        doc_types: Optional[List[DocType]] = None,
+        min_similarity: Optional[float] = None,
+    ) -> List[List[SearchResult]]:
+        return self._local.search_many(vectors, k, doc_types, min_similarity)
+
+    async def asearch_many(
+        self,
+        vectors: List[List[float]],
+        k: int,
+        doc_types: Optional[List[DocType]] = None,
+        min_similarity: Optional[float] = None,
+    ) -> List[List[SearchResult]]:
+        return self._local.search_many(vectors, k, doc_types, min_similarity)
+
+    def list_content_hashes(self, doc_types: List[DocType]) -> Dict[str, Optional[str]]:
+        return self.remote.list_content_hashes(doc_types)
+
+    def list_metas(self, doc_types: List[DocType]) -> Dict[str, DocMetaContainer]:
+        return self.remote.list_metas(doc_types)
+
+    def delete_docs(self, unique_ids: List[str]):
+        self.remote.delete_docs(unique_ids)
+        self._apply(lambda local: local.delete_docs(unique_ids))
+
+    def list_records(self) -> Iterator[VectorRecord]:
+        return self.remote.list_records()
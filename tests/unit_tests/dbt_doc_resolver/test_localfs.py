@@ -1,7 +1,14 @@
+import gzip
 import os
+from typing import Dict, cast
+
 import pytest
 
-from chatdbt.dbt_doc_resolver.localfs import LocalfsDBTDocResolver
+from chatdbt.dbt_doc_resolver.localfs import (
+    MANIFEST_COLUMN_FIELDS,
+    MANIFEST_NODE_FIELDS,
+    LocalfsDBTDocResolver,
+)
 
 TESTDATA_DIR = os.path.join(
     os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "testdata"
@@ -42,3 +49,55 @@ def test_get_catalog_by_unique_id(sample_resolver: LocalfsDBTDocResolver):
 def test_list_model_unique_id(sample_resolver: LocalfsDBTDocResolver):
     unique_ids = sample_resolver.list_model_unique_id()
     assert len(unique_ids) == 5
+
+
+def _compress(path: str, tmpdir, suffix: str) -> str:
+    compressed_path = os.path.join(tmpdir, os.path.basename(path) + suffix)
+    with open(path, "rb") as f:
+        data = f.read()
+    if suffix == ".gz":
+        with gzip.open(compressed_path, "wb") as compressed_f:
+            compressed_f.write(data)
+    else:
+        zstandard = pytest.importorskip("zstandard")
+        with open(compressed_path, "wb") as compressed_f:
+            compressed_f.write(zstandard.ZstdCompressor().compress(data))
+    return compressed_path
+
+
+@pytest.mark.parametrize("suffix", [".gz", ".zst"])
+def test_compressed_artifacts(tmpdir, suffix: str):
+    resolver = LocalfsDBTDocResolver(
+        _compress(MANIFEST_JSON_PATH, tmpdir, suffix),
+        _compress(CATALOG_JSON_PATH, tmpdir, suffix),
+    )
+    assert len(resolver.list_model_unique_id()) == 5
+
+
+def test_streaming_keeps_model_fields(sample_resolver: LocalfsDBTDocResolver, tmpdir):
+    pytest.importorskip("ijson")
+    resolver = LocalfsDBTDocResolver(
+        _compress(MANIFEST_JSON_PATH, tmpdir, ".gz"), CATALOG_JSON_PATH, streaming=True
+    )
+
+    assert resolver.list_model_unique_id() == sample_resolver.list_model_unique_id()
+    assert resolver.get_manifest_by_unique_id("seed.jaffle_shop.raw_orders") is None
+    doc = resolver.get_manifest_by_unique_id("model.jaffle_shop.customers")
+    expected = sample_resolver.get_manifest_by_unique_id("model.jaffle_shop.customers")
+    assert doc is not None and expected is not None
+    assert set(doc) <= set(MANIFEST_NODE_FIELDS)
+    assert doc["compiled_code"] == expected["compiled_code"]
+    assert doc["depends_on"]["nodes"] == expected["depends_on"]["nodes"]
+    assert doc["columns"]["customer_id"] == {
+        k: expected["columns"]["customer_id"][k] for k in MANIFEST_COLUMN_FIELDS
+    }
+    catalog = resolver.get_catalog_by_unique_id("model.jaffle_shop.customers")
+    assert catalog == {
+        "columns": {
+            name: {"name": column["name"], "type": column["type"]}
+            for name, column in cast(
+                Dict,
+                sample_resolver.get_catalog_by_unique_id("model.jaffle_shop.customers"),
+            )["columns"].items()
+        }
+    }
@@ -0,0 +1,49 @@
+import os
+from typing import List
+
+from chatdbt.embedding_cache.provider import CachedEmbeddingProvider
+from chatdbt.embedding_cache.sqlite import SqliteEmbeddingCache
+from chatdbt.model import EmbeddingProvider
+
+
+class CountingEmbeddingProvider(EmbeddingProvider):
+    def __init__(self) -> None:
+        self.embedded: List[str] = []
+
+    def embed(self, content: str) -> List[float]:
+        self.embedded.append(content)
+        return [float(len(content)), 0.5]
+
+
+def test_put_and_get_many(tmpdir):
+    cache = SqliteEmbeddingCache(os.path.join(tmpdir, "cache.db"))
+    cache.put_many("model-a", ["h1", "h2"], [[1.0, 2.0], [3.0, 4.0]])
+
+    assert cache.get_many("model-a", ["h2", "h3", "h1"]) == [
+        [3.0, 4.0],
+        None,
+        [1.0, 2.0],
+    ]
+    assert cache.get_many("model-b", ["h1"]) == [None]
+
+
+def test_evicts_least_recently_used(tmpdir):
+    cache = SqliteEmbeddingCache(os.path.join(tmpdir, "cache.db"), max_entries=2)
+    cache.put_many("model", ["h1"], [[1.0]])
+    cache.put_many("model", ["h2"], [[2.0]])
+    cache.get_many("model", ["h1"])
+    cache.put_many("model", ["h3"], [[3.0]])
+
+    assert cache.get_many("model", ["h1", "h2", "h3"]) == [[1.0], None, [3.0]]
+
+
+def test_cached_provider_survives_restart(tmpdir):
+    path = os.path.join(tmpdir, "cache.db")
+    provider = CountingEmbeddingProvider()
+    cached = CachedEmbeddingProvider(provider, SqliteEmbeddingCache(path))
+    assert cached.embed_many(["foo", "barbaz"]) == [[3.0, 0.5], [6.0, 0.5]]
+
+    cached = CachedEmbeddingProvider(provider, SqliteEmbeddingCache(path))
+    assert cached.embed_many(["barbaz", "qux!"]) == [[6.0, 0.5], [4.0, 0.5]]
+    assert provider.embedded == ["foo", "barbaz", "qux!"]
+    assert (cached.hits, cached.misses) == (1, 1)
@@ -0,0 +1,70 @@
+from typing import List
+
+import pytest
+
+from chatdbt.instrumentation.trace import Trace
+from chatdbt.model import InstrumentationCallback, Span
+
+
+class CollectingCallback(InstrumentationCallback):
+    def __init__(self) -> None:
+        self.spans: List[Span] = []
+
+    def on_span(self, span: Span):
+        self.spans.append(span)
+
+
+class FailingCallback(InstrumentationCallback):
+    def on_span(self, span: Span):
+        raise RuntimeError("callback failed")
+
+
+def test_spans_are_reported():
+    callback = CollectingCallback()
+    trace = Trace([FailingCallback(), callback])
+
+    with trace.span("search", callback, k=5) as attributes:
+        attributes["n_docs"] = 3
+    with pytest.raises(ValueError):
+        with trace.span("completion", "Openai"):
+            raise ValueError()
+    trace.record("completion", "Openai", 0.5, {"tokens": 10})
+
+    assert [(i.stage, i.backend, i.error) for i in callback.spans] == [
+        ("search", "CollectingCallback", None),
+        ("completion", "Openai", "ValueError"),
+        ("completion", "Openai", None),
+    ]
+    assert callback.spans[0].attributes == {"k": 5, "n_docs": 3}
+    assert set(trace.timings()) == {"search", "completion"}
+    assert trace.timings()["completion"] >= 0.5
+
+
+def test_shared_spans_are_not_reported_again():
+    callback = CollectingCallback()
+    batch_trace = Trace([callback])
+    batch_trace.record("embed", "Openai", 0.25)
+
+    trace = Trace([callback], batch_trace.spans)
+    trace.record("completion", "Openai", 1.0)
+    assert trace.timings() == {"embed": 0.25, "completion": 1.0}
+    assert len(callback.spans) == 2
+
+
+def test_prometheus_callback():
+    prometheus_client = pytest.importorskip("prometheus_client")
+    from chatdbt.instrumentation.prometheus import PrometheusCallback
+
+    registry = prometheus_client.CollectorRegistry()
+    trace = Trace([PrometheusCallback(registry=registry)])
+    trace.record("completion", "Openai", 0.5, {"tokens": 100, "cost": 0.0002})
+
+    labels = {"stage": "completion", "backend": "Openai"}
+    assert registry.get_sample_value(
+        "chatdbt_stage_duration_seconds_count", labels
+    ) == pytest.approx(1)
+    assert registry.get_sample_value("chatdbt_tokens_total", labels) == 100
+
+    trace.record("embed", "Openai", 0.1, {"n_queries": 2, "cache_hits": 1})
+    labels = {"stage": "embed", "backend": "Openai"}
+    assert registry.get_sample_value("chatdbt_cache_hits_total", labels) == 1
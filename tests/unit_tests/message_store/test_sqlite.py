@@ -0,0 +1,55 @@
+import datetime
+import os
+import time
+
+from chatdbt.message_store.memory import MemoryMessageStore
+from chatdbt.message_store.sqlite import SqliteMessageStore
+from chatdbt.model import ChatMessage
+
+
+def _message(chat_uuid: str) -> ChatMessage:
+    return ChatMessage(
+        uuid=chat_uuid,
+        created_at=datetime.datetime.now(),
+        query=f"query {chat_uuid}",
+        response=f"response {chat_uuid}",
+        ref_dbt_docs=[],
+        ref_chat_docs=[],
+    )
+
+
+def test_get_across_instances(tmpdir):
+    path = os.path.join(tmpdir, "messages.db")
+    SqliteMessageStore(path).put(_message("m1"))
+
+    message = SqliteMessageStore(path).get("m1")
+    assert message is not None
+    assert message.response == "response m1"
+    assert SqliteMessageStore(path).get("m2") is None
+
+
+def test_evicts_least_recently_used(tmpdir):
+    store = SqliteMessageStore(os.path.join(tmpdir, "messages.db"), max_entries=2)
+    store.put(_message("m1"))
+    store.put(_message("m2"))
+    store.get("m1")
+    store.put(_message("m3"))
+
+    assert [store.get(i) is not None for i in ["m1", "m2", "m3"]] == [
+        True,
+        False,
+        True,
+    ]
+
+
+def test_expires_after_ttl(tmpdir):
+    stores = [
+        SqliteMessageStore(os.path.join(tmpdir, "messages.db"), ttl_secs=0.05),
+        MemoryMessageStore(ttl_secs=0.05),
+    ]
+    for store in stores:
+        store.put(_message("m1"))
+        assert store.get("m1") is not None
+    time.sleep(0.1)
+    for store in stores:
+        assert store.get("m1") is None
@@ -0,0 +1,710 @@
+import asyncio
+import json
+import os
+import shutil
+import weakref
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple, cast
+
+import pytest
+
+from chatdbt.chat import ChatBot, DocManager, _flush_memory_at_exit
+from chatdbt.dbt_doc_resolver.localfs import LocalfsDBTDocResolver
+from chatdbt.embedding_cache.sqlite import SqliteEmbeddingCache
+from chatdbt.message_store.sqlite import SqliteMessageStore
+from chatdbt.model import (
+    ChatMessage,
+    DBTModelDocument,
+    Doc,
+    DocMetaContainer,
+    DocType,
+    EmbeddingProvider,
+    InstrumentationCallback,
+    Span,
+    VectorStorage,
+)
+
+TESTDATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "testdata")
+
+MANIFEST_JSON_PATH = os.path.join(TESTDATA_DIR, "jaffle_shop", "manifest.json")
+CATALOG_JSON_PATH = os.path.join(TESTDATA_DIR, "jaffle_shop", "catalog.json")
+
+
+FAKE_USAGE = dict(prompt_tokens=90, completion_tokens=10, total_tokens=100)
+
+
+class FakeOpenai(EmbeddingProvider):
+    """Deterministic stand-in for `chatdbt.openai.Openai`"""
+
+    embedding_model = "fake-embedding"
+
+    def __init__(self, **config) -> None:
+        self.embed_calls: List[List[str]] = []
+        self.completion_calls: List[List[Dict[str, str]]] = []
+
+    def embed(self, content: str) -> List[float]:
+        return self.embed_many([content])[0]
+
+    def embed_many(self, contents: List[str]) -> List[List[float]]:
+        self.embed_calls.append(list(contents))
+        return [[float(len(content)), 1.0, 0.0] for content in contents]
+
+    def get_model_name(self) -> str:
+        return self.embedding_model
+
+    def chat_completion(self, messages: List[Dict[str, str]]) -> str:
+        self.completion_calls.append(messages)
+        if "boom" in messages[-1]["content"]:
+            raise RuntimeError("completion failed")
+        return "fake response"
+
+    async def achat_completion(self, messages: List[Dict[str, str]]) -> str:
+        if "boom" in messages[-1]["content"]:
+            raise RuntimeError("completion failed")
+        return "fake async response"
+
+    def chat_completion_with_usage(
+        self, messages: List[Dict[str, str]]
+    ) -> Tuple[str, Dict[str, int]]:
+        return self.chat_completion(messages), FAKE_USAGE
+
+    async def achat_completion_with_usage(
+        self, messages: List[Dict[str, str]]
+    ) -> Tuple[str, Dict[str, int]]:
+        return await self.achat_completion(messages), FAKE_USAGE
+
+    def chat_completion_stream(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        yield from ["fake ", "streamed ", "response"]
+
+    async def achat_completion_stream(
+        self, messages: List[Dict[str, str]]
+    ) -> AsyncIterator[str]:
+        for delta in ["fake ", "async ", "response"]:
+            yield delta
+
+
+class FakeVectorStorage(VectorStorage):
+    def __init__(self) -> None:
+        self.rows: Dict[str, Tuple[DocMetaContainer, List[float]]] = {}
+        self.hashes: Dict[str, str] = {}
+        self.batches: List[int] = []
+        self.flushes = 0
+
+    def insert_doc(self, doc: Doc, vector: List[float]):
+        self.rows[doc.get_unique_id()] = (doc.get_metadata(), vector)
+        self.hashes[doc.get_unique_id()] = doc.get_content_hash()
+
+    def insert_docs(self, docs: List[Doc], vectors: List[List[float]]):
+        self.batches.append(len(docs))
+        super().insert_docs(docs, vectors)
+
+    def flush(self):
+        self.flushes += 1
+
+    def similarity_search(self, vector: List[float], k: int) -> List[DocMetaContainer]:
+        return [meta for meta, _ in list(self.rows.values())[:k]]
+
+    def list_content_hashes(self, doc_types: List[DocType]) -> Dict[str, Optional[str]]:
+        return {
+            unique_id: self.hashes.get(unique_id)
+            for unique_id, (meta, _) in self.rows.items()
+            if meta.doc_type in doc_types
+        }
+
+    def delete_docs(self, unique_ids: List[str]):
+        for unique_id in unique_ids:
+            self.rows.pop(unique_id, None)
+            self.hashes.pop(unique_id, None)
+
+    def list_metas(self, doc_types: List[DocType]) -> Dict[str, DocMetaContainer]:
+        return {
+            unique_id: meta
+            for unique_id, (meta, _) in self.rows.items()
+            if meta.doc_type in doc_types
+        }
+
+
+@pytest.fixture()
+def chat_bot(monkeypatch) -> ChatBot:
+    monkeypatch.setattr("chatdbt.chat.Openai", FakeOpenai)
+    return ChatBot(
+        LocalfsDBTDocResolver(MANIFEST_JSON_PATH, CATALOG_JSON_PATH),
+        FakeVectorStorage(),
+        None,
+    )
+
+
+def test_index_dbt_docs_in_batches(chat_bot: ChatBot):
+    chat_bot.index_dbt_docs(batch_size=2)
+    storage = chat_bot.vector_storage
+    assert isinstance(storage, FakeVectorStorage)
+    assert storage.batches == [2, 2, 1]
+    assert len(storage.rows) == 5
+    assert [len(i) for i in chat_bot.openai.embed_calls] == [2, 2, 1]  # type: ignore
+
+
+def test_index_dbt_docs_with_workers(chat_bot: ChatBot):
+    chat_bot.index_dbt_docs(
+        batch_size=1, workers=3, requests_per_minute=600, tokens_per_minute=100000
+    )
+    storage = chat_bot.vector_storage
+    assert isinstance(storage, FakeVectorStorage)
+    assert storage.batches == [1, 1, 1, 1, 1]
+    assert len(storage.rows) == 5
+
+
+def test_index_dbt_docs_incremental(chat_bot: ChatBot):
+    chat_bot.index_dbt_docs()
+    storage = chat_bot.vector_storage
+    assert isinstance(storage, FakeVectorStorage)
+    stale = DBTModelDocument(
+        name="jaffle_shop.dropped_model",
+        description=None,
+        columns=[],
+        depends_on=[],
+        meta=DocMetaContainer(
+            doc_type=DocType.MODEL, meta={"name": "jaffle_shop.dropped_model"}
+        ),
+    )
+    storage.insert_doc(stale, [0.0, 0.0, 0.0])
+    storage.hashes["jaffle_shop.orders"] = "outdated"
+    chat_bot.openai.embed_calls.clear()  # type: ignore
+
+    chat_bot.index_dbt_docs(incremental=True)
+
+    orders_doc = [
+        doc
+        for doc in chat_bot.doc_manager.get_all_docs()
+        if doc.get_unique_id() == "jaffle_shop.orders"
+    ][0]
+    assert chat_bot.openai.embed_calls == [[orders_doc.get_content()]]  # type: ignore
+    assert "jaffle_shop.dropped_model" not in storage.rows
+    assert len(storage.rows) == 5
+
+
+def test_query_embedding_cache(chat_bot: ChatBot):
+    chat_bot.index_dbt_docs()
+    chat_bot.openai.embed_calls.clear()  # type: ignore
+
+    chat_bot.suggest_table("how many orders per customer")
+    chat_bot.suggest_sql("how many orders per customer")
+
+    assert chat_bot.openai.embed_calls == [["how many orders per customer"]]  # type: ignore
+    assert chat_bot.query_embedding_provider.hits == 1
+    assert chat_bot.query_embedding_provider.misses == 1
+
+
+def test_query_embeddings_are_not_persisted(monkeypatch, tmpdir):
+    monkeypatch.setattr("chatdbt.chat.Openai", FakeOpenai)
+    embedding_cache = SqliteEmbeddingCache(os.path.join(tmpdir, "cache.db"))
+    chat_bot = ChatBot(
+        LocalfsDBTDocResolver(MANIFEST_JSON_PATH, CATALOG_JSON_PATH),
+        FakeVectorStorage(),
+        None,
+        embedding_cache=embedding_cache,
+    )
+    chat_bot.index_dbt_docs()
+    (n_docs,) = embedding_cache._conn.execute(
+        "SELECT COUNT(*) FROM embedding_cache"
+    ).fetchone()
+
+    chat_bot.suggest_table("how many orders per customer")
+
+    assert embedding_cache._conn.execute(
+        "SELECT COUNT(*) FROM embedding_cache"
+    ).fetchone() == (n_docs,)
+
+
+def test_min_similarity_zero(monkeypatch):
+    monkeypatch.setattr("chatdbt.chat.Openai", FakeOpenai)
+    storage = FakeVectorStorage()
+    search_calls: List[Optional[float]] = []
+
+    def _search_many(vectors, k, doc_types=None, min_similarity=None):
+        search_calls.append(min_similarity)
+        return [[] for _ in vectors]
+
+    monkeypatch.setattr(storage, "search_many", _search_many)
+    for min_similarity in [0, "0"]:
+        chat_bot = ChatBot(
+            LocalfsDBTDocResolver(MANIFEST_JSON_PATH, CATALOG_JSON_PATH),
+            storage,
+            None,
+            min_similarity=min_similarity,  # type: ignore
+        )
+        chat_bot.suggest_table("how many orders per customer")
+
+    assert search_calls == [0.0, 0.0]
+
+
+def test_async_api(chat_bot: ChatBot):
+    async def _run():
+        await chat_bot.aindex_dbt_docs(batch_size=2)
+        return await asyncio.gather(
+            chat_bot.asuggest_table("orders per customer"),
+            chat_bot.asuggest_sql("orders per customer"),
+        )
+
+    table_message, sql_message = asyncio.run(_run())
+
+    assert len(chat_bot.vector_storage.rows) == 5  # type: ignore
+    assert table_message.response == "fake async response"
+    assert sql_message.ref_dbt_docs
+
+    asyncio.run(chat_bot.amemory_message(sql_message))
+    assert len(chat_bot.vector_storage.rows) == 6  # type: ignore
+
+
+def test_doc_manager_snapshot(tmpdir, monkeypatch):
+    snapshot_dir = os.path.join(tmpdir, "snapshots")
+    resolver = LocalfsDBTDocResolver(MANIFEST_JSON_PATH, CATALOG_JSON_PATH)
+    built = DocManager(resolver, snapshot_dir=snapshot_dir)
+    assert len(os.listdir(snapshot_dir)) == 1
+
+    def _fail(*args):
+        raise AssertionError("docs should be loaded from the snapshot")
+
+    monkeypatch.setattr(resolver, "list_model_unique_id", _fail)
+    loaded = DocManager(resolver, snapshot_dir=snapshot_dir)
+    assert [doc.get_content() for doc in loaded.get_all_docs()] == [
+        doc.get_content() for doc in built.get_all_docs()
+    ]
+    sql_doc = loaded.resolve_doc_meta(
+        DocMetaContainer(doc_type=DocType.SQL, meta={"name": "jaffle_shop.orders"})
+    )
+    assert "jaffle_shop.orders" in sql_doc.get_content()
+
+    monkeypatch.undo()
+    monkeypatch.setattr(resolver, "get_fingerprint", lambda: "changed")
+    DocManager(resolver, snapshot_dir=snapshot_dir)
+    [snapshot] = os.listdir(snapshot_dir)
+    assert snapshot.startswith("doc_store-") and snapshot.endswith("-changed.pickle")
+
+
+def test_doc_manager_snapshot_skips_parsing(tmpdir, monkeypatch):
+    snapshot_dir = os.path.join(tmpdir, "snapshots")
+    manifest_path, catalog_path = _copy_artifacts(tmpdir)
+    DocManager(
+        LocalfsDBTDocResolver(manifest_path, catalog_path), snapshot_dir=snapshot_dir
+    )
+
+    def _fail(*args):
+        raise AssertionError("artifacts should not be parsed")
+
+    monkeypatch.setattr("chatdbt.dbt_doc_resolver.localfs.json.load", _fail)
+    doc_manager = DocManager(
+        LocalfsDBTDocResolver(manifest_path, catalog_path), snapshot_dir=snapshot_dir
+    )
+    assert len(doc_manager.get_all_docs()) == 5
+    monkeypatch.undo()
+
+    # the docs loaded from the snapshot are checksummed on the first reload
+    _edit_manifest(manifest_path)
+    assert doc_manager.reload() == (
+        ["jaffle_shop.stg_refunds"],
+        ["jaffle_shop.orders"],
+        ["jaffle_shop.stg_payments"],
+    )
+
+
+def test_doc_manager_snapshots_of_other_artifacts_are_kept(tmpdir):
+    snapshot_dir = os.path.join(tmpdir, "snapshots")
+    manifest_path, catalog_path = _copy_artifacts(tmpdir)
+    DocManager(
+        LocalfsDBTDocResolver(MANIFEST_JSON_PATH, CATALOG_JSON_PATH),
+        snapshot_dir=snapshot_dir,
+    )
+    DocManager(
+        LocalfsDBTDocResolver(manifest_path, catalog_path), snapshot_dir=snapshot_dir
+    )
+    assert len(os.listdir(snapshot_dir)) == 2
+
+    # a new version of the copied artifacts replaces its own snapshot only
+    _edit_manifest(manifest_path)
+    DocManager(
+        LocalfsDBTDocResolver(manifest_path, catalog_path), snapshot_dir=snapshot_dir
+    )
+    assert len(os.listdir(snapshot_dir)) == 2
+
+
+def test_doc_manager_snapshot_save_failures(tmpdir, monkeypatch):
+    resolver = LocalfsDBTDocResolver(MANIFEST_JSON_PATH, CATALOG_JSON_PATH)
+
+    # another worker removed the stale snapshot first
+    snapshot_dir = os.path.join(tmpdir, "snapshots")
+    stale_path = os.path.join(snapshot_dir, "doc_store-stale.pickle")
+    monkeypatch.setattr("chatdbt.chat.glob.glob", lambda pattern: [stale_path])
+    DocManager(resolver, snapshot_dir=snapshot_dir)
+    assert len(os.listdir(snapshot_dir)) == 1
+
+    # an unwritable snapshot dir only costs the snapshot
+    not_a_dir = os.path.join(tmpdir, "file")
+    open(not_a_dir, "w").close()
+    doc_manager = DocManager(resolver, snapshot_dir=not_a_dir)
+    assert len(doc_manager.get_all_docs()) == 5
+
+
+def test_doc_manager_lazy(monkeypatch):
+    resolver = LocalfsDBTDocResolver(MANIFEST_JSON_PATH, CATALOG_JSON_PATH)
+    eager = DocManager(resolver)
+    resolved: List[str] = []
+    get_manifest_by_unique_id = resolver.get_manifest_by_unique_id
+
+    def _get_manifest_by_unique_id(unique_id: str):
+        resolved.append(unique_id)
+        return get_manifest_by_unique_id(unique_id)
+
+    monkeypatch.setattr(
+        resolver, "get_manifest_by_unique_id", _get_manifest_by_unique_id
+    )
+    lazy = DocManager(resolver, lazy=True, lazy_cache_size=1)
+    assert resolved == []
+
+    orders = DocMetaContainer(
+        doc_type=DocType.MODEL, meta={"name": "jaffle_shop.orders"}
+    )
+    orders_sql = DocMetaContainer(
+        doc_type=DocType.SQL, meta={"name": "jaffle_shop.orders"}
+    )
+    assert lazy.resolve_doc_meta(orders) == eager.resolve_doc_meta(orders)
+    assert lazy.resolve_doc_meta(orders_sql) == eager.resolve_doc_meta(orders_sql)
+    assert set(resolved) == {"model.jaffle_shop.orders"}
+
+    # the cache only holds one model, orders is evicted by customers
+    resolved.clear()
+    customers = DocMetaContainer(
+        doc_type=DocType.MODEL, meta={"name": "jaffle_shop.customers"}
+    )
+    lazy.resolve_doc_meta(customers)
+    lazy.resolve_doc_meta(orders)
+    assert set(resolved) == {"model.jaffle_shop.customers", "model.jaffle_shop.orders"}
+
+    assert [doc.get_content() for doc in lazy.get_all_docs()] == [
+        doc.get_content() for doc in eager.get_all_docs()
+    ]
+
+
+def _copy_artifacts(tmpdir) -> Tuple[str, str]:
+    manifest_path = os.path.join(tmpdir, "manifest.json")
+    catalog_path = os.path.join(tmpdir, "catalog.json")
+    shutil.copy(MANIFEST_JSON_PATH, manifest_path)
+    shutil.copy(CATALOG_JSON_PATH, catalog_path)
+    return manifest_path, catalog_path
+
+
+def _edit_manifest(manifest_path: str):
+    """Change the orders model, remove stg_payments and add a copy of it"""
+    with open(manifest_path, "r", encoding="utf8") as f:
+        manifest = json.load(f)
+    nodes = manifest["nodes"]
+    nodes["model.jaffle_shop.orders"]["description"] = "Orders, reloaded"
+    payments = nodes.pop("model.jaffle_shop.stg_payments")
+    payments["unique_id"] = "model.jaffle_shop.stg_refunds"
+    nodes["model.jaffle_shop.stg_refunds"] = payments
+    with open(manifest_path, "w", encoding="utf8") as f:
+        json.dump(manifest, f)
+    stat = os.stat(manifest_path)
+    os.utime(manifest_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_reload_dbt_docs(tmpdir, monkeypatch):
+    monkeypatch.setattr("chatdbt.chat.Openai", FakeOpenai)
+    manifest_path, catalog_path = _copy_artifacts(tmpdir)
+    chat_bot = ChatBot(
+        LocalfsDBTDocResolver(manifest_path, catalog_path), FakeVectorStorage(), None
+    )
+    chat_bot.index_dbt_docs()
+    assert chat_bot.reload_dbt_docs(reindex=True) == ([], [], [])
+
+    _edit_manifest(manifest_path)
+    chat_bot.openai.embed_calls.clear()  # type: ignore
+    changes = chat_bot.reload_dbt_docs(reindex=True)
+
+    assert changes.added == ["jaffle_shop.stg_refunds"]
+    assert changes.changed == ["jaffle_shop.orders"]
+    assert changes.removed == ["jaffle_shop.stg_payments"]
+    orders = chat_bot.doc_manager.get_docs(["jaffle_shop.orders"])[0]
+    assert "Orders, reloaded" in orders.get_content()
+    assert len(chat_bot.openai.embed_calls[0]) == 2  # type: ignore
+    assert sorted(chat_bot.vector_storage.rows) == [  # type: ignore
+        "jaffle_shop.customers",
+        "jaffle_shop.orders",
+        "jaffle_shop.stg_customers",
+        "jaffle_shop.stg_orders",
+        "jaffle_shop.stg_refunds",
+    ]
+
+
+def test_reload_dbt_docs_removes_stale_docs(tmpdir, monkeypatch):
+    monkeypatch.setattr("chatdbt.chat.Openai", FakeOpenai)
+    manifest_path, catalog_path = _copy_artifacts(tmpdir)
+    chat_bot = ChatBot(
+        LocalfsDBTDocResolver(manifest_path, catalog_path), FakeVectorStorage(), None
+    )
+    chat_bot.index_dbt_docs()
+    message = chat_bot.suggest_sql("payments", k=10)
+    assert "jaffle_shop.stg_payments" in [
+        i.get_unique_id() for i in message.ref_dbt_docs
+    ]
+    chat_bot.memory_message(message)
+    assert len(chat_bot.vector_storage.rows) == 6  # type: ignore
+
+    _edit_manifest(manifest_path)
+    chat_bot.reload_dbt_docs()
+
+    # the model and the chat referring to it are gone, the rest stays
+    assert sorted(chat_bot.vector_storage.rows) == [  # type: ignore
+        "jaffle_shop.customers",
+        "jaffle_shop.orders",
+        "jaffle_shop.stg_customers",
+        "jaffle_shop.stg_orders",
+    ]
+    message = chat_bot.suggest_sql("payments", k=10)
+    assert len(message.ref_dbt_docs) == 4
+
+
+def test_suggest_skips_docs_of_removed_models(tmpdir, monkeypatch):
+    class _UndeletableVectorStorage(FakeVectorStorage):
+        delete_docs = VectorStorage.delete_docs
+
+    monkeypatch.setattr("chatdbt.chat.Openai", FakeOpenai)
+    manifest_path, catalog_path = _copy_artifacts(tmpdir)
+    chat_bot = ChatBot(
+        LocalfsDBTDocResolver(manifest_path, catalog_path),
+        _UndeletableVectorStorage(),
+        None,
+    )
+    chat_bot.index_dbt_docs()
+    chat_bot.memory_message(chat_bot.suggest_sql("payments", k=10))
+
+    _edit_manifest(manifest_path)
+    chat_bot.reload_dbt_docs()
+    assert "jaffle_shop.stg_payments" in chat_bot.vector_storage.rows  # type: ignore
+
+    message = chat_bot.suggest_sql("payments", k=10)
+    assert "jaffle_shop.stg_payments" not in [
+        i.get_unique_id() for i in message.ref_dbt_docs
+    ]
+    assert message.ref_chat_docs == []
+
+
+def test_doc_manager_lazy_reload(tmpdir):
+    manifest_path, catalog_path = _copy_artifacts(tmpdir)
+    doc_manager = DocManager(
+        LocalfsDBTDocResolver(manifest_path, catalog_path), lazy=True
+    )
+    orders = DocMetaContainer(
+        doc_type=DocType.MODEL, meta={"name": "jaffle_shop.orders"}
+    )
+    assert "Orders, reloaded" not in doc_manager.resolve_doc_meta(orders).get_content()
+
+    _edit_manifest(manifest_path)
+    changes = doc_manager.reload()
+
+    assert changes.changed == ["jaffle_shop.orders"]
+    assert "Orders, reloaded" in doc_manager.resolve_doc_meta(orders).get_content()
+    with pytest.raises(KeyError):
+        doc_manager.get_docs(["jaffle_shop.stg_payments"])
+    assert doc_manager.get_docs(["jaffle_shop.stg_refunds"])
+
+
+def test_suggest_stream(chat_bot: ChatBot):
+    chat_bot.index_dbt_docs()
+
+    stream = chat_bot.suggest_sql_stream("orders per customer")
+    assert stream.message is None
+    assert list(stream) == ["fake ", "streamed ", "response"]
+    message = stream.get_message()
+    assert message.response == "fake streamed response"
+    assert message.ref_dbt_docs
+    assert message.usage is not None
+    assert message.usage["total_tokens"] == (
+        message.usage["prompt_tokens"] + message.usage["completion_tokens"]
+    )
+
+    async def _run():
+        stream = await chat_bot.asuggest_table_stream("orders per customer")
+        deltas = [delta async for delta in stream]
+        return deltas, await stream.get_message()
+
+    deltas, message = asyncio.run(_run())
+    assert deltas == ["fake ", "async ", "response"]
+    assert message.response == "fake async response"
+
+
+def test_response_cache(monkeypatch):
+    monkeypatch.setattr("chatdbt.chat.Openai", FakeOpenai)
+    chat_bot = ChatBot(
+        LocalfsDBTDocResolver(MANIFEST_JSON_PATH, CATALOG_JSON_PATH),
+        FakeVectorStorage(),
+        None,
+        response_cache_config={"similarity_threshold": "0.99"},
+    )
+    chat_bot.index_dbt_docs()
+    openai = cast(FakeOpenai, chat_bot.openai)
+
+    assert chat_bot.suggest_sql("orders per customer").cache_hit is None
+    message = chat_bot.suggest_sql("orders per customer")
+    assert message.cache_hit == "exact"
+    assert message.response == "fake response"
+    assert message.usage is None
+    # fake embeddings of queries of similar lengths are similar
+    assert chat_bot.suggest_sql("orders per customers").cache_hit == "semantic"
+    assert chat_bot.suggest_sql("x").cache_hit is None
+    # the prompt differs between table and sql suggestions
+    assert chat_bot.suggest_table("orders per customer").cache_hit is None
+    assert len(openai.completion_calls) == 3
+
+    stream = chat_bot.suggest_sql_stream("orders per customer")
+    assert list(stream) == ["fake response"]
+    assert stream.get_message().cache_hit == "exact"
+
+    chat_bot.response_cache.invalidate(  # type: ignore
+        [doc.get_unique_id() for doc in message.ref_dbt_docs[:1]]
+    )
+    assert chat_bot.suggest_sql("orders per customer").cache_hit is None
+
+
+def test_memory_message_across_bots(tmpdir, monkeypatch):
+    monkeypatch.setattr("chatdbt.chat.Openai", FakeOpenai)
+    path = os.path.join(tmpdir, "messages.db")
+    storage = FakeVectorStorage()
+
+    def _bot() -> ChatBot:
+        return ChatBot(
+            LocalfsDBTDocResolver(MANIFEST_JSON_PATH, CATALOG_JSON_PATH),
+            storage,
+            None,
+            message_store=SqliteMessageStore(path),
+        )
+
+    _bot().index_dbt_docs()
+    message = _bot().suggest_sql("orders per customer")
+    _bot().memory_message_by_uuid(message.uuid)
+
+    chat_docs = [
+        meta for meta, _ in storage.rows.values() if meta.doc_type == DocType.CHAT
+    ]
+    assert len(chat_docs) == 1
+    assert chat_docs[0].meta["query"] == "orders per customer"
+    with pytest.raises(ValueError):
+        _bot().memory_message_by_uuid("unknown")
+
+
+def test_memory_flush_interval(chat_bot: ChatBot, monkeypatch):
+    chat_bot.index_dbt_docs()
+    storage = cast(FakeVectorStorage, chat_bot.vector_storage)
+    storage.flushes = 0
+    now = [1000.0]
+    monkeypatch.setattr("chatdbt.chat.time.monotonic", lambda: now[0])
+    chat_bot.flush_memory()
+    assert storage.flushes == 0  # nothing memorized yet
+
+    # messages memorized within the interval are flushed together
+    for query in ["orders per customer", "payments per order"]:
+        chat_bot.memory_message(chat_bot.suggest_sql(query))
+    asyncio.run(chat_bot.amemory_message(chat_bot.suggest_sql("customers")))
+    assert storage.flushes == 0
+    now[0] += chat_bot.memory_flush_interval_secs
+    chat_bot.memory_message(chat_bot.suggest_sql("first orders"))
+    assert storage.flushes == 1
+
+    chat_bot.memory_message(chat_bot.suggest_sql("last orders"))
+    chat_bot.flush_memory()
+    chat_bot.flush_memory()
+    assert storage.flushes == 2
+
+    # unflushed messages are flushed when the process exits
+    chat_bot.memory_message(chat_bot.suggest_sql("orders by status"))
+    _flush_memory_at_exit(weakref.ref(chat_bot))
+    assert storage.flushes == 3
+
+
+def test_suggest_many(chat_bot: ChatBot):
+    chat_bot.index_dbt_docs()
+    openai = cast(FakeOpenai, chat_bot.openai)
+    openai.embed_calls.clear()
+    queries = ["orders per customer", "boom", "payments per order"]
+
+    results = chat_bot.suggest_sql_many(queries, max_concurrency=2)
+    assert openai.embed_calls == [queries]
+    assert isinstance(results[1], RuntimeError)
+    messages = [results[0], results[2]]
+    assert [cast(ChatMessage, i).query for i in messages] == [queries[0], queries[2]]
+    assert all(cast(ChatMessage, i).response == "fake response" for i in messages)
+
+    results = asyncio.run(chat_bot.asuggest_table_many(queries))
+    assert isinstance(results[1], RuntimeError)
+    assert cast(ChatMessage, results[2]).response == "fake async response"
+
+
+def test_hybrid_retrieval(monkeypatch):
+    monkeypatch.setattr("chatdbt.chat.Openai", FakeOpenai)
+    chat_bot = ChatBot(
+        LocalfsDBTDocResolver(MANIFEST_JSON_PATH, CATALOG_JSON_PATH),
+        FakeVectorStorage(),
+        None,
+        retrieval_mode="hybrid",
+    )
+    chat_bot.index_dbt_docs()
+    openai = cast(FakeOpenai, chat_bot.openai)
+    openai.embed_calls.clear()
+
+    # the fake storage returns docs in insertion order, stg_payments is last
+    message = chat_bot.suggest_sql("stg_payments amount", k=2)
+    assert message.ref_dbt_docs[0].get_metadata().meta["name"] == (
+        "jaffle_shop.stg_payments"
+    )
+    assert openai.embed_calls == [["stg_payments amount"]]
+
+    chat_bot.lexical_skip_embedding = True
+    message = chat_bot.suggest_sql("stg_customers by first name", k=2)
+    assert message.ref_dbt_docs[0].get_metadata().meta["name"] == (
+        "jaffle_shop.stg_customers"
+    )
+    assert openai.embed_calls == [["stg_payments amount"]]
+
+    # orders, stg_orders and customers all match, the query is still embedded
+    chat_bot.suggest_sql("orders per customer", k=2)
+    assert openai.embed_calls[-1] == ["orders per customer"]
+
+
+def test_instrumentation(monkeypatch):
+    monkeypatch.setattr("chatdbt.chat.Openai", FakeOpenai)
+    spans: List[Span] = []
+
+    class _Callback(InstrumentationCallback):
+        def on_span(self, span: Span):
+            spans.append(span)
+
+    chat_bot = ChatBot(
+        LocalfsDBTDocResolver(MANIFEST_JSON_PATH, CATALOG_JSON_PATH),
+        FakeVectorStorage(),
+        None,
+        callbacks=[_Callback()],
+    )
+    chat_bot.index_dbt_docs()
+
+    message = chat_bot.suggest_sql("orders per customer")
+    stages = ["embed", "search", "resolve", "prompt", "completion"]
+    assert [i.stage for i in spans] == stages
+    assert spans[0].attributes == {"n_queries": 1, "cache_hits": 0}
+    assert spans[1].backend == "FakeVectorStorage"
+    assert spans[-1].attributes["tokens"] == FAKE_USAGE["total_tokens"]
+    assert list(message.timings) == stages
+    assert message.usage == FAKE_USAGE
+    assert message.cost == spans[-1].attributes["cost"]
+
+    spans.clear()
+    results = chat_bot.suggest_sql_many(["orders per customer", "boom"])
+    assert isinstance(results[1], RuntimeError)
+    # the batch embedding and search are reported once
+    embed_spans = [i for i in spans if i.stage == "embed"]
+    assert len(embed_spans) == 1
+    # the repeated query is not embedded again
+    assert embed_spans[0].attributes == {"n_queries": 2, "cache_hits": 1}
+    # completions run concurrently, in any order
+    assert sorted(str(i.error) for i in spans if i.stage == "completion") == [
+        "None",
+        "RuntimeError",
+    ]
+    assert list(cast(ChatMessage, results[0]).timings) == stages
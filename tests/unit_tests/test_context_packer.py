@@ -0,0 +1,87 @@
+from typing import List, Optional
+
+from chatdbt.context_packer import ContextPacker
+from chatdbt.model import (
+    CatalogColumn,
+    DBTModelDocument,
+    DocMetaContainer,
+    DocType,
+    TikTokenProvider,
+)
+
+
+def _tokens(content: str) -> int:
+    return len(content) // 4
+
+
+class FakeTikTokenProvider(TikTokenProvider):
+    """One token per 4 characters"""
+
+    def __init__(self) -> None:
+        self.calls: List[int] = []
+
+    def count_token(self, prompt: str, model: str) -> Optional[int]:
+        return _tokens(prompt)
+
+    def count_tokens(self, prompts: List[str], model: str) -> List[Optional[int]]:
+        self.calls.append(len(prompts))
+        return super().count_tokens(prompts, model)
+
+
+def _doc(name: str, n_columns: int) -> DBTModelDocument:
+    return DBTModelDocument(
+        name=name,
+        description=f"all the {name}",
+        columns=[
+            CatalogColumn(
+                name=f"column_{i}",
+                data_type="integer",
+                description=f"the {i}th column of {name}",
+            )
+            for i in range(n_columns)
+        ],
+        depends_on=["stg_orders"],
+        meta=DocMetaContainer(doc_type=DocType.MODEL, meta={"name": name}),
+    )
+
+
+def test_pack_within_budget():
+    provider = FakeTikTokenProvider()
+    docs = [_doc("orders", 3), _doc("customers", 3)]
+    packed = ContextPacker(provider, max_tokens=1000).pack(docs)
+
+    assert packed.docs == docs
+    assert packed.contents == [doc.get_content() for doc in docs]
+    assert packed.dropped_docs == []
+    assert packed.n_tokens == sum(_tokens(doc.get_content()) for doc in docs)
+    # compact renderings are only counted when over budget
+    assert provider.calls == [2]
+
+
+def test_pack_trims_before_dropping():
+    docs = [_doc("orders", 50), _doc("customers", 50), _doc("payments", 50)]
+    budget = _tokens(docs[0].get_content()) + sum(
+        _tokens(doc.get_compact_contents()[0]) for doc in docs[1:]
+    )
+
+    packed = ContextPacker(FakeTikTokenProvider(), max_tokens=budget).pack(docs)
+    assert packed.docs == docs
+    assert packed.dropped_docs == []
+    # the least relevant docs lose their column descriptions first
+    assert packed.contents == [
+        docs[0].get_content(),
+        *[doc.get_compact_contents()[0] for doc in docs[1:]],
+    ]
+
+    budget = sum(_tokens(doc.get_compact_contents()[-1]) for doc in docs[:2])
+    packed = ContextPacker(FakeTikTokenProvider(), max_tokens=budget).pack(docs)
+    assert packed.docs == docs[:2]
+    assert packed.dropped_docs == docs[2:]
+    assert packed.contents == [doc.get_compact_contents()[-1] for doc in docs[:2]]
+    assert packed.n_tokens == budget
+
+
+def test_pack_estimates_without_provider():
+    packed = ContextPacker(None, max_tokens=0).pack([_doc("orders", 1)])
+    assert packed.docs == []
+    assert packed.n_tokens == 0
@@ -0,0 +1,68 @@
+from chatdbt.lexical_index import BM25Index, tokenize
+
+
+def _index() -> BM25Index:
+    index = BM25Index()
+    index.add("shop.fct_orders", "one row per order", ["order_id", "amount"])
+    index.add("shop.customers", "customers and their orders", ["customer_id"])
+    index.add("shop.payments", "payments of orders", ["payment_id", "amount"])
+    return index
+
+
+def test_tokenize():
+    assert tokenize("Revenue of `fct_orders`") == [
+        "revenue",
+        "of",
+        "fct_orders",
+        "fct",
+        "orders",
+    ]
+    assert tokenize(None) == []
+
+
+def test_search_ranks_named_models_first():
+    index = _index()
+
+    hits = index.search("fct_orders revenue by day", 3)
+    assert hits[0].name == "shop.fct_orders"
+    assert hits[0].exact
+    assert not any(i.exact for i in hits[1:])
+
+    assert [i.name for i in index.search("payment amount", 2)] == [
+        "shop.payments",
+        "shop.fct_orders",
+    ]
+    assert index.search("unrelated", 3) == []
+
+
+def test_remove_and_replace():
+    index = _index()
+    index.remove("shop.fct_orders")
+    assert "shop.fct_orders" not in [i.name for i in index.search("fct_orders", 3)]
+
+    index.add("shop.customers", "buyers", ["buyer_id"])
+    assert index.search("customer", 3) == []
+    assert [i.name for i in index.search("buyer", 3)] == ["shop.customers"]
+    assert len(index) == 2
+
+
+def test_unambiguous_hits():
+    index = _index()
+    index.add("shop.orders", "orders placed in the shop", ["order_id"])
+
+    hits = index.search("fct_orders revenue by day", 3)
+    assert hits[0].unambiguous
+    assert not any(i.unambiguous for i in hits[1:])
+
+    # several models are about orders, naming one of them is not enough
+    hits = index.search("orders", 3)
+    assert hits[0].name == "shop.orders"
+    assert hits[0].exact
+    assert not any(i.unambiguous for i in hits)
+
+    # unless the query names it by its full name
+    hits = index.search("monthly count of shop.orders", 3)
+    assert hits[0].name == "shop.orders"
+    assert hits[0].unambiguous
+
+    assert not any(i.unambiguous for i in index.search("payment amount", 3))
@@ -0,0 +1,25 @@
+import time
+
+from chatdbt.lru_cache import LRUCache
+
+
+def test_evicts_least_recently_used():
+    cache: LRUCache[int] = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_expires_after_ttl():
+    cache: LRUCache[int] = LRUCache(max_entries=2, ttl_secs=0.01)
+    cache.put("a", 1)
+    time.sleep(0.02)
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
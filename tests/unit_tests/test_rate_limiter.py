@@ -0,0 +1,24 @@
+import pytest
+
+from chatdbt.rate_limiter import RateLimiter
+
+
+def test_unlimited():
+    limiter = RateLimiter()
+    for _ in range(1000):
+        assert limiter._reserve(10000) == 0
+
+
+def test_waits_for_tokens():
+    limiter = RateLimiter(tokens_per_minute=600)
+    assert limiter._reserve(600) == 0
+    # 300 tokens refill in 30 seconds
+    assert limiter._reserve(300) == pytest.approx(30, abs=0.1)
+
+
+def test_waits_for_requests():
+    limiter = RateLimiter(requests_per_minute=60)
+    for _ in range(60):
+        assert limiter._reserve(0) == 0
+    assert limiter._reserve(0) == pytest.approx(1, abs=0.1)
+    assert limiter._reserve(0) == pytest.approx(2, abs=0.1)
@@ -0,0 +1,48 @@
+import time
+
+from chatdbt.response_cache import CachedResponse, ResponseCache
+
+
+def _messages(query: str):
+    return [
+        {"role": "system", "content": "related tables: orders"},
+        {"role": "user", "content": query},
+    ]
+
+
+def test_exact_and_semantic_tiers():
+    cache = ResponseCache(similarity_threshold=0.9)
+    cached = CachedResponse("select 1", frozenset(["model.orders"]))
+    cache.put(_messages("orders"), "context", [1.0, 0.0], cached)
+
+    assert cache.get(_messages("orders"), "context", [1.0, 0.0]) == (cached, "exact")
+    assert cache.get(_messages("all orders"), "context", [0.99, 0.1]) == (
+        cached,
+        "semantic",
+    )
+    assert cache.get(_messages("customers"), "context", [0.0, 1.0]) is None
+    # the same query over other docs
+    assert cache.get(_messages("all orders"), "other", [0.99, 0.1]) is None
+
+
+def test_invalidate_and_expire():
+    cache = ResponseCache(ttl_secs=0.05)
+    cache.put(
+        _messages("orders"),
+        "context",
+        [1.0, 0.0],
+        CachedResponse("select 1", frozenset(["model.orders"])),
+    )
+    cache.put(
+        _messages("customers"),
+        "context",
+        [0.0, 1.0],
+        CachedResponse("select 2", frozenset(["model.customers"])),
+    )
+
+    cache.invalidate(["model.orders"])
+    assert cache.get(_messages("orders"), "context", [1.0, 0.0]) is None
+    assert cache.get(_messages("customers"), "context", [0.0, 1.0]) is not None
+
+    time.sleep(0.1)
+    assert cache.get(_messages("customers"), "context", [0.0, 1.0]) is None
@@ -0,0 +1,56 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, Set, Tuple
+
+import pytest
+
+from chatdbt.tiktoken_provider.tiktoken_http_server import TikTokenHttpServerProvider
+
+
+class _TokenizeHandler(BaseHTTPRequestHandler):
+    """Stand-in for tiktoken-http-server, one token per whitespace separated word"""
+
+    protocol_version = "HTTP/1.1"
+    connections: Set[Tuple[str, int]] = set()
+
+    def do_GET(self):
+        self.connections.add(self.client_address)
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if body["prompt"] == "fail":
+            status, payload = 500, b"boom"
+        else:
+            status = 200
+            payload = json.dumps({"tokens": body["prompt"].split()}).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture()
+def api_base() -> Iterator[str]:
+    _TokenizeHandler.connections = set()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _TokenizeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+
+def test_count_token(api_base: str):
+    provider = TikTokenHttpServerProvider(api_base)
+    assert provider.count_token("select * from orders", "gpt-3.5-turbo") == 4
+    assert provider.count_token("fail", "gpt-3.5-turbo") is None
+
+
+def test_count_tokens_reuses_connections(api_base: str):
+    provider = TikTokenHttpServerProvider(api_base, max_workers=2)
+    prompts = [" ".join(["word"] * i) for i in range(50)] + ["fail"]
+
+    assert provider.count_tokens(prompts, "gpt-3.5-turbo") == [*range(50), None]
+    assert len(_TokenizeHandler.connections) <= 2
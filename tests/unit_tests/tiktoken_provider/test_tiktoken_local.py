@@ -0,0 +1,55 @@
+import base64
+import os
+
+import pytest
+
+pytest.importorskip("tiktoken")
+
+from chatdbt.tiktoken_provider.tiktoken_local import TikTokenLocalProvider  # noqa: E402
+
+
+@pytest.fixture()
+def encoding_dir(tmpdir) -> str:
+    # a byte-level encoding without merges, every byte is one token
+    with open(os.path.join(tmpdir, "cl100k_base.tiktoken"), "wb") as f:
+        for rank in range(256):
+            f.write(base64.b64encode(bytes([rank])) + b" " + str(rank).encode() + b"\n")
+    return str(tmpdir)
+
+
+def test_count_token_from_local_encoding(encoding_dir: str):
+    provider = TikTokenLocalProvider(encoding_dir=encoding_dir)
+    assert provider.count_token("hello world", "text-embedding-ada-002") == 11
+    assert provider.count_token("hello world", "gpt-3.5-turbo") == 11
+
+
+def test_count_token_is_memoized(encoding_dir: str):
+    provider = TikTokenLocalProvider(encoding_dir=encoding_dir)
+    provider.count_token("hello", "text-embedding-ada-002")
+    provider._encodings.clear()
+    provider._encodings["cl100k_base"] = None
+
+    # served from the memo without touching the encoding
+    assert provider.count_token("hello", "text-embedding-ada-002") == 5
+
+
+def test_count_token_unknown_model(encoding_dir: str):
+    provider = TikTokenLocalProvider(encoding_dir=encoding_dir)
+    assert provider.count_token("hello", "no-such-model") is None
+
+
+def test_local_encoding_matches_tiktoken(encoding_dir: str):
+    from tiktoken_ext import openai_public
+
+    provider = TikTokenLocalProvider(encoding_dir=encoding_dir)
+    encoding = provider._get_encoding("cl100k_base")
+    spec = openai_public.ENCODING_CONSTRUCTORS["cl100k_base"].__code__.co_consts
+    # the pattern of the installed tiktoken, never downloaded
+    assert encoding._pat_str in spec
+    assert encoding._special_tokens["<|endoftext|>"] == 100257
+    assert encoding.n_vocab == 100277
+
+    with pytest.raises(ValueError):
+        provider._get_encoding("gpt2")
+    with pytest.raises(ValueError):
+        provider._get_encoding("no_such_encoding")
@@ -0,0 +1,126 @@
+import contextlib
+import sys
+import types
+from typing import Any, Dict, List
+
+import pytest
+
+from chatdbt.model import DBTModelDocument, DocMetaContainer, DocType
+from chatdbt.vector_storage.atlas import AtlasVectorStorage
+
+
+class _FakeProjection:
+    def __init__(self, project: "_FakeAtlasProject") -> None:
+        self.project = project
+
+    def vector_search(self, queries: List[List[float]], k: int):
+        # nearest first by dot product, distances are 1 - score
+        neighbors, distances = [], []
+        for query in queries:
+            scored = sorted(
+                (
+                    (sum(a * b for a, b in zip(query, vector)), idx)
+                    for idx, vector in enumerate(self.project.embeddings)
+                ),
+                reverse=True,
+            )[:k]
+            neighbors.append([str(idx) for _, idx in scored])
+            distances.append([1 - score for score, _ in scored])
+        return neighbors, distances
+
+
+class _FakeAtlasProject:
+    def __init__(self, **kwargs: Any) -> None:
+        self.data: List[Dict[str, Any]] = []
+        self.embeddings: List[List[float]] = []
+        self.add_calls: List[int] = []
+        self.lock_waits = 0
+        self.projections = [_FakeProjection(self)]
+
+    @contextlib.contextmanager
+    def wait_for_project_lock(self):
+        self.lock_waits += 1
+        yield
+
+    def add_embeddings(self, data: List[Dict[str, Any]], embeddings: List[List[float]]):
+        self.add_calls.append(len(data))
+        self.data.extend(data)
+        self.embeddings.extend(embeddings)
+
+    def get_data(self, ids: List[str]) -> List[Dict[str, Any]]:
+        return [self.data[int(i)] for i in ids]
+
+
+@pytest.fixture(autouse=True)
+def fake_nomic(monkeypatch):
+    monkeypatch.setitem(
+        sys.modules, "nomic", types.SimpleNamespace(AtlasProject=_FakeAtlasProject)
+    )
+
+
+def _doc(name: str) -> DBTModelDocument:
+    return DBTModelDocument(
+        name=name,
+        description="",
+        columns=[],
+        depends_on=[],
+        meta=DocMetaContainer(doc_type=DocType.MODEL, meta={"name": name}),
+    )
+
+
+def test_buffered_writes():
+    storage = AtlasVectorStorage("key", "project", flush_batch_size=3)
+    project = storage.project
+
+    storage.insert_docs([_doc("orders"), _doc("customers")], [[1, 0], [0, 1]])
+    assert project.add_calls == []
+
+    storage.insert_docs([_doc(f"model_{i}") for i in range(5)], [[1, 1]] * 5)
+    assert project.add_calls == [3, 3, 1]
+    assert project.lock_waits == 1
+
+    storage.flush()
+    assert project.lock_waits == 1
+
+
+def test_failed_flush_keeps_unwritten_docs():
+    storage = AtlasVectorStorage("key", "project", flush_batch_size=2)
+    project = storage.project
+    add_embeddings = project.add_embeddings
+
+    def _fail_second_batch(data, embeddings):
+        if len(project.add_calls) == 1:
+            project.add_calls.append(0)
+            raise ConnectionError()
+        add_embeddings(data, embeddings)
+
+    project.add_embeddings = _fail_second_batch
+    with pytest.raises(ConnectionError):
+        storage.insert_docs([_doc(f"model_{i}") for i in range(3)], [[1, 1]] * 3)
+    assert [i["meta"]["name"] for i in project.data] == ["model_0", "model_1"]
+
+    storage.insert_doc(_doc("orders"), [1, 0])
+    storage.flush()
+    assert [i["meta"]["name"] for i in project.data] == [
+        "model_0",
+        "model_1",
+        "model_2",
+        "orders",
+    ]
+
+
+def test_search_maps_every_neighbor():
+    storage = AtlasVectorStorage("key", "project")
+    storage.insert_docs(
+        [_doc("orders"), _doc("customers"), _doc("payments")],
+        [[1.0, 0.0], [0.0, 1.0], [0.8, 0.2]],
+    )
+    storage.flush()
+
+    assert [i.meta["name"] for i in storage.similarity_search([1.0, 0.0], 2)] == [
+        "orders",
+        "payments",
+    ]
+    results = storage.search([1.0, 0.0], 3, min_similarity=0.5)
+    assert [i.meta.meta["name"] for i in results] == ["orders", "payments"]
+    assert results[1].similarity == pytest.approx(0.8)
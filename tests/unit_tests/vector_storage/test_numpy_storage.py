@@ -0,0 +1,206 @@
+import json
+import os
+from typing import List, Tuple
+
+import numpy as np
+import pytest
+
+from chatdbt.model import DBTModelDocument, DocMetaContainer, DocType
+from chatdbt.vector_storage.numpy_storage import NumpyVectorStorage
+
+
+def _doc(
+    name: str, description: str = "", doc_type: DocType = DocType.MODEL
+) -> DBTModelDocument:
+    return DBTModelDocument(
+        name=name,
+        description=description,
+        columns=[],
+        depends_on=[],
+        meta=DocMetaContainer(doc_type=doc_type, meta={"name": name}),
+    )
+
+
+def _names(metas):
+    return [i.meta["name"] for i in metas]
+
+
+def test_similarity_search():
+    storage = NumpyVectorStorage()
+    storage.insert_docs(
+        [_doc("orders"), _doc("customers"), _doc("payments")],
+        [[1.0, 0.0, 0.0], [0.0, 2.0, 0.0], [0.7, 0.7, 0.0]],
+    )
+
+    assert _names(storage.similarity_search([1.0, 0.1, 0.0], 2)) == [
+        "orders",
+        "payments",
+    ]
+    assert _names(storage.similarity_search([0.0, 1.0, 0.0], 10)) == [
+        "customers",
+        "payments",
+        "orders",
+    ]
+
+
+def test_search_filters_and_scores():
+    storage = NumpyVectorStorage()
+    storage.insert_docs(
+        [_doc("orders"), _doc("customers"), _doc("orders_sql", doc_type=DocType.SQL)],
+        [[1.0, 0.0], [0.0, 1.0], [1.0, 0.1]],
+    )
+
+    results = storage.search([1.0, 0.0], 3, min_similarity=0.5)
+    assert _names(i.meta for i in results) == ["orders", "orders_sql"]
+    assert results[0].similarity == pytest.approx(1.0)
+
+    results = storage.search([1.0, 0.0], 3, doc_types=[DocType.MODEL])
+    assert _names(i.meta for i in results) == ["orders", "customers"]
+    assert results[1].similarity == pytest.approx(0.0)
+
+    assert storage.search([0.0, 1.0], 3, [DocType.SQL], min_similarity=0.5) == []
+
+
+def test_search_many_matches_search():
+    storage = NumpyVectorStorage()
+    storage.insert_docs(
+        [_doc("orders"), _doc("customers"), _doc("orders_sql", doc_type=DocType.SQL)],
+        [[1.0, 0.0], [0.0, 1.0], [1.0, 0.1]],
+    )
+    vectors = [[1.0, 0.0], [0.0, 3.0], [0.0, 0.0]]
+
+    for kwargs in [{}, {"min_similarity": 0.5}, {"doc_types": [DocType.MODEL]}]:
+        assert storage.search_many(vectors, 2, **kwargs) == [
+            storage.search(vector, 2, **kwargs) for vector in vectors
+        ]
+    assert storage.search_many([], 2) == []
+
+
+def test_upsert_and_delete():
+    storage = NumpyVectorStorage()
+    storage.insert_docs([_doc("orders"), _doc("customers")], [[1, 0], [0, 1]])
+    storage.insert_doc(_doc("orders", "changed"), [0, 1])
+    assert storage.list_content_hashes([DocType.MODEL]) == {
+        "orders": _doc("orders", "changed").get_content_hash(),
+        "customers": _doc("customers").get_content_hash(),
+    }
+
+    storage.delete_docs(["customers"])
+    assert _names(storage.similarity_search([0, 1], 5)) == ["orders"]
+    assert list(storage.list_metas([DocType.MODEL])) == ["orders"]
+    assert storage.list_metas([DocType.CHAT]) == {}
+
+
+def test_persist_and_memory_map(tmpdir):
+    path = os.path.join(tmpdir, "index")
+    storage = NumpyVectorStorage(path)
+    storage.insert_docs([_doc("orders"), _doc("customers")], [[3, 4], [0, 1]])
+    storage.flush()
+
+    reloaded = NumpyVectorStorage(path)
+    assert isinstance(reloaded._matrix, np.memmap)
+    assert _names(reloaded.similarity_search([0, 1], 1)) == ["customers"]
+
+    reloaded.insert_doc(_doc("payments"), [-1, 0])
+    reloaded.flush()
+    assert _names(NumpyVectorStorage(path).similarity_search([-1, 0], 1)) == [
+        "payments"
+    ]
+
+
+def test_writes_are_saved_on_flush(tmpdir):
+    path = os.path.join(tmpdir, "index")
+    storage = NumpyVectorStorage(path)
+    storage.insert_docs([_doc("orders")], [[1, 0]])
+    storage.insert_docs([_doc("customers")], [[0, 1]])
+    assert not os.path.exists(f"{path}.json")
+
+    storage.flush()
+    assert len(NumpyVectorStorage(path)) == 2
+
+    storage.delete_docs(["orders"])
+    assert len(NumpyVectorStorage(path)) == 2
+    storage.flush()
+    assert len(NumpyVectorStorage(path)) == 1
+
+
+def test_flush_without_autosave(tmpdir):
+    path = os.path.join(tmpdir, "index")
+    storage = NumpyVectorStorage(path, autosave=False)
+    storage.insert_docs([_doc("orders")], [[1, 0]])
+    storage.flush()
+    assert not os.path.exists(f"{path}.json")
+
+    storage.save()
+    assert len(NumpyVectorStorage(path)) == 1
+
+
+def test_save_switches_matrix_and_metadata_at_once(tmpdir, monkeypatch):
+    path = os.path.join(tmpdir, "index")
+    storage = NumpyVectorStorage(path)
+    storage.insert_docs([_doc("orders"), _doc("customers")], [[1, 0], [0, 1]])
+    storage.flush()
+    storage.insert_docs([_doc("payments")], [[-1, 0]])
+    storage.flush()
+    # only the matrix of the last save is kept
+    assert set(os.listdir(tmpdir)) == {
+        "index.json",
+        f"index.{storage._matrix_version}.npy",
+    }
+
+    # a save which crashes before replacing the metadata changes nothing
+    storage.delete_docs(["orders"])
+    monkeypatch.setattr("os.replace", _crash_after(0))
+    with pytest.raises(_Crash):
+        storage.flush()
+    assert _names(NumpyVectorStorage(path).similarity_search([1, 0], 1)) == ["orders"]
+
+    # a save is complete once one file is replaced
+    monkeypatch.setattr("os.replace", _crash_after(1))
+    storage.flush()
+    monkeypatch.undo()
+    reloaded = NumpyVectorStorage(path)
+    assert _names(reloaded.similarity_search([0, 1], 3)) == ["customers", "payments"]
+    assert _names(reloaded.similarity_search([-1, 0], 1)) == ["payments"]
+    assert len(os.listdir(tmpdir)) == 2
+
+
+_os_replace = os.replace
+
+
+class _Crash(BaseException):
+    pass
+
+
+def _crash_after(n_replaces: int):
+    """os.replace which crashes the process after `n_replaces` calls"""
+    calls: List[Tuple[str, str]] = []
+
+    def _replace(*args):
+        if len(calls) == n_replaces:
+            raise _Crash()
+        calls.append(args)
+        _os_replace(*args)
+
+    return _replace
+
+
+def test_load_unversioned_files(tmpdir):
+    path = os.path.join(tmpdir, "index")
+    storage = NumpyVectorStorage(path)
+    storage.insert_docs([_doc("orders")], [[1, 0]])
+    storage.flush()
+    # files saved before matrices were versioned
+    os.rename(storage._matrix_path(storage._matrix_version), f"{path}.npy")
+    with open(f"{path}.json", "r", encoding="utf8") as f:
+        metadata = json.load(f)
+    del metadata["matrix_version"]
+    with open(f"{path}.json", "w", encoding="utf8") as f:
+        json.dump(metadata, f)
+
+    reloaded = NumpyVectorStorage(path)
+    assert len(reloaded) == 1
+    reloaded.insert_doc(_doc("customers"), [0, 1])
+    reloaded.flush()
+    assert not os.path.exists(f"{path}.npy")
+    assert len(NumpyVectorStorage(path)) == 2
@@ -0,0 +1,254 @@
+import itertools
+import sys
+import types
+from typing import Any, Dict, List
+
+import pytest
+
+pytest.importorskip("pgvector")
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy.dialects import postgresql  # noqa: E402
+
+from chatdbt.model import DocType  # noqa: E402
+from chatdbt.vector_storage import get_vector_storage, pgvector  # noqa: E402
+from chatdbt.vector_storage.pgvector import PGVectorStorage  # noqa: E402
+
+# every storage declares its own table on the shared declarative base
+_table_ids = itertools.count()
+pytestmark = pytest.mark.filterwarnings(
+    "ignore:This declarative base already contains a class"
+)
+
+
+class _FakeResult:
+    def all(self) -> List[Any]:
+        return []
+
+
+class _FakeConnection:
+    def __init__(self, engine: "_FakeEngine") -> None:
+        self.engine = engine
+
+    def __enter__(self) -> "_FakeConnection":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        pass
+
+    def execution_options(self, **options: Any) -> "_FakeConnection":
+        self.engine.execution_options.update(options)
+        return self
+
+    def execute(self, stmt: Any) -> _FakeResult:
+        self.engine.statements.append(str(stmt))
+        return _FakeResult()
+
+    def commit(self) -> None:
+        pass
+
+
+class _FakeEngine:
+    """Records the statements it is asked to execute"""
+
+    def __init__(self, url: str, **options: Any) -> None:
+        self.url = url
+        self.options = options
+        self.dialect = postgresql.dialect()
+        self.statements: List[str] = []
+        self.execution_options: Dict[str, Any] = {}
+
+    def begin(self) -> _FakeConnection:
+        return _FakeConnection(self)
+
+    def connect(self) -> _FakeConnection:
+        return _FakeConnection(self)
+
+
+@pytest.fixture()
+def make_storage(monkeypatch):
+    monkeypatch.setattr(pgvector, "create_engine", _FakeEngine)
+    monkeypatch.setattr(pgvector.Base.metadata, "create_all", lambda bind: None)
+
+    def _make_storage(**kwargs: Any) -> PGVectorStorage:
+        table_name = f"chatdbt_{next(_table_ids)}"
+        storage = PGVectorStorage("postgresql+psycopg://", table_name, **kwargs)
+        storage._session = lambda: _FakeConnection(storage._engine)  # type: ignore
+        return storage
+
+    return _make_storage
+
+
+def _statements(storage: PGVectorStorage) -> List[str]:
+    return storage._engine.statements  # type: ignore
+
+
+def test_no_index_by_default(make_storage):
+    storage = make_storage()
+    assert not [i for i in _statements(storage) if i.startswith("CREATE INDEX")]
+
+    storage.rebuild_index()
+    assert not [i for i in _statements(storage) if i.startswith("REINDEX")]
+
+
+def test_ivfflat_index(make_storage):
+    storage = make_storage(index_type="ivfflat", distance="l2", ivfflat_lists="50")
+    table_name = storage.table_name
+
+    assert _statements(storage)[-1] == (
+        f"CREATE INDEX IF NOT EXISTS {table_name}_embedding_ivfflat_l2_idx "
+        f"ON {table_name} USING ivfflat (embedding vector_l2_ops) WITH (lists = 50)"
+    )
+
+
+def test_hnsw_index(make_storage):
+    storage = make_storage(index_type="hnsw", hnsw_m="8", hnsw_ef_construction="32")
+    table_name = storage.table_name
+
+    assert _statements(storage)[-1] == (
+        f"CREATE INDEX IF NOT EXISTS {table_name}_embedding_hnsw_cosine_idx "
+        f"ON {table_name} USING hnsw (embedding vector_cosine_ops) "
+        "WITH (m = 8, ef_construction = 32)"
+    )
+
+
+def test_unknown_index_type(make_storage):
+    with pytest.raises(ValueError):
+        make_storage(index_type="lsh")
+
+
+def test_search_settings(make_storage):
+    storage = make_storage(index_type="ivfflat", ivfflat_probes="10")
+    storage.search([0.0] * 1536, 3)
+    assert _statements(storage)[-2] == "SET LOCAL ivfflat.probes = 10"
+
+    storage = make_storage(index_type="hnsw", hnsw_ef_search="80")
+    storage.search_many([[0.0] * 1536], 3)
+    assert _statements(storage)[-2] == "SET LOCAL hnsw.ef_search = 80"
+
+    storage = make_storage()
+    storage.search([0.0] * 1536, 3)
+    assert not [i for i in _statements(storage) if i.startswith("SET LOCAL")]
+
+
+@pytest.mark.parametrize(
+    "distance, operator, min_similarity, max_distance",
+    [
+        ("cosine", "<=>", 0.8, pytest.approx(0.2)),
+        ("cosine", "<=>", 0, 1.0),
+        ("l2", "<->", -0.5, 0.5),
+        ("inner_product", "<#>", 0.3, -0.3),
+    ],
+)
+def test_search_filters_in_postgres(
+    make_storage, distance, operator, min_similarity, max_distance
+):
+    storage = make_storage(distance=distance)
+    compiled = storage._search_stmt(
+        [0.0] * 1536, 3, [DocType.MODEL], min_similarity
+    ).compile(dialect=postgresql.dialect())
+    table_name = storage.table_name
+
+    assert (
+        f"WHERE {table_name}.doc_type IN (__[POSTCOMPILE_doc_type_1]) "
+        f"AND ({table_name}.embedding {operator} %(embedding_1)s) <= %(param_1)s "
+    ) in str(compiled)
+    assert compiled.params["doc_type_1"] == ["model"]
+    assert compiled.params["param_1"] == max_distance
+    # a hit exactly at the threshold is kept
+    assert storage._similarity(compiled.params["param_1"]) == pytest.approx(
+        min_similarity
+    )
+
+
+def test_search_without_filters(make_storage):
+    storage = make_storage()
+    sql = str(
+        storage._search_stmt([0.0] * 1536, 3).compile(dialect=postgresql.dialect())
+    )
+    assert "WHERE" not in sql
+
+
+def test_list_metas_filters_in_postgres(make_storage):
+    storage = make_storage()
+    assert storage.list_metas([DocType.CHAT]) == {}
+
+    # only the metadata of chat docs is read, never the embeddings
+    table_name = storage.table_name
+    assert _statements(storage)[-1] == (
+        f"SELECT {table_name}.unique_id, {table_name}.data_metadata \n"
+        f"FROM {table_name} \n"
+        f"WHERE {table_name}.doc_type IN (__[POSTCOMPILE_doc_type_1])"
+    )
+
+
+def test_rebuild_index(make_storage):
+    storage = make_storage(index_type="hnsw")
+    index_name = f"{storage.table_name}_embedding_hnsw_cosine_idx"
+
+    storage.rebuild_index()
+    assert _statements(storage)[-2:] == [
+        f"REINDEX INDEX CONCURRENTLY {index_name}",
+        f"ANALYZE {storage.table_name}",
+    ]
+    assert storage._engine.execution_options == {  # type: ignore
+        "isolation_level": "AUTOCOMMIT"
+    }
+
+    storage.rebuild_index(concurrently=False)
+    assert _statements(storage)[-2] == f"REINDEX INDEX {index_name}"
+
+
+def test_pool_options(make_storage):
+    storage = make_storage(
+        pool_size=5, max_overflow=2, pool_recycle=600, pool_pre_ping=False
+    )
+    assert storage._engine.options == {  # type: ignore
+        "pool_size": 5,
+        "max_overflow": 2,
+        "pool_timeout": 30.0,
+        "pool_recycle": 600,
+        "pool_pre_ping": False,
+    }
+
+
+def test_pool_options_from_env_config(make_storage, monkeypatch):
+    # values of CHATDBT_VECTOR_STORAGE_CONFIG_* env vars are strings
+    storage = get_vector_storage(
+        "pgvector",
+        {
+            "connect_string": "postgresql+psycopg://",
+            "table_name": f"chatdbt_{next(_table_ids)}",
+            "pool_size": "3",
+            "max_overflow": "0",
+            "pool_timeout": "5",
+            "pool_recycle": "120",
+            "pool_pre_ping": "false",
+        },
+    )
+    options = {
+        "pool_size": 3,
+        "max_overflow": 0,
+        "pool_timeout": 5.0,
+        "pool_recycle": 120,
+        "pool_pre_ping": False,
+    }
+    assert storage._engine.options == options  # type: ignore
+
+    # the async engine is created lazily, with the same pool options
+    async_engines: List[_FakeEngine] = []
+
+    def _create_async_engine(url: str, **kwargs: Any) -> _FakeEngine:
+        async_engines.append(_FakeEngine(url, **kwargs))
+        return async_engines[-1]
+
+    monkeypatch.setitem(
+        sys.modules,
+        "sqlalchemy.ext.asyncio",
+        types.SimpleNamespace(create_async_engine=_create_async_engine),
+    )
+    assert isinstance(storage, PGVectorStorage)
+    assert storage._get_async_engine() is storage._get_async_engine()
+    assert len(async_engines) == 1
+    assert async_engines[0].url == "postgresql+psycopg://"
+    assert async_engines[0].options == options
@@ -0,0 +1,99 @@
+from typing import Iterator, List
+
+import pytest
+
+from chatdbt.model import (
+    DBTModelDocument,
+    DocMetaContainer,
+    DocType,
+    VectorRecord,
+    VectorStorage,
+)
+from chatdbt.vector_storage import get_vector_storage
+from chatdbt.vector_storage.numpy_storage import NumpyVectorStorage
+from chatdbt.vector_storage.replica import ReplicaVectorStorage
+
+
+def _doc(name: str) -> DBTModelDocument:
+    return DBTModelDocument(
+        name=name,
+        description=None,
+        columns=[],
+        depends_on=[],
+        meta=DocMetaContainer(doc_type=DocType.MODEL, meta={"name": name}),
+    )
+
+
+def _names(metas):
+    return [i.meta["name"] for i in metas]
+
+
+def test_replica_serves_remote_vectors():
+    remote = NumpyVectorStorage()
+    remote.insert_docs([_doc("orders"), _doc("customers")], [[1, 0], [0, 1]])
+    replica = ReplicaVectorStorage(remote)
+
+    assert _names(replica.similarity_search([0, 1], 1)) == ["customers"]
+
+    # writes pass through to the remote storage and show up locally right away
+    replica.insert_doc(_doc("payments"), [-1, 0])
+    assert _names(remote.similarity_search([-1, 0], 1)) == ["payments"]
+    assert _names(replica.similarity_search([-1, 0], 1)) == ["payments"]
+
+    # changes made to the remote storage directly need a refresh
+    remote.delete_docs(["orders"])
+    assert _names(replica.similarity_search([1, 0], 1)) == ["orders"]
+    replica.refresh()
+    assert "orders" not in _names(replica.similarity_search([1, 0], 3))
+
+
+class _RefreshingRemote(NumpyVectorStorage):
+    """Writes to the replica while the replica lists its records"""
+
+    replica: ReplicaVectorStorage
+
+    def list_records(self) -> Iterator[VectorRecord]:
+        records = list(super().list_records())
+        if hasattr(self, "replica"):
+            self.replica.insert_doc(_doc("payments"), [-1, 0])
+        return iter(records)
+
+
+def test_writes_during_refresh_are_replayed():
+    remote = _RefreshingRemote()
+    remote.insert_docs([_doc("orders")], [[1, 0]])
+    replica = ReplicaVectorStorage(remote)
+    remote.replica = replica
+
+    replica.refresh()
+
+    assert _names(replica.similarity_search([-1, 0], 1)) == ["payments"]
+    assert len(replica._local) == 2
+
+
+class _UnlistableStorage(VectorStorage):
+    def similarity_search(self, vector: List[float], k: int):
+        return []
+
+    def insert_doc(self, doc, vector: List[float]):
+        pass
+
+
+def test_unlistable_remote_is_rejected():
+    with pytest.raises(ValueError, match="cannot be replicated"):
+        ReplicaVectorStorage(_UnlistableStorage())
+
+
+def test_get_replica_vector_storage(tmpdir):
+    path = str(tmpdir.join("index"))
+    remote = NumpyVectorStorage(path)
+    remote.insert_doc(_doc("orders"), [1, 0])
+    remote.flush()
+
+    storage = get_vector_storage(
+        "replica", {"remote_type": "numpy", "path": path, "refresh_interval_secs": "60"}
+    )
+
+    assert isinstance(storage, ReplicaVectorStorage)
+    assert _names(storage.similarity_search([1, 0], 1)) == ["orders"]
+    storage.close()